@@ -1,6 +1,9 @@
 import logging
 
-from app.tests import test_data
+from sqlalchemy import create_engine
+
+from app.admin import backfill, discharge_tracker, event_summary, replication
+from app.initialise import _reset_db, _generate
 
 
 def execute(application, command):
@@ -8,7 +11,129 @@ def execute(application, command):
         return _reset_db(application)
     elif command.lower().strip() == 'generate':
         return _generate(application)
+    elif command.lower().strip() == 'reindex_search':
+        return _reindex_search(application)
+    elif command.lower().strip() == 'backfill_dob_year':
+        return _backfill_dob_year(application)
+    elif command.lower().strip() == 'rebuild_phones':
+        return _rebuild_phones(application)
+    elif command.lower().strip() == 'check_tracker':
+        return _check_tracker(application)
+    elif command.lower().strip() == 'rebuild_tracker':
+        return _rebuild_tracker(application)
+    elif command.lower().strip() == 'check_summary':
+        return _check_summary(application)
+    elif command.lower().strip() == 'rebuild_summary':
+        return _rebuild_summary(application)
+    elif command.lower().strip() == 'export_replication':
+        return _export_replication(application)
+    elif command.lower().strip() == 'forward_replication':
+        return _forward_replication(application)
     else:
         return "No such command."
 
 
+def _reindex_search(application):
+    session = application.db.session
+    try:
+        application.search_backend.rebuild(session)
+        session.commit()
+        logging.info('Rebuilt patient search index using {}.'.format(type(application.search_backend).__name__))
+    except Exception as e:
+        session.rollback()
+        raise e
+
+    return "Done"
+
+
+def _backfill_dob_year(application):
+    session = application.db.session
+    try:
+        count = backfill.dob_years(session)
+        session.commit()
+        logging.info('Set the birth year of {} patients.'.format(count))
+    except Exception as e:
+        session.rollback()
+        raise e
+
+    return 'Set the birth year of {} patients\nDone'.format(count)
+
+
+def _rebuild_phones(application):
+    session = application.db.session
+    try:
+        count = backfill.phones(session)
+        session.commit()
+        logging.info('Rebuilt {} patient phone numbers.'.format(count))
+    except Exception as e:
+        session.rollback()
+        raise e
+
+    return 'Rebuilt {} phone numbers\nDone'.format(count)
+
+
+def _check_tracker(application):
+    diff = discharge_tracker.check(application.db.session)
+    return discharge_tracker.format_diff(diff)
+
+
+def _rebuild_tracker(application):
+    session = application.db.session
+    try:
+        diff = discharge_tracker.check(session)
+        discharge_tracker.rebuild(session)
+        session.commit()
+        logging.info('Rebuilt patient discharge tracking.')
+    except Exception as e:
+        session.rollback()
+        raise e
+
+    return discharge_tracker.format_diff(diff) + '\nDone'
+
+
+def _check_summary(application):
+    diff = event_summary.check(application.db.session)
+    return event_summary.format_diff(diff)
+
+
+def _rebuild_summary(application):
+    session = application.db.session
+    try:
+        diff = event_summary.check(session)
+        event_summary.rebuild(session)
+        session.commit()
+        logging.info('Rebuilt event summaries.')
+    except Exception as e:
+        session.rollback()
+        raise e
+
+    return event_summary.format_diff(diff) + '\nDone'
+
+
+def _export_replication(application):
+    session = application.db.session
+    try:
+        paths = replication.export_outbox(session, application.config['REPLICATION_NODE'],
+                                          application.config['REPLICATION_OUTBOX'])
+        logging.info('Exported {} replication batches.'.format(len(paths)))
+    except Exception as e:
+        session.rollback()
+        raise e
+
+    return 'Exported {} batches\nDone'.format(len(paths))
+
+
+def _forward_replication(application):
+    engine = create_engine(application.config['REPLICATION_TARGET_URL'], pool_pre_ping=True)
+    session = replication.target_session(engine)
+    try:
+        results = replication.forward_outbox(session, application.config['REPLICATION_OUTBOX'])
+        logging.info('Forwarded {} replication batches.'.format(len(results)))
+    except Exception as e:
+        session.rollback()
+        raise e
+    finally:
+        session.close()
+        engine.dispose()
+
+    return replication.format_results(results) + '\nDone'
@@ -0,0 +1,37 @@
+from sqlalchemy import extract, select
+
+from app.models import Patient, PatientPhone
+from app.util import phone
+
+
+def dob_years(session):
+    """Sets dob_year on patients recorded before it was kept by Patient's dob validator, returning how many."""
+    return session.query(Patient) \
+        .filter(Patient.dob_year.is_(None), Patient.dob.isnot(None)) \
+        .update({Patient.dob_year: extract('year', Patient.dob)}, synchronize_session=False)
+
+
+def phones(session, batch_size=1000):
+    """Rebuilds PatientPhones from every patient's phone numbers, for patients written without Patient's phone
+    validator: before the table existed, or by a bulk insert. Returns how many numbers were written."""
+    connection = session.connection()
+    t = PatientPhone.__table__
+    p = Patient.__table__
+    connection.execute(t.delete())
+
+    written = 0
+    last_id = None
+    while True:
+        page = select([p.c.id, p.c.phone_1, p.c.phone_2]).order_by(p.c.id).limit(batch_size)
+        rows = connection.execute(page if last_id is None else page.where(p.c.id > last_id)).fetchall()
+        if not rows:
+            return written
+
+        values = [dict(patient_id=id, position=position, number=number, number_reversed=phone.reversed_digits(number))
+                  for (id, *numbers) in rows
+                  for (position, number) in enumerate(map(phone.normalise, numbers), start=1) if number]
+        if values:
+            connection.execute(t.insert(), values)
+
+        written += len(values)
+        last_id = rows[-1].id
@@ -0,0 +1,107 @@
+import csv
+import datetime
+from collections import namedtuple
+
+from sqlalchemy import and_, exists, extract, func
+from sqlalchemy.orm import aliased
+
+from app.models import Patient, Event, InguinalMeshHerniaRepair, Followup, Discharge
+
+Issue = namedtuple('Issue', ['entity', 'id', 'patient_id', 'issue'])
+
+
+def scan(session, today=None):
+    """Returns the Issues found in the registry. Each check is a single set-based query."""
+    today = today or datetime.date.today()
+
+    checks = [
+        _patients_without_events,
+        _events_before_birth,
+        _events_in_future,
+        _followups_without_repair,
+        _discharges_without_repair,
+        _possible_duplicate_patients,
+    ]
+
+    issues = []
+    for check in checks:
+        issues.extend(check(session, today))
+
+    return issues
+
+
+def write_csv(issues, f):
+    writer = csv.writer(f)
+    writer.writerow(['Entity', 'Id', 'Patient Id', 'Issue'])
+    writer.writerows(issues)
+
+
+def summarise(issues):
+    counts = {}
+    for issue in issues:
+        counts[issue.issue] = counts.get(issue.issue, 0) + 1
+
+    if not counts:
+        return 'No issues found.'
+
+    return '; '.join('{}: {}'.format(issue, count) for (issue, count) in sorted(counts.items()))
+
+
+def _patients_without_events(session, today):
+    query = session.query(Patient.id) \
+        .filter(~exists().where(Event.patient_id == Patient.id)) \
+        .order_by(Patient.id)
+
+    return [Issue('Patient', id, id, 'No events recorded') for (id,) in query]
+
+
+def _events_before_birth(session, today):
+    query = session.query(Event.id, Event.patient_id) \
+        .join(Patient, Patient.id == Event.patient_id) \
+        .filter(extract('year', Event.date) < Patient.dob_year) \
+        .order_by(Event.id)
+
+    return [Issue('Event', id, patient_id, 'Dated before the patient was born') for (id, patient_id) in query]
+
+
+def _events_in_future(session, today):
+    query = session.query(Event.id, Event.patient_id).filter(Event.date > today).order_by(Event.id)
+
+    return [Issue('Event', id, patient_id, 'Dated in the future') for (id, patient_id) in query]
+
+
+def _without_earlier_repair(session, entity, issue):
+    repair = aliased(Event)
+    repair_type = InguinalMeshHerniaRepair.__mapper__.polymorphic_identity
+
+    query = session.query(Event.id, Event.patient_id) \
+        .filter(Event.type == entity.__mapper__.polymorphic_identity) \
+        .filter(~exists().where(and_(repair.patient_id == Event.patient_id,
+                                     repair.type == repair_type,
+                                     repair.date <= Event.date))) \
+        .order_by(Event.id)
+
+    return [Issue('Event', id, patient_id, issue) for (id, patient_id) in query]
+
+
+def _followups_without_repair(session, today):
+    return _without_earlier_repair(session, Followup, 'Follow-up without an earlier repair')
+
+
+def _discharges_without_repair(session, today):
+    return _without_earlier_repair(session, Discharge, 'Discharge without an earlier repair')
+
+
+def _possible_duplicate_patients(session, today):
+    duplicates = session.query(Patient.center_id, Patient.name, Patient.dob_year) \
+        .group_by(Patient.center_id, Patient.name, Patient.dob_year) \
+        .having(func.count(Patient.id) > 1) \
+        .subquery()
+
+    query = session.query(Patient.id) \
+        .join(duplicates, and_(duplicates.c.center_id == Patient.center_id,
+                               duplicates.c.name == Patient.name,
+                               duplicates.c.dob_year == Patient.dob_year)) \
+        .order_by(Patient.id)
+
+    return [Issue('Patient', id, id, 'Possible duplicate (same name, birth year and center)') for (id,) in query]
@@ -0,0 +1,71 @@
+from collections import namedtuple
+
+from sqlalchemy import and_, func, or_, select
+
+from app.models import Event, Discharge, PatientDischargeTracker
+
+TrackerDiff = namedtuple('TrackerDiff', ['missing', 'unexpected', 'mismatched'])
+
+
+def expected_tracking():
+    """Select the (patient_id, center_id, event_date) rows PatientDischargeTracker should hold.
+
+    A patient is pending discharge when their latest non-discharge event is after their latest discharge (or they
+    have never been discharged). The tracked date and center are those of that latest event. Only aggregates and
+    joins are used, so this runs as one statement on MySQL 5.7 as well as on databases with window functions.
+    """
+    events = Event.__table__
+    discharge_type = Discharge.__mapper__.polymorphic_identity
+
+    last_event = select([events.c.patient_id, func.max(events.c.date).label('event_date')]) \
+        .where(events.c.type != discharge_type) \
+        .group_by(events.c.patient_id) \
+        .alias('last_event')
+
+    last_discharge = select([events.c.patient_id, func.max(events.c.date).label('discharge_date')]) \
+        .where(events.c.type == discharge_type) \
+        .group_by(events.c.patient_id) \
+        .alias('last_discharge')
+
+    latest = events.alias('latest')
+
+    return select([last_event.c.patient_id, func.max(latest.c.center_id).label('center_id'),
+                   last_event.c.event_date]) \
+        .select_from(last_event
+                     .outerjoin(last_discharge, last_discharge.c.patient_id == last_event.c.patient_id)
+                     .join(latest, and_(latest.c.patient_id == last_event.c.patient_id,
+                                        latest.c.date == last_event.c.event_date,
+                                        latest.c.type != discharge_type))) \
+        .where(or_(last_discharge.c.discharge_date.is_(None),
+                   last_discharge.c.discharge_date < last_event.c.event_date)) \
+        .group_by(last_event.c.patient_id, last_event.c.event_date)
+
+
+def check(session):
+    expected = {row.patient_id: (row.center_id, row.event_date) for row in session.execute(expected_tracking())}
+
+    tracker = PatientDischargeTracker.__table__
+    actual = {row.patient_id: (row.center_id, row.event_date) for row in
+              session.execute(select([tracker.c.patient_id, tracker.c.center_id, tracker.c.event_date]))}
+
+    return TrackerDiff(missing=sorted(set(expected) - set(actual)),
+                       unexpected=sorted(set(actual) - set(expected)),
+                       mismatched=sorted(id for id in set(expected) & set(actual) if expected[id] != actual[id]))
+
+
+def rebuild(session):
+    tracker = PatientDischargeTracker.__table__
+    session.execute(tracker.delete())
+    session.execute(tracker.insert().from_select(['patient_id', 'center_id', 'event_date'], expected_tracking()))
+    session.expire_all()
+
+
+def format_diff(diff, limit=20):
+    lines = []
+    for name, patient_ids in diff._asdict().items():
+        lines.append('{}: {}'.format(name.capitalize(), len(patient_ids)))
+        if patient_ids:
+            lines.append('  patient ids {}{}'.format(', '.join(str(id) for id in patient_ids[:limit]),
+                                                     ', ...' if len(patient_ids) > limit else ''))
+
+    return '\n'.join(lines)
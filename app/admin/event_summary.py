@@ -0,0 +1,73 @@
+from collections import namedtuple
+
+from sqlalchemy import case, extract, func, or_, select
+
+from app.models import Event, EventSummary, InguinalMeshHerniaRepair, Followup, Discharge
+
+SummaryDiff = namedtuple('SummaryDiff', ['missing', 'unexpected', 'mismatched'])
+
+
+def expected_summary():
+    """Select the rows EventSummary should hold, aggregated from the whole event history.
+
+    The complication rules must match models._summary, which maintains the table incrementally.
+    """
+    events = Event.__table__
+    repairs = InguinalMeshHerniaRepair.__table__
+    followups = Followup.__table__
+    discharges = Discharge.__table__
+
+    year = extract('year', events.c.date)
+    month = extract('month', events.c.date)
+    repair_type = InguinalMeshHerniaRepair.__mapper__.polymorphic_identity
+    mesh_type_id = case([(events.c.type == repair_type, func.coalesce(repairs.c.mesh_type_id, 0))], else_=0)
+    surgeon_id = case([(events.c.type == repair_type, func.coalesce(repairs.c.primary_surgeon_id, 0))], else_=0)
+
+    complication = case([
+        (func.length(func.trim(func.coalesce(repairs.c.complications, ''))) > 0, 1),
+        (or_(followups.c.infection == True, followups.c.seroma == True, followups.c.numbness == True), 1),
+        (discharges.c.perioperative_complication == True, 1),
+    ], else_=0)
+
+    return select([events.c.center_id.label('center_id'), year.label('year'), month.label('month'),
+                   events.c.type.label('type'), mesh_type_id.label('mesh_type_id'), surgeon_id.label('surgeon_id'),
+                   func.count(events.c.id).label('events'), func.sum(complication).label('complications')]) \
+        .select_from(events
+                     .outerjoin(repairs, repairs.c.id == events.c.id)
+                     .outerjoin(followups, followups.c.id == events.c.id)
+                     .outerjoin(discharges, discharges.c.id == events.c.id)) \
+        .group_by(events.c.center_id, year, month, events.c.type, mesh_type_id, surgeon_id)
+
+
+def check(session):
+    expected = {_key(row): (row.events, row.complications) for row in session.execute(expected_summary())}
+
+    summaries = EventSummary.__table__
+    actual = {_key(row): (row.events, row.complications) for row in session.execute(select([summaries]))}
+
+    return SummaryDiff(missing=sorted(set(expected) - set(actual)),
+                       unexpected=sorted(set(actual) - set(expected)),
+                       mismatched=sorted(key for key in set(expected) & set(actual) if expected[key] != actual[key]))
+
+
+def rebuild(session):
+    summaries = EventSummary.__table__
+    session.execute(summaries.delete())
+    session.execute(summaries.insert().from_select(list(EventSummary.KEY) + ['events', 'complications'],
+                                                   expected_summary()))
+    session.expire_all()
+
+
+def format_diff(diff, limit=5):
+    lines = []
+    for name, keys in diff._asdict().items():
+        lines.append('{}: {}'.format(name.capitalize(), len(keys)))
+        if keys:
+            lines.append('  {}{}'.format(', '.join(str(key) for key in keys[:limit]),
+                                         ', ...' if len(keys) > limit else ''))
+
+    return '\n'.join(lines)
+
+
+def _key(row):
+    return tuple(int(row[name]) if name != 'type' else row[name] for name in EventSummary.KEY)
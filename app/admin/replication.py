@@ -0,0 +1,280 @@
+import datetime
+import gzip
+import os
+from collections import namedtuple
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import with_polymorphic
+
+from app import sync
+from app.models import Patient, Event, Center, MeshType, User, ReplicationCursor, Replica
+from app.util import restful
+from app.util.serializer import serializer
+from application import db
+
+REPLICATION_BATCH_SIZE = 500
+# Changes only replicate once they are this old, so a transaction that commits late is not passed over
+REPLICATION_SETTLE_SECONDS = 5
+BATCH_SUFFIX = '.json.gz'
+SENT_DIRECTORY = 'sent'
+
+# Foreign keys are replicated by natural key, as reference data and users have different ids on each node
+NATURAL_KEYS = {
+    'Centers': (Center, 'name'),
+    'MeshTypes': (MeshType, 'name'),
+    'Users': (User, 'email'),
+}
+
+EVENT_IDENTITIES = {cls.__mapper__.polymorphic_identity: cls for cls in sync.EVENT_TYPES.values()}
+
+# Columns that are assigned on the central database rather than copied from the edge node
+LOCAL_FIELDS = {'id', 'version_id', 'client_id', 'type'}
+
+Problem = namedtuple('Problem', ['entity', 'client_id', 'message'])
+ReplicationResult = namedtuple('ReplicationResult', ['applied', 'skipped', 'conflicts', 'errors'])
+
+
+def target_session(engine):
+    """A session on another database that still has the registry's session hooks, which are registered on the
+    application's session factory. Flask-SQLAlchemy binds every table to the application's engine unless the
+    binds are cleared."""
+    return db.session.session_factory(bind=engine, binds={})
+
+
+def export_outbox(session, node, directory, limit=REPLICATION_BATCH_SIZE):
+    """Writes the changes made on this node since the last export to compressed batch files in directory, returning
+    their paths. The cursors move on only once a batch is written, so an interrupted export resumes where it was."""
+    os.makedirs(directory, exist_ok=True)
+
+    paths = []
+    while True:
+        batch = export_batch(session, node, limit)
+        if batch is None:
+            return paths
+
+        path = os.path.join(directory, '{}-{:%Y%m%dT%H%M%S%f}{}'.format(node, datetime.datetime.now(), BATCH_SUFFIX))
+        with open(path, 'wb') as f:
+            f.write(batch)
+
+        session.commit()
+        paths.append(path)
+
+
+def export_batch(session, node, limit=REPLICATION_BATCH_SIZE):
+    """Returns the next gzipped JSON batch of up to limit patients and limit events changed on this node, advancing
+    the cursors in session, or None if there are no changes."""
+    settled = datetime.datetime.now() - datetime.timedelta(seconds=REPLICATION_SETTLE_SECONDS)
+    keys = _Keys(session, node)
+
+    events = with_polymorphic(Event, '*')
+    changed = {}
+    for (stream, entity) in [('patients', Patient), ('events', events)]:
+        cursor = session.query(ReplicationCursor).get((node, stream)) or ReplicationCursor(node=node, stream=stream)
+        query = session.query(entity).filter(entity.updated_at < settled)
+        if cursor.changed_at is not None:
+            query = query.filter(or_(entity.updated_at > cursor.changed_at,
+                                     and_(entity.updated_at == cursor.changed_at, entity.id > cursor.last_id)))
+
+        instances = query.order_by(entity.updated_at, entity.id).limit(limit).all()
+        if instances:
+            (cursor.changed_at, cursor.last_id) = (instances[-1].updated_at, instances[-1].id)
+            session.add(cursor)
+
+        changed[stream] = instances
+
+    # Events go with their patients, as the patient stream may not have reached a patient changed after its event.
+    # Applying a patient that is already up to date centrally skips it.
+    parent_ids = {e.patient_id for e in changed['events']} - {p.id for p in changed['patients']}
+    if parent_ids:
+        changed['patients'] += session.query(Patient).filter(Patient.id.in_(parent_ids)).order_by(Patient.id).all()
+
+    records = {stream: [keys.record(i) for i in instances] for (stream, instances) in changed.items()}
+
+    if not any(records.values()):
+        return None
+
+    return gzip.compress(restful.json_dumps(dict(node=node, **records)).encode('utf-8'))
+
+
+def forward_outbox(session, directory):
+    """Applies the batch files in directory to the database of session in the order they were written, committing
+    each and moving it to the sent directory. A batch with errors stays in directory, to be applied again by the next
+    forward once the cause is fixed, and is retried straight away while other batches are still applying records.
+    Returns the latest ReplicationResult of each file by name."""
+    sent = os.path.join(directory, SENT_DIRECTORY)
+    os.makedirs(sent, exist_ok=True)
+
+    results = {}
+    pending = sorted(n for n in os.listdir(directory) if n.endswith(BATCH_SUFFIX))
+    while pending:
+        failed = []
+        for name in pending:
+            with open(os.path.join(directory, name), 'rb') as f:
+                results[name] = apply_batch(session, f.read())
+
+            session.commit()
+            if results[name].errors:
+                failed.append(name)
+            else:
+                os.replace(os.path.join(directory, name), os.path.join(sent, name))
+
+        # Records already applied are skipped when a batch is applied again, so this stops once a pass applies nothing
+        if not any(results[name].applied for name in pending):
+            break
+        pending = failed
+
+    return results
+
+
+def apply_batch(session, data):
+    """Applies a batch from export_batch. Each record is matched to the central one by its client_id, so a batch
+    applied twice changes nothing the second time.
+
+    A record the central database has changed since it was last replicated is a conflict and is left as it is, as is
+    a record whose references cannot be found. Both are reported in the ReplicationResult with what was applied and
+    skipped. The caller commits.
+    """
+    batch = restful.json_loads(gzip.decompress(data).decode('utf-8'), schema=sync.SCHEMA)
+    lookups = _Lookups(session)
+    result = ReplicationResult([], [], [], [])
+
+    for record in batch['patients']:
+        _apply(session, Patient, record, lookups, result)
+
+    # The new patients need their ids before events can refer to them
+    session.flush()
+
+    for record in batch['events']:
+        entity = EVENT_IDENTITIES.get(record.get('type'))
+        if entity is None:
+            result.errors.append(Problem('Event', record.get('client_id'), 'Unknown event type.'))
+            continue
+
+        _apply(session, entity, record, lookups, result)
+
+    session.flush()
+    return result
+
+
+def format_results(results):
+    lines = []
+    for (name, result) in results.items():
+        lines.append('{}: {} applied, {} skipped, {} conflicts, {} errors'.format(
+            name, len(result.applied), len(result.skipped), len(result.conflicts), len(result.errors)))
+        lines.extend('  Conflict: {} {}: {}'.format(*p) for p in result.conflicts)
+        lines.extend('  Error: {} {}: {}'.format(*p) for p in result.errors)
+
+    return '\n'.join(lines)
+
+
+def _apply(session, entity, record, lookups, result):
+    name = Event.__name__ if issubclass(entity, Event) else entity.__name__
+    client_id = record['client_id']
+    origin_version = record['version_id']
+
+    replica = session.query(Replica).get((name, client_id))
+    if replica is not None and origin_version <= replica.origin_version:
+        result.skipped.append(Problem(name, client_id, 'Already applied.'))
+        return
+
+    try:
+        values = lookups.resolve(entity, record)
+    except LookupError as e:
+        result.errors.append(Problem(name, client_id, str(e)))
+        return
+
+    instance = session.query(entity).filter(entity.client_id == client_id).first()
+    if instance is None:
+        instance = entity(client_id=client_id)
+        session.add(instance)
+    elif replica is None or instance.version_id != replica.version_id:
+        result.conflicts.append(Problem(name, client_id, 'Changed centrally since it was last replicated.'))
+        return
+
+    for (k, v) in values.items():
+        setattr(instance, k, v)
+
+    session.flush()
+    if replica is None:
+        replica = Replica(entity=name, client_id=client_id)
+        session.add(replica)
+    (replica.origin_version, replica.version_id) = (origin_version, instance.version_id)
+
+    if name == Patient.__name__:
+        lookups.patients[client_id] = instance.id
+    result.applied.append(Problem(name, client_id, 'Applied.'))
+
+
+class _Keys:
+    """Turns the records of an edge node into their replicated form: identified by client_id, which is the
+    node and id unless the record already has one, and with foreign keys given by natural key."""
+
+    def __init__(self, session, node):
+        self.session = session
+        self.node = node
+        self.natural_keys = {table: dict(session.query(entity.id, getattr(entity, key)))
+                             for (table, (entity, key)) in NATURAL_KEYS.items()}
+        self.patients = {}
+
+    def client_id(self, instance):
+        return instance.client_id or '{}:{}'.format(self.node, instance.id)
+
+    def record(self, instance):
+        s = serializer(type(instance))
+        record = s.instance(instance)
+        for column in s.columns:
+            value = record[column.name]
+            if column.name in LOCAL_FIELDS:
+                continue
+
+            for fk in column.foreign_keys if value is not None else []:
+                record[column.name] = self._natural_key(fk.column.table.name, value)
+
+        record['client_id'] = self.client_id(instance)
+        del record['id']
+        return record
+
+    def _natural_key(self, table, id):
+        if table == Patient.__tablename__:
+            if id not in self.patients:
+                patient = self.session.query(Patient).get(id)
+                self.patients[id] = self.client_id(patient)
+            return self.patients[id]
+
+        return self.natural_keys[table][id]
+
+
+class _Lookups:
+    """The central ids of natural keys, read once per batch."""
+
+    def __init__(self, session):
+        self.session = session
+        self.ids = {table: {k: id for (id, k) in session.query(entity.id, getattr(entity, key))}
+                    for (table, (entity, key)) in NATURAL_KEYS.items()}
+        self.patients = {}
+
+    def resolve(self, entity, record):
+        values = {}
+        for column in serializer(entity).columns:
+            if column.name in LOCAL_FIELDS or column.name not in record:
+                continue
+
+            value = record[column.name]
+            for fk in column.foreign_keys if value is not None else []:
+                value = self._id(fk.column.table.name, value)
+            values[column.name] = value
+
+        return values
+
+    def _id(self, table, key):
+        if table == Patient.__tablename__:
+            if key not in self.patients:
+                self.patients[key] = self.session.query(Patient.id).filter(Patient.client_id == key).scalar()
+            id = self.patients[key]
+        else:
+            id = self.ids[table].get(key)
+
+        if id is None:
+            raise LookupError('Unable to find {} {}.'.format(table, key))
+
+        return id
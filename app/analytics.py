@@ -0,0 +1,160 @@
+from collections import namedtuple
+
+import pandas as pd
+from sqlalchemy import select, type_coerce
+from sqlalchemy.types import NullType
+
+from app.models import Center, User, MeshType, Event, InguinalMeshHerniaRepair, Followup, Discharge, Occurrence, \
+    Pain
+
+Frames = namedtuple('Frames', ['repairs', 'followups', 'discharges'])
+
+DIMENSIONS = ('center', 'surgeon', 'mesh_type', 'cepod', 'complexity')
+
+RECURRENT = [Occurrence.Recurrent.name, Occurrence.ReRecurrent.name]
+PAIN_LEVELS = [p.name for p in Pain]
+
+
+def load(session):
+    """Reads every repair, follow-up and discharge into pandas frames with one query per event type.
+
+    Enums are read as their stored names and become categoricals. Follow-ups
+    and discharges are linked to the patient's most recent repair on or before their date, and the repair's
+    dimensions are copied onto them so that every frame can be sliced the same way.
+    """
+    events = Event.__table__
+    r = InguinalMeshHerniaRepair.__table__.c
+    f = Followup.__table__.c
+    d = Discharge.__table__.c
+
+    repairs = _frame(session, [events.c.id, events.c.patient_id, events.c.date, events.c.center_id,
+                               r.primary_surgeon_id, r.mesh_type_id, r.cepod, r.complexity, r.side, r.occurrence,
+                               r.discharge_date],
+                     events.join(InguinalMeshHerniaRepair.__table__, r.id == events.c.id),
+                     dates=['date', 'discharge_date'])
+
+    followups = _frame(session, [events.c.id, events.c.patient_id, events.c.date, f.pain, f.infection, f.seroma,
+                                 f.numbness, f.mesh_awareness],
+                       events.join(Followup.__table__, f.id == events.c.id),
+                       dates=['date'])
+
+    discharges = _frame(session, [events.c.id, events.c.patient_id, events.c.date,
+                                  d.post_operative_antibiotics_iv_days, d.post_operative_antibiotics_oral_days],
+                        events.join(Discharge.__table__, d.id == events.c.id),
+                        dates=['date'])
+
+    names = dict(center=_names(session, Center), surgeon=_names(session, User), mesh_type=_names(session, MeshType))
+    repairs['center'] = _categorical(repairs['center_id'], names['center'])
+    repairs['surgeon'] = _categorical(repairs['primary_surgeon_id'], names['surgeon'])
+    repairs['mesh_type'] = _categorical(repairs['mesh_type_id'], names['mesh_type'])
+    for column in ['cepod', 'complexity', 'side', 'occurrence']:
+        repairs[column] = repairs[column].astype('category')
+
+    followups['pain'] = pd.Categorical(followups['pain'], categories=PAIN_LEVELS, ordered=True)
+    for column in ['infection', 'seroma', 'numbness', 'mesh_awareness']:
+        followups[column] = followups[column].astype('float64')
+
+    return Frames(repairs=repairs, followups=_link(followups, repairs), discharges=_link(discharges, repairs))
+
+
+def outcomes(frames, by):
+    """Returns the key outcome metrics of repairs grouped by one of the DIMENSIONS."""
+    _check_dimension(by)
+
+    repairs = frames.repairs.assign(recurred=recurrences(frames.repairs),
+                                    length_of_stay=length_of_stay(frames.repairs, frames.discharges))
+    discharges = frames.discharges.assign(
+        antibiotic_days=frames.discharges['post_operative_antibiotics_iv_days'].fillna(0) +
+                        frames.discharges['post_operative_antibiotics_oral_days'].fillna(0))
+
+    grouped_repairs = repairs.groupby(by, observed=True)
+    grouped_followups = frames.followups.groupby(by, observed=True)
+
+    result = pd.DataFrame({
+        'repairs': grouped_repairs.size(),
+        'recurrence_rate': grouped_repairs['recurred'].mean(),
+        'mean_length_of_stay': grouped_repairs['length_of_stay'].mean(),
+        'median_length_of_stay': grouped_repairs['length_of_stay'].median(),
+        'followups': grouped_followups.size(),
+        'infection_rate': grouped_followups['infection'].mean(),
+        'seroma_rate': grouped_followups['seroma'].mean(),
+        'mean_antibiotic_days': discharges.groupby(by, observed=True)['antibiotic_days'].mean(),
+    })
+    result['followups'] = result['followups'].fillna(0).astype('int64')
+
+    return result.sort_index()
+
+
+def pain_distribution(frames, by):
+    """Returns the share of follow-ups at each pain level, grouped by one of the DIMENSIONS."""
+    _check_dimension(by)
+
+    followups = frames.followups
+    return pd.crosstab(followups[by], followups['pain'], normalize='index', dropna=True) \
+        .reindex(columns=PAIN_LEVELS, fill_value=0.0)
+
+
+def write_excel(frames, path):
+    """Writes the outcomes and pain distribution for every dimension to an Excel workbook, a sheet per table."""
+    with pd.ExcelWriter(path, engine='openpyxl') as writer:
+        for by in DIMENSIONS:
+            outcomes(frames, by).to_excel(writer, sheet_name='Outcomes by {}'.format(by), index_label=by)
+            pain_distribution(frames, by).to_excel(writer, sheet_name='Pain by {}'.format(by), index_label=by)
+
+
+def recurrences(repairs):
+    """Flags each repair that was followed by a recurrent repair on the same side of the same patient."""
+    ordered = repairs.sort_values(['patient_id', 'side', 'date', 'id'])
+    same_side = ordered[['patient_id', 'side']].shift(-1)
+    next_occurrence = ordered['occurrence'].astype('object').shift(-1)
+
+    recurred = (same_side['patient_id'].to_numpy() == ordered['patient_id'].to_numpy()) & \
+               (same_side['side'].to_numpy() == ordered['side'].astype('object').to_numpy()) & \
+               next_occurrence.isin(RECURRENT).to_numpy()
+
+    return pd.Series(recurred, index=ordered.index).reindex(repairs.index)
+
+
+def length_of_stay(repairs, discharges):
+    """Days from repair to discharge, from the repair's discharge date or else its first linked Discharge event."""
+    first_discharge = discharges.dropna(subset=['repair_id']).groupby('repair_id')['date'].min()
+    discharge_date = repairs['discharge_date'].fillna(
+        pd.Series(first_discharge.reindex(repairs['id']).to_numpy(), index=repairs.index))
+
+    return (discharge_date - repairs['date']).dt.days
+
+
+def _link(frame, repairs):
+    # Each row takes the patient's latest repair on or before its date, along with the repair's dimensions.
+    columns = ['id', 'patient_id', 'date'] + list(DIMENSIONS)
+    linked = pd.merge_asof(frame.reset_index().sort_values('date'),
+                           repairs[columns].rename(columns={'id': 'repair_id', 'date': 'repair_date'})
+                           .sort_values('repair_date'),
+                           left_on='date', right_on='repair_date', by='patient_id', direction='backward')
+
+    return linked.set_index('index').sort_index().rename_axis(None)
+
+
+def _frame(session, columns, from_, dates):
+    # Take the driver's values as they are (enum names, ISO dates on SQLite, ...) and convert whole columns at once,
+    # rather than letting each column type convert every value.
+    result = session.execute(select([type_coerce(c, NullType).label(c.name) for c in columns]).select_from(from_))
+    frame = pd.DataFrame.from_records(result.fetchall(), columns=list(result.keys()))
+    frame = frame.astype({'id': 'int64', 'patient_id': 'int64'})
+    for column in dates:
+        frame[column] = pd.to_datetime(frame[column]).astype('datetime64[ns]')
+
+    return frame
+
+
+def _names(session, entity):
+    return dict(session.query(entity.id, entity.name))
+
+
+def _categorical(ids, names):
+    return pd.Categorical(ids.map(names))
+
+
+def _check_dimension(by):
+    if by not in DIMENSIONS:
+        raise ValueError('Unknown dimension {}.'.format(by))
@@ -0,0 +1,274 @@
+import base64
+import binascii
+import datetime
+import json
+
+from flask import current_app as application
+from flask import request, stream_with_context
+from flask_login import current_user, login_required
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from app import sync
+from app.replica import read_replica
+from app.models import Patient, Event, Tombstone
+from app.util import restful
+from app.util.filter import keyset_after
+from app.util.restful import CustomJSONEncoder
+from app.util.serializer import Serializer
+
+from application import db
+
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 1000
+API_ORDERS = ('id', 'updated_at')
+CHANGE_STREAMS = ('patients', 'events', 'deleted')
+CHANGES_SETTLE_SECONDS = 5
+
+EVENT_TYPES = sync.EVENT_TYPES
+
+_encoder = CustomJSONEncoder(separators=(',', ':'))
+
+
+class ApiError(Exception):
+    pass
+
+
+@application.route('/api/patients', methods=['GET'])
+@login_required
+@read_replica
+def api_patients():
+    table = Patient.__table__
+    return _page(table, {None: list(table.c)}, table)
+
+
+@application.route('/api/events', methods=['GET'])
+@login_required
+@read_replica
+def api_events():
+    return _events(list(EVENT_TYPES.values()))
+
+
+@application.route('/api/events/<string:type>', methods=['GET'])
+@login_required
+@read_replica
+def api_events_of_type(type):
+    if type not in EVENT_TYPES:
+        return _error('Unknown event type {}, expected one of {}.'.format(type, ', '.join(sorted(EVENT_TYPES))), 404)
+
+    return _events([EVENT_TYPES[type]])
+
+
+@application.route('/api/sync', methods=['POST'])
+@login_required
+def api_sync():
+    """Applies a batch of patients and events recorded offline in one transaction, see sync.apply. Responds with
+    {"patients": [...], "events": [...]} giving the client_id, id, version_id and status of each record, or 409 with
+    the conflicting records if any were changed on the server since the client read them."""
+    # Only JSON is accepted, which a cross-site form cannot send
+    if not request.is_json:
+        return _error('Expected a JSON body.', 415)
+
+    try:
+        batch = restful.json_loads(request.get_data(as_text=True), schema=sync.SCHEMA)
+        result = sync.apply(db.session, batch, current_user)
+        db.session.commit()
+    except sync.SyncConflict as e:
+        db.session.rollback()
+        return application.response_class(
+            _encoder.encode(dict(error=str(e), conflicts=[c._asdict() for c in e.conflicts])), status=409,
+            mimetype='application/json')
+    except (sync.SyncError, ValueError, IntegrityError) as e:
+        db.session.rollback()
+        return _error(str(e.orig) if isinstance(e, IntegrityError) else str(e), 400)
+
+    return application.response_class(_encoder.encode(result), mimetype='application/json')
+
+
+@application.route('/api/changes', methods=['GET'])
+@login_required
+def api_changes():
+    """Streams the Patients and Events inserted or updated, and those deleted, after the `after` cursor, as
+    {"patients": [...], "events": [...], "deleted": [...], "more": bool, "next": cursor}. Keep requesting with
+    `next` until `more` is false; the final `next` is where the following sync starts.
+
+    Only changes older than CHANGES_SETTLE_SECONDS are returned, so that a transaction which commits after a later
+    one has been read is not skipped over by the cursor.
+    """
+    try:
+        positions = _parse_changes_cursor(request.args.get('after'))
+        limit = _limit()
+    except ApiError as e:
+        return _error(str(e), 400)
+
+    settled = datetime.datetime.now() - datetime.timedelta(seconds=CHANGES_SETTLE_SECONDS)
+
+    patients = Patient.__table__
+    events = Event.__table__
+    tombstones = Tombstone.__table__
+    (event_columns, event_from) = _event_columns(list(EVENT_TYPES.values()))
+
+    streams = [
+        ('patients', patients, {None: list(patients.c)}, patients, patients.c.updated_at),
+        ('events', events, event_columns, event_from, events.c.updated_at),
+        ('deleted', tombstones, {None: [tombstones.c.entity, tombstones.c.entity_id, tombstones.c.deleted_at]},
+         tombstones, tombstones.c.deleted_at),
+    ]
+
+    results = []
+    more = False
+    for (name, table, columns, from_, changed_at) in streams:
+        keys = [changed_at, table.c.id]
+        (rows, stream_more, serialize) = _fetch(table, columns, from_, keys, positions.get(name), limit,
+                                                changed_at < settled)
+        if rows:
+            positions[name] = [rows[-1][changed_at], rows[-1][table.c.id]]
+
+        results.append((name, rows, serialize))
+        more = more or stream_more
+
+    def generate():
+        yield '{'
+        for (name, rows, serialize) in results:
+            yield '"{}":['.format(name)
+            for (i, row) in enumerate(rows):
+                yield (',' if i else '') + _encoder.encode(serialize(row))
+            yield '],'
+        yield '"more":{},"next":{}}}'.format(_encoder.encode(more), _encoder.encode(_changes_cursor(positions)))
+
+    return application.response_class(stream_with_context(generate()), mimetype='application/json')
+
+
+def _events(classes):
+    (columns, from_) = _event_columns(classes)
+    return _page(Event.__table__, columns, from_)
+
+
+def _event_columns(classes):
+    # Events of the given classes with their subclass columns, keyed by polymorphic identity so that each row only
+    # carries the columns of its own type.
+    events = Event.__table__
+    from_ = events
+    columns = {None: list(events.c)}
+    for cls in classes:
+        subclass = cls.__table__
+        from_ = from_.join(subclass, subclass.c.id == events.c.id) if len(classes) == 1 else \
+            from_.outerjoin(subclass, subclass.c.id == events.c.id)
+        columns[cls.__mapper__.polymorphic_identity] = [c for c in subclass.c if c.name != 'id']
+
+    return columns, from_
+
+
+def _page(table, columns, from_):
+    """Streams one keyset page of table as compact JSON: {"results": [...], "next": cursor}.
+
+    columns maps a row type (the polymorphic identity, or None for columns every row has) to its columns. The page
+    continues after the `after` cursor in `order` ("id" or "updated_at") and holds at most `limit` rows; `fields`
+    restricts the columns returned. `next` is the cursor of the following page, or null on the last page.
+    """
+    try:
+        order = request.args.get('order', 'id')
+        if order not in API_ORDERS:
+            raise ApiError('Unknown order {}, expected one of {}.'.format(order, ', '.join(API_ORDERS)))
+
+        keys = [table.c.id] if order == 'id' else [table.c.updated_at, table.c.id]
+        columns = _select_fields(columns, request.args.get('fields'))
+        after = request.args.get('after')
+        after = _parse_cursor(after, order) if after else None
+        limit = _limit()
+    except ApiError as e:
+        return _error(str(e), 400)
+
+    (rows, more, serialize) = _fetch(table, columns, from_, keys, after, limit)
+
+    def generate():
+        yield '{"results":['
+        for (i, row) in enumerate(rows):
+            yield (',' if i else '') + _encoder.encode(serialize(row))
+        yield '],"next":{}}}'.format(_encoder.encode(_cursor(rows[-1], order) if more else None))
+
+    return application.response_class(stream_with_context(generate()), mimetype='application/json')
+
+
+def _fetch(table, columns, from_, keys, after, limit, *where):
+    """Returns up to limit rows of the select ordered by keys and after the keys' values after, whether there are
+    more and a function turning each row into the dict of its type's columns."""
+    # The keys, and for events the type, are always read for the cursor and for picking each row's columns.
+    required = keys + ([table.c.type] if len(columns) > 1 else [])
+    selected = required + [c for cs in columns.values() for c in cs if c.name not in {r.name for r in required}]
+    query = select(selected).select_from(from_).order_by(*keys).limit(limit + 1)
+
+    if after:
+        query = query.where(keyset_after(keys, after))
+    for clause in where:
+        query = query.where(clause)
+
+    rows = db.session.execute(query).fetchall()
+    return rows[:limit], len(rows) > limit, _serializer(columns, selected, len(keys))
+
+
+def _limit():
+    return max(1, min(request.args.get('limit', API_PAGE_SIZE, type=int), API_MAX_PAGE_SIZE))
+
+
+def _select_fields(columns, fields):
+    if not fields:
+        return columns
+
+    names = set(f.strip() for f in fields.split(',') if f.strip())
+    known = {c.name for cs in columns.values() for c in cs}
+    unknown = names - known
+    if unknown:
+        raise ApiError('Unknown fields {}.'.format(', '.join(sorted(unknown))))
+
+    return {type: [c for c in cs if c.name in names] for (type, cs) in columns.items()}
+
+
+def _serializer(columns, selected, type_position):
+    if len(columns) == 1:
+        return Serializer(columns[None], selected=selected).row
+
+    serializers = {type: Serializer(columns[None] + cs, selected=selected).row
+                   for (type, cs) in columns.items() if type is not None}
+    common = Serializer(columns[None], selected=selected).row
+
+    return lambda row: serializers.get(row[type_position], common)(row)
+
+
+def _cursor(row, order):
+    if order == 'id':
+        return str(row['id'])
+
+    return '{}|{}'.format(row['updated_at'].isoformat(), row['id'])
+
+
+def _parse_cursor(cursor, order):
+    try:
+        if order == 'id':
+            return [int(cursor)]
+
+        (updated_at, id) = cursor.split('|')
+        return [datetime.datetime.fromisoformat(updated_at), int(id)]
+    except ValueError:
+        raise ApiError('Invalid cursor {} for order {}.'.format(cursor, order))
+
+
+def _changes_cursor(positions):
+    encoded = {name: [changed_at.isoformat(), id] for (name, (changed_at, id)) in positions.items()}
+    return base64.urlsafe_b64encode(json.dumps(encoded, separators=(',', ':')).encode()).decode()
+
+
+def _parse_changes_cursor(cursor):
+    if not cursor:
+        return {}
+
+    try:
+        decoded = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return {name: [datetime.datetime.fromisoformat(changed_at), int(id)]
+                for (name, (changed_at, id)) in decoded.items() if name in CHANGE_STREAMS}
+    except (ValueError, TypeError, binascii.Error):
+        raise ApiError('Invalid changes cursor {}.'.format(cursor))
+
+
+def _error(message, status):
+    return application.response_class(json.dumps(dict(error=message)), status=status, mimetype='application/json')
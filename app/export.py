@@ -0,0 +1,281 @@
+import csv
+import enum
+import io
+import os
+import tempfile
+from collections import defaultdict
+
+from openpyxl import Workbook
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from sqlalchemy.orm import aliased
+
+from app.models import Patient, Center, User, MeshType, Drug, DrugEventAssociation, Event, \
+    InguinalMeshHerniaRepair, Followup, Discharge
+from app.util.filter import keyset_after
+
+EXPORT_CHUNK_SIZE = 1000
+EXPORT_FORMATS = ('csv', 'xlsx')
+MIMETYPES = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+FILE_CHUNK_SIZE = 64 * 1024
+
+
+def find_report(name):
+    if name not in REPORTS:
+        raise ValueError('Unknown report {}.'.format(name))
+
+    return REPORTS[name]
+
+
+def export(session, report, format, progress=None):
+    """Returns a generator of the report's rows rendered as format, for use as a streamed response body. progress,
+    if given, is called with the number of rows read so far after each chunk."""
+    if format == 'csv':
+        return _csv(session, report, progress)
+    elif format == 'xlsx':
+        return _xlsx(session, report, progress)
+    else:
+        raise ValueError('Unknown export format {}.'.format(format))
+
+
+def filename(report, format):
+    return '{}.{}'.format(report.name, format)
+
+
+class Report:
+    """A flat export of one entity. Rows are read in keyset ordered chunks of EXPORT_CHUNK_SIZE, so neither the
+    query results nor the output are ever held in memory as a whole, and no cursor stays open between chunks."""
+
+    name = None
+
+    def columns(self):
+        """The (header, column expression) pairs of the report. The first column must be the unique key."""
+        raise NotImplementedError()
+
+    def query(self, session):
+        raise NotImplementedError()
+
+    def headers(self):
+        return [header for (header, _) in self.columns()]
+
+    def count(self, session):
+        return self.query(session).with_entities(self.columns()[0][1]).count()
+
+    def chunks(self, session, progress=None):
+        columns = [column for (_, column) in self.columns()]
+        key = columns[0]
+
+        last = None
+        done = 0
+        while True:
+            query = self.query(session).with_entities(*columns)
+            if last is not None:
+                query = query.filter(keyset_after([key], [last]))
+
+            rows = query.order_by(key).limit(EXPORT_CHUNK_SIZE).all()
+            if len(rows) == 0:
+                return
+
+            yield self.complete(session, [list(row) for row in rows])
+
+            last = rows[-1][0]
+            done += len(rows)
+            if progress:
+                progress(done)
+
+    def complete(self, session, rows):
+        return rows
+
+
+class PatientReport(Report):
+    name = 'Patient'
+
+    def columns(self):
+        return [
+            ('Id', Patient.id),
+            ('Name', Patient.name),
+            ('Gender', Patient.gender),
+            ('Birth Year', Patient.dob_year),
+            ('Date of Birth', Patient.dob),
+            ('Year of Birth Only', Patient.dob_year_only),
+            ('Phone 1', Patient.phone_1),
+            ('Phone 1 Comments', Patient.phone_1_comments),
+            ('Phone 2', Patient.phone_2),
+            ('Phone 2 Comments', Patient.phone_2_comments),
+            ('Hospital Number', Patient.hospital_number),
+            ('National Id', Patient.national_id),
+            ('Address', Patient.address),
+            ('Center', Center.name),
+            ('Created At', Patient.created_at),
+            ('Updated At', Patient.updated_at),
+        ]
+
+    def query(self, session):
+        return session.query(Patient).join(Center, Center.id == Patient.center_id)
+
+
+class EpisodeReport(Report):
+    """Every event with its subclass columns side by side, blank where they do not apply to the event type."""
+
+    name = 'Episode'
+
+    def __init__(self):
+        self.repairs = InguinalMeshHerniaRepair.__table__
+        self.followups = Followup.__table__
+        self.discharges = Discharge.__table__
+
+        self.created_by = aliased(User)
+        self.updated_by = aliased(User)
+        self.primary_surgeon = aliased(User)
+        self.secondary_surgeon = aliased(User)
+        self.tertiary_surgeon = aliased(User)
+        self.attendee = aliased(User)
+
+    def columns(self):
+        r = self.repairs.c
+        f = self.followups.c
+        d = self.discharges.c
+
+        return [
+            ('Id', Event.id),
+            ('Type', Event.type),
+            ('Date', Event.date),
+            ('Patient Id', Event.patient_id),
+            ('Patient', Patient.name),
+            ('Center', Center.name),
+            ('Comments', Event.comments),
+            ('Created By', self.created_by.name),
+            ('Created At', Event.created_at),
+            ('Updated By', self.updated_by.name),
+            ('Updated At', Event.updated_at),
+
+            ('Cepod', r.cepod),
+            ('Side', r.side),
+            ('Occurrence', r.occurrence),
+            ('Hernia Type', r.hernia_type),
+            ('Complexity', r.complexity),
+            ('Mesh Type', MeshType.name),
+            ('Anaesthetic Type', r.anaesthetic_type),
+            ('Anaesthetic Other', r.anaesthetic_other),
+            ('Diathermy Used', r.diathermy_used),
+            ('Discharge Date', r.discharge_date),
+            ('Primary Surgeon', self.primary_surgeon.name),
+            ('Secondary Surgeon', self.secondary_surgeon.name),
+            ('Tertiary Surgeon', self.tertiary_surgeon.name),
+            ('Additional Procedure', r.additional_procedure),
+            ('Complications', r.complications),
+
+            ('Attendee', self.attendee.name),
+            ('Pain', f.pain),
+            ('Pain Comments', f.pain_comments),
+            ('Mesh Awareness', f.mesh_awareness),
+            ('Mesh Awareness Comments', f.mesh_awareness_comments),
+            ('Infection', f.infection),
+            ('Infection Comments', f.infection_comments),
+            ('Seroma', f.seroma),
+            ('Seroma Comments', f.seroma_comments),
+            ('Numbness', f.numbness),
+            ('Numbness Comments', f.numbness_comments),
+
+            ('Perioperative Complication', d.perioperative_complication),
+            ('Perioperative Complication Comments', d.perioperative_complication_comments),
+            ('Post-operative Antibiotics', d.post_operative_antibiotics),
+            ('Post-operative Antibiotics Comments', d.post_operative_antibiotics_comments),
+            ('Post-operative Antibiotics IV Days', d.post_operative_antibiotics_iv_days),
+            ('Post-operative Antibiotics Oral Days', d.post_operative_antibiotics_oral_days),
+        ]
+
+    def headers(self):
+        return super().headers() + ['Antibiotics']
+
+    def query(self, session):
+        r = self.repairs.c
+        f = self.followups.c
+        d = self.discharges.c
+
+        return session.query(Event) \
+            .join(Patient, Patient.id == Event.patient_id) \
+            .join(Center, Center.id == Event.center_id) \
+            .join(self.created_by, self.created_by.id == Event.created_by_id) \
+            .join(self.updated_by, self.updated_by.id == Event.updated_by_id) \
+            .outerjoin(self.repairs, r.id == Event.id) \
+            .outerjoin(MeshType, MeshType.id == r.mesh_type_id) \
+            .outerjoin(self.primary_surgeon, self.primary_surgeon.id == r.primary_surgeon_id) \
+            .outerjoin(self.secondary_surgeon, self.secondary_surgeon.id == r.secondary_surgeon_id) \
+            .outerjoin(self.tertiary_surgeon, self.tertiary_surgeon.id == r.tertiary_surgeon_id) \
+            .outerjoin(self.followups, f.id == Event.id) \
+            .outerjoin(self.attendee, self.attendee.id == f.attendee_id) \
+            .outerjoin(self.discharges, d.id == Event.id)
+
+    def complete(self, session, rows):
+        antibiotics = defaultdict(list)
+        for (event_id, name) in session.query(DrugEventAssociation.event_id, Drug.name) \
+                .join(Drug, Drug.id == DrugEventAssociation.drug_id) \
+                .filter(DrugEventAssociation.event_id.in_([row[0] for row in rows])) \
+                .order_by(DrugEventAssociation.event_id, Drug.name):
+            antibiotics[event_id].append(name)
+
+        for row in rows:
+            row.append(', '.join(antibiotics.get(row[0], [])))
+
+        return rows
+
+
+REPORTS = {report.name: report for report in [PatientReport(), EpisodeReport()]}
+
+
+def _value(value):
+    if isinstance(value, enum.Enum):
+        return value.name
+
+    return value
+
+
+def _csv(session, report, progress):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    writer.writerow(report.headers())
+    for rows in report.chunks(session, progress):
+        writer.writerows([_value(v) for v in row] for row in rows)
+        yield buffer.getvalue()
+
+        buffer.seek(0)
+        buffer.truncate()
+
+    yield buffer.getvalue()
+
+
+def _xlsx_value(value):
+    value = _value(value)
+    if isinstance(value, str):
+        return ILLEGAL_CHARACTERS_RE.sub('', value)
+
+    return value
+
+
+def _xlsx(session, report, progress):
+    # A write-only workbook streams rows to disk as they are appended; the finished file is then streamed back.
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(report.name)
+
+    sheet.append(report.headers())
+    for rows in report.chunks(session, progress):
+        for row in rows:
+            sheet.append([_xlsx_value(v) for v in row])
+
+    (fd, path) = tempfile.mkstemp(suffix='.xlsx')
+    try:
+        os.close(fd)
+        workbook.save(path)
+
+        with open(path, 'rb') as f:
+            while True:
+                data = f.read(FILE_CHUNK_SIZE)
+                if not data:
+                    break
+                yield data
+    finally:
+        os.remove(path)
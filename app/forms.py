@@ -1,16 +1,17 @@
 from datetime import date
 
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileRequired, FileAllowed
 from wtforms import StringField, PasswordField, BooleanField, SubmitField, SelectField, TextAreaField, \
     HiddenField, IntegerField, DateField
 from wtforms.validators import DataRequired, Optional
 
 from app import base_data
 from app.models import Cepod, Side, Occurrence, InguinalHerniaType, Complexity, AnestheticType, Pain
-from app.util.form_utils import choice_for_bool, coerce_for_bool, choice_for_enum, coerce_for_enum
+from app.util.form_utils import choice_for_bool, coerce_for_bool, choice_for_enum, coerce_for_enum, filter_for_id
 from app.validators import validate_pain_comments, validate_aware_of_mesh, validate_infection, validate_seroma, \
     validate_numbness, validate_perioperative_complication, validate_post_operative_antibiotics, \
-    validate_antibiotics_iv_days, validate_antibiotics_oral_days
+    validate_antibiotics_iv_days, validate_antibiotics_oral_days, validate_patient_id, validate_age_to
 
 
 def _readonly_render_kw(readonly):
@@ -27,6 +28,17 @@ class LoginForm(FlaskForm):
     submit = SubmitField('Sign In')
 
 
+class JobForm(FlaskForm):
+    report_name = HiddenField('Report')
+    format = HiddenField('Format')
+
+
+class ImportForm(FlaskForm):
+    importer = SelectField('Import', validators=[DataRequired()])
+    file = FileField('File', validators=[FileRequired(), FileAllowed(['csv', 'xlsx'], 'CSV or Excel files only.')])
+    submit = SubmitField('Import')
+
+
 class UserForm(FlaskForm):
     name = StringField('Name', validators=[DataRequired()])
     email = StringField('Email', validators=[DataRequired()])
@@ -79,6 +91,7 @@ class PatientSearchForm(FlaskForm):
     hospital_number = StringField('Hospital Number', validators=[Optional()])
     birth_year = IntegerField('Year of Birth', validators=[Optional()])
     age = IntegerField('Age', validators=[Optional()])
+    age_to = IntegerField('Age (to)', validators=[Optional(), validate_age_to])
     center_id = SelectField('Center', validators=[Optional()])
     gender = SelectField('Gender', choices=[('', 'Any'), ('M', 'Male'), ('F', 'Female')], validators=[Optional()])
     phone = StringField('Phone #', validators=[Optional()])
@@ -107,8 +120,8 @@ class EventForm(FlaskForm):
     type = StringField('Type', render_kw={'readonly': True})
     date = DateField('Date', default=date.today)
 
-    patient_id = SelectField('Patient', render_kw={'readonly': True})
-    center_id = SelectField('Center')
+    patient_id = HiddenField('Patient', filters=[filter_for_id()], validators=[validate_patient_id])
+    center_id = SelectField('Center', coerce=int)
     comments = TextAreaField('Comments')
 
     created_by = HiddenField('Created By')
@@ -0,0 +1,310 @@
+import csv
+import datetime
+from collections import namedtuple
+from types import SimpleNamespace
+
+from flask import current_app
+from openpyxl import load_workbook
+from werkzeug.datastructures import MultiDict
+from wtforms import HiddenField
+
+from app.admin import backfill, discharge_tracker, event_summary
+from app.forms import PatientEditForm, InguinalMeshHerniaRepairForm, FollowupForm, DischargeForm
+from app.models import Patient, Center, MeshType, User
+from app.route_helper import event_helper
+from app.route_helper.choices import id_choices
+from app.route_helper.patient_helper import copy_to_patient
+
+IMPORT_BATCH_SIZE = 500
+IMPORT_FORMATS = ('csv', 'xlsx')
+
+RowError = namedtuple('RowError', ['row', 'field', 'message'])
+ImportResult = namedtuple('ImportResult', ['rows', 'imported', 'errors'])
+
+
+def find_importer(name):
+    if name not in IMPORTERS:
+        raise ValueError('Unknown import {}.'.format(name))
+
+    return IMPORTERS[name]
+
+
+def import_file(session, importer, path, format, user, progress=None):
+    """Imports the rows of a CSV or Excel file, returning an ImportResult with an error for each rejected field."""
+    return import_rows(session, importer, read_rows(path, format), user, progress)
+
+
+def import_rows(session, importer, rows, user, progress=None):
+    """Validates each row, a dict of column name to text, with the same form and validators as the web pages and
+    bulk inserts the valid ones in transactions of IMPORT_BATCH_SIZE rows. The data maintained by the session hooks
+    for single inserts (discharge tracking, event summaries and the search index) is then rebuilt set-wise.
+
+    Rows are numbered as in a spreadsheet, so the first row after the header is row 2.
+    """
+    lookups = Lookups(session, importer)
+
+    errors = []
+    batch = []
+    imported = 0
+    number = 1
+    for (number, row) in enumerate(rows, start=2):
+        (mapping, row_errors) = importer.validate(row, lookups)
+        errors.extend(RowError(number, field, message) for (field, message) in row_errors)
+        if mapping is None:
+            continue
+
+        mapping.update(created_by_id=user.id, updated_by_id=user.id, version_id=1)
+        batch.append(mapping)
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            imported += _insert(session, importer, batch)
+            batch = []
+            if progress:
+                progress(number - 1)
+
+    imported += _insert(session, importer, batch)
+    if imported:
+        importer.rebuild(session)
+        session.commit()
+
+    return ImportResult(rows=number - 1, imported=imported, errors=errors)
+
+
+def write_errors(errors, f):
+    writer = csv.writer(f)
+    writer.writerow(['Row', 'Field', 'Error'])
+    writer.writerows(errors)
+
+
+def read_rows(path, format):
+    if format == 'csv':
+        return _read_csv(path)
+    elif format == 'xlsx':
+        return _read_xlsx(path)
+    else:
+        raise ValueError('Unknown import format {}.'.format(format))
+
+
+def count_rows(path, format):
+    if format == 'xlsx':
+        workbook = load_workbook(path, read_only=True)
+        try:
+            return max(0, (workbook.active.max_row or 1) - 1)
+        finally:
+            workbook.close()
+
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        return max(0, sum(1 for _ in csv.reader(f)) - 1)
+
+
+class Lookups:
+    """Names and ids read once per import, so that resolving a row takes no queries."""
+
+    def __init__(self, session, importer):
+        self.ids = {entity: _names(session, entity) for entity in (Center, MeshType, User)}
+        self.choices = importer.choices(session)
+        self.patient_ids = set(id for (id,) in session.query(Patient.id)) if importer.needs_patients else set()
+
+    def id(self, entity, name):
+        return self.ids[entity].get(name.strip().lower())
+
+
+class Importer:
+    name = None
+    title = None
+    needs_patients = False
+
+    # Columns holding the name of a Center, MeshType or User, which are given to the form as the id field
+    named_columns = {'center': ('center_id', Center)}
+    required_columns = ('center',)
+
+    def form_class(self):
+        raise NotImplementedError()
+
+    def copy(self, form, target):
+        raise NotImplementedError()
+
+    def entity(self):
+        raise NotImplementedError()
+
+    def choices(self, session):
+        return dict(center_id=id_choices(session, Center, include_empty=False))
+
+    def rebuild(self, session):
+        raise NotImplementedError()
+
+    def columns(self):
+        form = self.form_class()(formdata=MultiDict(), meta={'csrf': False})
+        named = {field for (field, _) in self.named_columns.values()}
+        columns = [name for name in form.data if name not in named and name not in IGNORED_FIELDS]
+        return list(self.named_columns) + columns
+
+    def validate(self, row, lookups):
+        """Returns the insert mapping of the row, or None, and the (column, message) errors found."""
+        row = {k.strip(): v.strip() for (k, v) in row.items() if k and v and v.strip()}
+        errors = [(column, 'A value is required.') for column in self.required_columns if column not in row]
+
+        for (column, (field, entity)) in self.named_columns.items():
+            if column in row:
+                id = lookups.id(entity, row.pop(column))
+                if id is None:
+                    errors.append((column, 'Unable to find a {} with this name.'.format(entity.__name__)))
+                else:
+                    row[field] = str(id)
+
+        form = self.form_class()(formdata=MultiDict(row), meta={'csrf': False})
+        for (name, values) in lookups.choices.items():
+            getattr(form, name).choices = values
+
+        if not form.validate():
+            named = {field: column for (column, (field, _)) in self.named_columns.items()}
+            reported = {column for (column, _) in errors}
+            errors.extend((named.get(field, field), message)
+                          for (field, messages) in form.errors.items() if named.get(field, field) not in reported
+                          for message in messages)
+
+        errors.extend(self.check(form, lookups))
+        if errors:
+            return None, errors
+
+        target = SimpleNamespace()
+        self.copy(form, target)
+        # Leaving out empty values lets the column defaults apply
+        return self.mapping({k: v for (k, v) in vars(target).items() if v is not None}), []
+
+    def check(self, form, lookups):
+        return []
+
+    def mapping(self, values):
+        return values
+
+
+class PatientImporter(Importer):
+    name = 'Patient'
+    title = 'Patients'
+
+    def form_class(self):
+        return PatientEditForm
+
+    def copy(self, form, target):
+        copy_to_patient(form, target)
+
+    def entity(self):
+        return Patient
+
+    def mapping(self, values):
+        # The birth year is a hybrid property and dob_year is kept by a validator, neither of which bulk inserts use
+        birth_year = values.pop('birth_year', None)
+        if birth_year:
+            values.update(dob=datetime.date(birth_year, 1, 1), dob_year=birth_year, dob_year_only=True)
+
+        return values
+
+    def rebuild(self, session):
+        current_app.search_backend.rebuild(session)
+        backfill.phones(session)
+
+
+class EventImporter(Importer):
+    needs_patients = True
+    required_columns = ('center', 'patient_id', 'date')
+
+    def __init__(self, helper, form_class, title, named_columns=None):
+        self.helper = helper
+        self.name = helper.name()
+        self.title = title
+        self.named_columns = dict(Importer.named_columns, **(named_columns or {}))
+
+        # The patient is checked against the ids read up front rather than with a query per row
+        self._form_class = type('Import' + form_class.__name__, (form_class,), dict(patient_id=HiddenField('Patient')))
+
+    def form_class(self):
+        return self._form_class
+
+    def copy(self, form, target):
+        self.helper.copy_to_event(form, target)
+        target.type = self.entity().__mapper__.polymorphic_identity
+
+    def entity(self):
+        return self.helper.clazz()
+
+    def choices(self, session):
+        return self.helper.choices(session)
+
+    def check(self, form, lookups):
+        try:
+            patient_id = int(form.patient_id.data)
+        except (TypeError, ValueError):
+            return [('patient_id', 'A patient id must be given.')]
+
+        if patient_id not in lookups.patient_ids:
+            return [('patient_id', 'Unable to find a patient with id {}.'.format(patient_id))]
+
+        return []
+
+    def rebuild(self, session):
+        discharge_tracker.rebuild(session)
+        event_summary.rebuild(session)
+
+
+# Form fields that are not data or are set by the import itself
+IGNORED_FIELDS = {'id', 'version', 'type', 'age', 'next_action', 'created_by', 'created_at', 'updated_by',
+                  'updated_at', 'submit', 'csrf_token'}
+
+IMPORTERS = {importer.name: importer for importer in [
+    PatientImporter(),
+    EventImporter(event_helper.InguinalMeshHerniaRepairEventHelper(), InguinalMeshHerniaRepairForm,
+                  'Inguinal Mesh Hernia Repairs',
+                  dict(mesh_type=('mesh_type_id', MeshType),
+                       primary_surgeon=('primary_surgeon_id', User),
+                       secondary_surgeon=('secondary_surgeon_id', User),
+                       tertiary_surgeon=('tertiary_surgeon_id', User))),
+    EventImporter(event_helper.FollowupEventHelper(), FollowupForm, 'Follow-ups',
+                  dict(attendee=('attendee_id', User))),
+    EventImporter(event_helper.DischargeEventHelper(), DischargeForm, 'Discharges'),
+]}
+
+
+def _insert(session, importer, mappings):
+    if not mappings:
+        return 0
+
+    # Joined table inheritance needs each Event's generated id to insert its subclass row
+    session.bulk_insert_mappings(importer.entity(), mappings, return_defaults=importer.needs_patients)
+    session.commit()
+    return len(mappings)
+
+
+def _names(session, entity):
+    return {name.strip().lower(): id for (id, name) in session.query(entity.id, entity.name)}
+
+
+def _read_csv(path):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            yield {k: v or '' for (k, v) in row.items() if k is not None}
+
+
+def _read_xlsx(path):
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        headers = [str(h).strip() if h is not None else None for h in next(rows, [])]
+        for values in rows:
+            if any(v is not None for v in values):
+                yield {h: _text(v) for (h, v) in zip(headers, values) if h}
+    finally:
+        workbook.close()
+
+
+def _text(value):
+    # Cell values as the web forms would post them
+    if value is None:
+        return ''
+    elif isinstance(value, datetime.datetime):
+        return value.date().isoformat()
+    elif isinstance(value, datetime.date):
+        return value.isoformat()
+    elif isinstance(value, float) and value.is_integer():
+        return str(int(value))
+
+    return str(value)
@@ -0,0 +1,247 @@
+import json
+import logging
+import os
+import socket
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import current_app, has_app_context
+from sqlalchemy import or_
+
+from app import analytics, export, importer
+from app.admin import data_quality, discharge_tracker
+from app.models import Job, JobStatus, LONG_TEXT_LENGTH
+from app.util.routing import READ_REPLICA_KEY
+from application import db
+
+
+def run_export(session, job, parameters, progress):
+    report = export.find_report(parameters.get('report_name'))
+    format = parameters.get('format', 'xlsx')
+    if format not in export.EXPORT_FORMATS:
+        raise ValueError('Unknown export format {}.'.format(format))
+
+    total = report.count(session)
+    with open(result_path(job, export.filename(report, format)), 'wb') as f:
+        for data in export.export(session, report, format, lambda done: progress(done, total)):
+            f.write(data.encode('utf-8') if isinstance(data, str) else data)
+
+    return 'Exported {} {} rows.'.format(total, report.name)
+
+
+def run_rebuild_tracker(session, job, parameters, progress):
+    diff = discharge_tracker.check(session)
+    discharge_tracker.rebuild(session)
+    session.commit()
+
+    return discharge_tracker.format_diff(diff).replace('\n', ' ')
+
+
+def run_data_quality(session, job, parameters, progress):
+    issues = data_quality.scan(session)
+    with open(result_path(job, 'data_quality.csv'), 'w', newline='') as f:
+        data_quality.write_csv(issues, f)
+
+    return data_quality.summarise(issues)
+
+
+def run_outcomes(session, job, parameters, progress):
+    frames = analytics.load(session)
+    progress(1, 2)
+    analytics.write_excel(frames, result_path(job, 'outcomes.xlsx'))
+
+    return 'Analysed {} repairs, {} follow-ups and {} discharges.'.format(
+        len(frames.repairs), len(frames.followups), len(frames.discharges))
+
+
+def run_import(session, job, parameters, progress):
+    entity_importer = importer.find_importer(parameters.get('importer'))
+    (path, format) = (parameters['path'], parameters['format'])
+
+    try:
+        total = importer.count_rows(path, format)
+        result = importer.import_file(session, entity_importer, path, format, job.created_by,
+                                      lambda done: progress(done, total))
+    finally:
+        os.remove(path)
+
+    with open(result_path(job, 'import_errors.csv'), 'w', newline='') as f:
+        importer.write_errors(result.errors, f)
+
+    return 'Imported {} of {} {} rows, {} errors.'.format(result.imported, result.rows, entity_importer.name,
+                                                          len(result.errors))
+
+
+JOB_TYPES = {
+    'export': run_export,
+    'rebuild_tracker': run_rebuild_tracker,
+    'data_quality': run_data_quality,
+    'outcomes': run_outcomes,
+    'import': run_import,
+}
+
+# Jobs that only read the registry, so may read from the read replica
+READ_ONLY_JOBS = {'export', 'data_quality', 'outcomes'}
+
+
+def result_path(job, name):
+    directory = job_runner().directory
+    os.makedirs(directory, exist_ok=True)
+
+    job.result_name = name
+    job.result_path = os.path.join(directory, '{}-{}'.format(job.id, name))
+    return job.result_path
+
+
+def upload_path(filename):
+    """A path in the jobs directory for a file uploaded for a job, which the job removes once it has read it."""
+    directory = os.path.join(job_runner().directory, 'uploads')
+    os.makedirs(directory, exist_ok=True)
+
+    return os.path.join(directory, '{}-{}'.format(uuid.uuid4().hex, filename))
+
+
+def job_runner():
+    return current_app.job_runner
+
+
+class JobRunner:
+    """Runs jobs off the request thread, tracking them in the Jobs table so that any worker process can report
+    on them. With max_workers of 0 jobs run synchronously when submitted, which is what the unit tests use.
+
+    Each job is tracked in a session of its own, committed as progress is made so that SQLite is never left locked
+    for the length of a job, and does its work in another, so that committing progress never commits the job's work.
+
+    A thread beats the heartbeat of the jobs this process owns every heartbeat_seconds, and fails any job whose
+    heartbeat has stopped for three beats, as the process running it has gone (a restart or a crash)."""
+
+    def __init__(self, app, directory, max_workers, heartbeat_seconds=30):
+        self.app = app
+        self.directory = directory
+        self.heartbeat_seconds = heartbeat_seconds
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job') \
+            if max_workers > 0 else None
+
+        self._stopped = threading.Event()
+        self._heartbeat = None
+        if self.executor:
+            self._heartbeat = threading.Thread(target=self._beat_forever, name='job-heartbeat', daemon=True)
+            self._heartbeat.start()
+
+    @property
+    def owner(self):
+        # Worked out each time, as gunicorn may fork the process after the runner was created
+        return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+    def submit(self, session, type, parameters, user):
+        if type not in JOB_TYPES:
+            raise ValueError('Unknown job type {}.'.format(type))
+
+        job = Job(type=type, parameters=json.dumps(parameters), status=JobStatus.Queued, progress=0,
+                  created_by=user, owner=self.owner, heartbeat_at=datetime.now())
+        session.add(job)
+        session.commit()
+
+        if self.executor:
+            self.executor.submit(self.run, job.id)
+        else:
+            self.run(job.id)
+
+        return job.id
+
+    def run(self, job_id):
+        # Popping an app context removes the thread's scoped session, so only push one when running off the
+        # request thread.
+        if has_app_context() and current_app._get_current_object() is self.app:
+            return self._run_in_session(job_id)
+
+        with self.app.app_context():
+            self._run_in_session(job_id)
+
+    def _run_in_session(self, job_id):
+        # A plain session from the same factory, so the registry's session hooks still apply
+        session = db.session.session_factory()
+        try:
+            self._run(session, job_id)
+        finally:
+            session.close()
+
+    def _run(self, session, job_id):
+        job = session.query(Job).get(job_id)
+        if job.status != JobStatus.Queued:
+            # Failed as stale while it waited
+            return
+
+        job.status = JobStatus.Running
+        job.started_at = datetime.now()
+        job.owner = self.owner
+        job.heartbeat_at = job.started_at
+        session.commit()
+
+        def progress(done, total):
+            job.progress = min(99, int(100 * done / total)) if total else 0
+            job.heartbeat_at = datetime.now()
+            session.commit()
+
+        # The job itself is tracked on the primary, a read-only job may read the registry from the replica
+        work = db.session.session_factory(info={READ_REPLICA_KEY: job.type in READ_ONLY_JOBS})
+        try:
+            message = JOB_TYPES[job.type](work, job, json.loads(job.parameters), progress)
+            job.status = JobStatus.Succeeded
+            job.progress = 100
+            job.message = message[:LONG_TEXT_LENGTH]
+        except Exception as e:
+            logging.exception('Job {} failed.'.format(job_id))
+            work.rollback()
+            session.rollback()
+
+            job.status = JobStatus.Failed
+            job.message = str(e)[:LONG_TEXT_LENGTH]
+        finally:
+            work.close()
+
+        job.finished_at = datetime.now()
+        session.commit()
+
+    def beat(self, session, now=None):
+        """Beats the heartbeat of this process's unfinished jobs, and fails every unfinished job whose heartbeat
+        stopped more than three heartbeats ago. Returns the number of jobs failed."""
+        now = now or datetime.now()
+        unfinished = Job.status.in_([JobStatus.Queued, JobStatus.Running])
+
+        session.query(Job).filter(unfinished, Job.owner == self.owner) \
+            .update(dict(heartbeat_at=now), synchronize_session=False)
+        failed = session.query(Job) \
+            .filter(unfinished, or_(Job.heartbeat_at.is_(None),
+                                    Job.heartbeat_at < now - timedelta(seconds=3 * self.heartbeat_seconds))) \
+            .update(dict(status=JobStatus.Failed, finished_at=now,
+                         message='Interrupted, as the process running the job stopped.'), synchronize_session=False)
+        session.commit()
+
+        if failed:
+            logging.warning('Failed {} interrupted jobs.'.format(failed))
+        return failed
+
+    def _beat_forever(self):
+        # Beats once straight away, so that jobs interrupted by a restart are failed as it comes back up
+        with self.app.app_context():
+            while True:
+                session = db.session.session_factory()
+                try:
+                    self.beat(session)
+                except Exception:
+                    logging.exception('Job heartbeat failed.')
+                finally:
+                    session.close()
+
+                if self._stopped.wait(self.heartbeat_seconds):
+                    return
+
+    def shutdown(self):
+        self._stopped.set()
+        if self._heartbeat:
+            self._heartbeat.join()
+        if self.executor:
+            self.executor.shutdown(wait=True)
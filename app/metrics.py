@@ -0,0 +1,183 @@
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+
+# name: (help, buckets), each observed once per request
+HISTOGRAMS = {
+    'registry_request_duration_seconds': ('Time taken to handle a request.', SECONDS_BUCKETS),
+    'registry_request_queries': ('SQL statements executed by a request.', QUERY_BUCKETS),
+    'registry_request_sql_seconds': ('Time a request spent executing SQL.', SECONDS_BUCKETS),
+    'registry_request_template_seconds': ('Time a request spent rendering templates.', SECONDS_BUCKETS),
+}
+
+# pool_status key: (name, type, help)
+POOL_METRICS = {
+    'checked_out': ('registry_db_pool_checked_out', 'gauge', 'Connections currently checked out of the pool.'),
+    'capacity': ('registry_db_pool_capacity', 'gauge', 'Connections the pool can hand out, with its overflow.'),
+    'saturation': ('registry_db_pool_saturation', 'gauge', 'Share of the pool capacity checked out.'),
+    'checkouts': ('registry_db_pool_checkouts_total', 'counter', 'Connections checked out of the pool.'),
+    'wait_seconds': ('registry_db_pool_wait_seconds_total', 'counter', 'Time checkouts waited for a connection.'),
+    'timeouts': ('registry_db_pool_timeouts_total', 'counter', 'Checkouts that gave up waiting for a connection.'),
+}
+
+
+def init_app(app):
+    app.metrics = Metrics()
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.jinja_env.template_class = TimedTemplate
+
+
+class RequestMetrics:
+    """What the current request has spent so far, kept in g."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for (i, bound) in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """Request counts and per-route histograms of latency, SQL statements, SQL time and template render time, for
+    this process. Each gunicorn worker keeps its own, so a scrape sees the worker that answered it."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.histograms = {name: {} for name in HISTOGRAMS}
+
+    def record(self, endpoint, method, status, m, duration):
+        observed = {
+            'registry_request_duration_seconds': duration,
+            'registry_request_queries': m.queries,
+            'registry_request_sql_seconds': m.sql_seconds,
+            'registry_request_template_seconds': m.template_seconds,
+        }
+
+        with self._lock:
+            key = (endpoint, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            for (name, value) in observed.items():
+                histograms = self.histograms[name]
+                if endpoint not in histograms:
+                    histograms[endpoint] = Histogram(HISTOGRAMS[name][1])
+                histograms[endpoint].observe(value)
+
+    def render(self, pools=None):
+        """The metrics in the Prometheus text format, with the pool_status of each engine in pools by name."""
+        lines = ['# HELP registry_requests_total Requests handled.', '# TYPE registry_requests_total counter']
+
+        with self._lock:
+            for ((endpoint, method, status), count) in sorted(self.requests.items()):
+                lines.append('registry_requests_total{} {}'.format(
+                    _labels(endpoint=endpoint, method=method, status=status), count))
+
+            for (name, (help, _)) in HISTOGRAMS.items():
+                lines += ['# HELP {} {}'.format(name, help), '# TYPE {} histogram'.format(name)]
+                for (endpoint, histogram) in sorted(self.histograms[name].items()):
+                    lines += _histogram_lines(name, endpoint, histogram)
+
+        for (key, (name, type, help)) in POOL_METRICS.items():
+            samples = [(engine, status[key]) for (engine, status) in sorted((pools or {}).items())
+                       if status.get(key) is not None]
+            if samples:
+                lines += ['# HELP {} {}'.format(name, help), '# TYPE {} {}'.format(name, type)]
+                lines += ['{}{} {}'.format(name, _labels(engine=engine), _number(v)) for (engine, v) in samples]
+
+        return '\n'.join(lines) + '\n'
+
+
+class TimedTemplate(Template):
+    """Adds the time taken to render to the current request's metrics."""
+
+    def render(self, *args, **kwargs):
+        m = _current()
+        if m is None:
+            return super().render(*args, **kwargs)
+
+        start = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            m.template_seconds += time.perf_counter() - start
+
+
+def _current():
+    return g.get('request_metrics') if has_request_context() else None
+
+
+def _start_request():
+    g.request_metrics = RequestMetrics()
+
+
+def _finish_request(response):
+    m = g.pop('request_metrics', None)
+    if m is not None:
+        current_app.metrics.record(request.endpoint or 'unknown', request.method, response.status_code, m,
+                                   time.perf_counter() - m.started)
+
+    return response
+
+
+def _histogram_lines(name, endpoint, histogram):
+    lines = []
+    cumulative = 0
+    for (bound, count) in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        lines.append('{}_bucket{} {}'.format(name, _labels(endpoint=endpoint, le=_number(bound)), cumulative))
+
+    lines += ['{}_bucket{} {}'.format(name, _labels(endpoint=endpoint, le='+Inf'), histogram.count),
+              '{}_sum{} {}'.format(name, _labels(endpoint=endpoint), _number(histogram.sum)),
+              '{}_count{} {}'.format(name, _labels(endpoint=endpoint), histogram.count)]
+    return lines
+
+
+def _labels(**labels):
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                          for (k, v) in labels.items()) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def receive_before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current() is not None:
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def receive_after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    m = _current()
+    started = conn.info.get('query_started')
+    if m is not None and started:
+        m.queries += 1
+        m.sql_seconds += time.perf_counter() - started.pop()
@@ -3,19 +3,25 @@ from datetime import datetime, date
 
 from flask_login import UserMixin
 from password_strength import PasswordStats
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Date, Enum, Boolean, event, func, and_
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Date, Enum, Boolean, Float, Index, event, func, \
+    and_, inspect, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import relationship, validates
 from werkzeug.security import generate_password_hash, check_password_hash
 
+from app.util import phone
+from app.util.serializer import serializer
 from application import db
 
 SHORT_TEXT_LENGTH = 60
 LONG_TEXT_LENGTH = 240
+CLIENT_ID_LENGTH = 36
 
 
 class ExtendedBase:
     def as_dict(self):
-        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+        return serializer(type(self), encode=False).instance(self)
 
     def from_dict(self, d):
         for k, v in d.items():
@@ -80,6 +86,13 @@ class AnestheticType(enum.Enum):
     Other = 5
 
 
+class JobStatus(enum.Enum):
+    Queued = 1
+    Running = 2
+    Succeeded = 3
+    Failed = 4
+
+
 # This is necessary so that the Custom JSONEncoder/Decoder in restful.py can know which enums to
 # encode or decode.
 #
@@ -93,6 +106,7 @@ KNOWN_ENUMS = {
     'Pain': Pain,
     'DrugType': DrugType,
     'AnestheticType': AnestheticType,
+    'JobStatus': JobStatus,
 }
 
 
@@ -149,21 +163,26 @@ class Patient(db.Model, ExtendedBase):
 
     id = Column(Integer(), primary_key=True, autoincrement=True)
     version_id = Column(Integer, nullable=False)
-    name = Column(String(SHORT_TEXT_LENGTH), nullable=False)
+    name = Column(String(SHORT_TEXT_LENGTH), nullable=False, index=True)
     gender = Column(String(1), nullable=False)
     dob = Column(Date(), nullable=True)
     dob_year_only = Column(Boolean(), nullable=True)
+    # Denormalised from dob by _validate_dob so that birth year and age band searches can use an index.
+    dob_year = Column(Integer(), nullable=True, index=True)
     phone_1 = Column(String(20), nullable=True)
     phone_1_comments = Column(String(SHORT_TEXT_LENGTH), nullable=True)
     phone_2 = Column(String(20), nullable=True)
     phone_2_comments = Column(String(SHORT_TEXT_LENGTH), nullable=True)
-    hospital_number = Column(String(SHORT_TEXT_LENGTH), nullable=True)
-    national_id = Column(String(SHORT_TEXT_LENGTH), nullable=True)
+    hospital_number = Column(String(SHORT_TEXT_LENGTH), nullable=True, index=True)
+    national_id = Column(String(SHORT_TEXT_LENGTH), nullable=True, index=True)
     address = Column(String(LONG_TEXT_LENGTH), nullable=True)
 
     center_id = Column(ForeignKey('Centers.id'), nullable=False)
     center = relationship(Center)
 
+    # Generated by offline clients so that a batch they resubmit is not recorded twice, see app/sync.py
+    client_id = Column(String(CLIENT_ID_LENGTH), nullable=True, unique=True)
+
     created_at = Column('created_at', DateTime(), default=datetime.now, nullable=False)
     created_by_id = Column(ForeignKey('Users.id'), nullable=False)
     created_by = relationship(User, foreign_keys=[created_by_id])
@@ -172,7 +191,7 @@ class Patient(db.Model, ExtendedBase):
     updated_by_id = Column(ForeignKey('Users.id'), nullable=False)
     updated_by = relationship(User, foreign_keys=[updated_by_id])
 
-    @property
+    @hybrid_property
     def birth_year(self):
         if self.dob:
             return self.dob.year
@@ -184,6 +203,39 @@ class Patient(db.Model, ExtendedBase):
         self.dob_year_only = True
         self.dob = date(year, 1, 1)
 
+    @birth_year.expression
+    def birth_year(cls):
+        return cls.dob_year
+
+    @classmethod
+    def aged_between(cls, min_age, max_age, today=None):
+        # Ages are recorded as whole years since the birth year, matching the age shown on the patient form.
+        year = (today or date.today()).year
+        return cls.birth_year.between(year - max_age, year - min_age)
+
+    @validates('dob')
+    def _validate_dob(self, key, dob):
+        self.dob_year = dob.year if dob else None
+        return dob
+
+    phones = relationship('PatientPhone', cascade='all, delete-orphan')
+
+    @validates('phone_1', 'phone_2')
+    def _validate_phone(self, key, number):
+        position = 1 if key == 'phone_1' else 2
+        phones = [p for p in self.phones if p.position != position]
+
+        normalised = phone.normalise(number)
+        if normalised:
+            phones.append(PatientPhone(position=position, number=normalised))
+
+        self.phones = phones
+        return number
+
+    __table_args__ = (
+        Index('ix_Patients_updated_at_id', 'updated_at', 'id'),
+    )
+
     __mapper_args__ = {
         "version_id_col": version_id
     }
@@ -192,6 +244,22 @@ class Patient(db.Model, ExtendedBase):
         return self.name
 
 
+class PatientPhone(db.Model):
+    __tablename__ = 'PatientPhones'
+
+    # Normalised copies of Patient.phone_1 and phone_2 (position 1 and 2), maintained by Patient._validate_phone.
+    # number_reversed holds the digits in reverse so that 'ends with' searches are index range scans.
+    patient_id = Column(ForeignKey('Patients.id'), primary_key=True)
+    position = Column(Integer, primary_key=True)
+    number = Column(String(20), nullable=False, index=True)
+    number_reversed = Column(String(20), nullable=False, index=True)
+
+    @validates('number')
+    def _validate_number(self, key, number):
+        self.number_reversed = phone.reversed_digits(number)
+        return number
+
+
 class MeshType(db.Model, ExtendedBase):
     __tablename__ = 'MeshTypes'
 
@@ -248,6 +316,8 @@ class Event(db.Model, ExtendedBase):
 
     comments = Column(String(LONG_TEXT_LENGTH), nullable=False, default='none')
 
+    client_id = Column(String(CLIENT_ID_LENGTH), nullable=True, unique=True)
+
     created_at = Column('created_at', DateTime(), default=datetime.now, nullable=False)
     created_by_id = Column(ForeignKey('Users.id'), nullable=False)
     created_by = relationship(User, foreign_keys=[created_by_id])
@@ -258,6 +328,11 @@ class Event(db.Model, ExtendedBase):
 
     requires_discharge = False
 
+    __table_args__ = (
+        Index('ix_Events_patient_id_date', 'patient_id', 'date'),
+        Index('ix_Events_updated_at_id', 'updated_at', 'id'),
+    )
+
     __mapper_args__ = {
         'version_id_col': version_id,
         'polymorphic_on': type,
@@ -366,51 +441,363 @@ class PatientDischargeTracker(db.Model, ExtendedBase):
     patient_id = Column(ForeignKey('Patients.id'), primary_key=True)
     patient = relationship(Patient)
 
+    center_id = Column(ForeignKey('Centers.id'), nullable=False)
+    center = relationship(Center)
+
     event_date = Column(Date, nullable=False)
 
+    __table_args__ = (
+        Index('ix_PatientDischargeTracker_center_event_date', 'center_id', 'event_date'),
+    )
+
+
+class EventSummary(db.Model):
+    __tablename__ = 'EventSummaries'
+
+    # Event counts by center, month, type, mesh type and primary surgeon, maintained by the before_flush hook below.
+    # Mesh type and surgeon are 0 for events without them so that the key has no nulls.
+    center_id = Column(ForeignKey('Centers.id'), primary_key=True)
+    center = relationship(Center)
+
+    year = Column(Integer, primary_key=True)
+    month = Column(Integer, primary_key=True)
+    type = Column(String(SHORT_TEXT_LENGTH), primary_key=True)
+    mesh_type_id = Column(Integer, primary_key=True, default=0)
+    surgeon_id = Column(Integer, primary_key=True, default=0)
+
+    events = Column(Integer, nullable=False, default=0)
+    complications = Column(Integer, nullable=False, default=0)
+
+    KEY = ('center_id', 'year', 'month', 'type', 'mesh_type_id', 'surgeon_id')
+
+    __table_args__ = (
+        Index('ix_EventSummaries_year_month', 'year', 'month'),
+    )
+
+
+class Tombstone(db.Model):
+    __tablename__ = 'Tombstones'
+
+    # A log of deleted Patients and Events for the change feed, written by the before_flush hook below.
+    id = Column(Integer(), primary_key=True, autoincrement=True)
+    entity = Column(String(SHORT_TEXT_LENGTH), nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime(), default=datetime.now, nullable=False)
+
+    __table_args__ = (
+        Index('ix_Tombstones_deleted_at_id', 'deleted_at', 'id'),
+    )
+
+
+class ReplicationCursor(db.Model):
+    __tablename__ = 'ReplicationCursors'
+
+    # Kept on an edge node: how far each stream of changes has been exported to the central database.
+    node = Column(String(SHORT_TEXT_LENGTH), primary_key=True)
+    stream = Column(String(SHORT_TEXT_LENGTH), primary_key=True)
+    changed_at = Column(DateTime(), nullable=False)
+    last_id = Column(Integer, nullable=False)
+
+
+class Replica(db.Model):
+    __tablename__ = 'Replicas'
+
+    # Kept centrally: the edge version last applied to each replicated record and the central version it became,
+    # so that a record changed centrally since then is reported as a conflict rather than overwritten.
+    entity = Column(String(SHORT_TEXT_LENGTH), primary_key=True)
+    client_id = Column(String(CLIENT_ID_LENGTH), primary_key=True)
+    origin_version = Column(Integer, nullable=False)
+    version_id = Column(Integer, nullable=False)
+    replicated_at = Column(DateTime(), default=datetime.now, onupdate=datetime.now, nullable=False)
+
+
+class ReplicaHeartbeat(db.Model):
+    __tablename__ = 'ReplicaHeartbeats'
+
+    # A single row written to the primary by app.replica and read back from the read replica to measure its lag.
+    id = Column(Integer, primary_key=True)
+    beat_at = Column(DateTime(), nullable=False)
+
+
+class PatientSearchGram(db.Model):
+    __tablename__ = 'PatientSearchGrams'
+
+    # Maintained by app.search after each flush, so there is deliberately no foreign key to Patients; the patient
+    # row has already been deleted by the time its grams are removed.
+    patient_id = Column(Integer, primary_key=True)
+    field = Column(String(20), primary_key=True)
+    gram = Column(String(3), primary_key=True)
+    weight = Column(Float, nullable=False)
+
+    __table_args__ = (
+        Index('ix_PatientSearchGrams_gram_field', 'gram', 'field'),
+    )
+
+
+class Job(db.Model, ExtendedBase):
+    __tablename__ = 'Jobs'
+
+    # Updated by app.jobs from worker threads while the job runs, so not versioned.
+    id = Column(Integer(), primary_key=True, autoincrement=True)
+    type = Column(String(SHORT_TEXT_LENGTH), nullable=False)
+    parameters = Column(String(LONG_TEXT_LENGTH), nullable=False, default='{}')
+    status = Column(Enum(JobStatus), nullable=False, default=JobStatus.Queued)
+    progress = Column(Integer, nullable=False, default=0)
+    message = Column(String(LONG_TEXT_LENGTH), nullable=True)
+
+    result_path = Column(String(LONG_TEXT_LENGTH), nullable=True)
+    result_name = Column(String(SHORT_TEXT_LENGTH), nullable=True)
+
+    created_at = Column('created_at', DateTime(), default=datetime.now, nullable=False)
+    created_by_id = Column(ForeignKey('Users.id'), nullable=False)
+    created_by = relationship(User, foreign_keys=[created_by_id])
+
+    started_at = Column(DateTime(), nullable=True)
+    finished_at = Column(DateTime(), nullable=True)
+
+    # The host:pid of the process running the job, and when it last showed it was still alive
+    owner = Column(String(SHORT_TEXT_LENGTH), nullable=True)
+    heartbeat_at = Column(DateTime(), nullable=True)
+
+    __table_args__ = (
+        Index('ix_Jobs_created_at', 'created_at'),
+    )
+
+    def is_finished(self):
+        return self.status in (JobStatus.Succeeded, JobStatus.Failed)
+
+    def __repr__(self):
+        return "{}: [id='{}', type='{}', status='{}', ...]".format(self.__tablename__, self.id, self.type,
+                                                                   self.status)
+
 
 @event.listens_for(db.session, 'before_flush')
 def receive_before_flush(session, flush_context, instances):
-    for o in session.new:
-        _before_flush(session, o)
-
-    for o in session.dirty:
-        _before_flush(session, o)
-
-
-def _before_flush(session, instance):
-    if isinstance(instance, Discharge):
-        track = session.query(PatientDischargeTracker).filter(
-            PatientDischargeTracker.patient_id == instance.patient_id).first()
-
-        # If patient is tracked and event date is prior to the discharge then stop tracking
-        if track and track.event_date <= instance.date:
-            session.delete(track)
-
-        if not track:
-            last_event_date = session.query(Event.date, func.max(Event.date)).filter(
-                and_(Event.type.in_(InguinalMeshHerniaRepair.INGUINAL_MESH_HERNIA_REPAIR),
-                     Event.patient_id == instance.patient_id)).scalar()
-
-            # If patient is not tracked BUT there is an trackable event after the discharge date then start tracking
-            if last_event_date and last_event_date > instance.date:
-                track = PatientDischargeTracker()
-                track.patient_id = instance.patient_id
-                track.event_date = instance.date
-                session.add(track)
-    elif isinstance(instance, Event):
-        last_discharge_date = session.query(Discharge.date, func.max(Discharge.date)).filter(
-            Discharge.patient_id == instance.patient_id).scalar()
-
-        track = session.query(PatientDischargeTracker).filter(
-            PatientDischargeTracker.patient_id == instance.patient_id).first()
-
-        if not last_discharge_date or last_discharge_date < instance.date:
-            if track:
-                track.event_date = max(instance.date, track.event_date)
-                session.add(track)
-            else:
-                track = PatientDischargeTracker()
-                track.patient_id = instance.patient_id
-                track.event_date = instance.date
-                session.add(track)
+    events = [o for o in list(session.new) + list(session.dirty) if isinstance(o, Event)]
+    if events:
+        _track_discharges(session, events)
+
+    _summarise_events(session)
+    _record_tombstones(session)
+
+
+def _track_discharges(session, events):
+    # Resolve the state of every affected patient with a fixed number of set-based queries, then apply the events in
+    # order against that state. The stored rows of the events being flushed are left out, as they are applied again.
+    references = {e: (_patient_key(e), _center_id(e)) for e in events}
+    patient_ids = {patient for (patient, _) in references.values() if isinstance(patient, int)}
+    flushed_ids = [e.id for e in events if e.id is not None]
+
+    last_discharge_dates = dict(session.query(Discharge.patient_id, func.max(Discharge.date))
+                                .filter(and_(Discharge.patient_id.in_(patient_ids), ~Discharge.id.in_(flushed_ids)))
+                                .group_by(Discharge.patient_id))
+
+    tracks = {t.patient_id: t for t in session.query(PatientDischargeTracker)
+              .filter(PatientDischargeTracker.patient_id.in_(patient_ids))}
+
+    # The (date, center_id) of each discharged patient's latest other event, as app.admin.discharge_tracker has it
+    discharged_ids = {references[e][0] for e in events if isinstance(e, Discharge)} & patient_ids
+    last_events = {}
+    if discharged_ids:
+        for (patient_id, event_date, center_id) in session.query(Event.patient_id, Event.date, Event.center_id) \
+                .filter(and_(Event.type != Discharge.__mapper__.polymorphic_identity,
+                             Event.patient_id.in_(discharged_ids), ~Event.id.in_(flushed_ids))):
+            _note_event(last_events, patient_id, event_date, center_id)
+
+    for instance in events:
+        (patient, center_id) = references[instance]
+        track = tracks.get(patient)
+
+        if isinstance(instance, Discharge):
+            last_discharge_date = last_discharge_dates.get(patient)
+
+            # If patient is tracked and event date is prior to the discharge then stop tracking
+            if track and track.event_date <= instance.date:
+                if track in session.new:
+                    session.expunge(track)
+                else:
+                    session.delete(track)
+                tracks[patient] = None
+            elif not track:
+                last_event = last_events.get(patient)
+
+                # If patient is not tracked BUT there is an trackable event after every discharge then start tracking
+                # from that event
+                if last_event and last_event[0] > max(instance.date, last_discharge_date or instance.date):
+                    (event_date, last_center_id) = last_event
+                    tracks[patient] = _track(session, patient, last_center_id, event_date)
+
+            # Later events in this flush are judged against this discharge too
+            last_discharge_dates[patient] = max(instance.date, last_discharge_date or instance.date)
+        else:
+            last_discharge_date = last_discharge_dates.get(patient)
+
+            if not last_discharge_date or last_discharge_date < instance.date:
+                if track:
+                    if (instance.date, center_id) > (track.event_date, track.center_id):
+                        (track.event_date, track.center_id) = (instance.date, center_id)
+                else:
+                    tracks[patient] = _track(session, patient, center_id, instance.date)
+
+            _note_event(last_events, patient, instance.date, center_id)
+
+
+def _patient_key(instance):
+    # The patient's id, or the patient itself when it is new in this flush and has no id yet
+    added = inspect(instance).attrs['patient'].history.added
+    if added and added[0] is not None and added[0].id is None:
+        return added[0]
+
+    return _id(_current(instance, 'patient_id', 'patient'))
+
+
+def _center_id(instance):
+    return _id(_current(instance, 'center_id', 'center'))
+
+
+def _id(value):
+    # The event forms give ids as strings
+    return int(value) if value is not None else None
+
+
+def _note_event(last_events, patient, event_date, center_id):
+    # The latest event wins, and the highest center among events on the same date
+    if patient not in last_events or (event_date, center_id) > last_events[patient]:
+        last_events[patient] = (event_date, center_id)
+
+
+def _track(session, patient, center_id, event_date):
+    track = PatientDischargeTracker()
+    if isinstance(patient, Patient):
+        track.patient = patient
+    else:
+        track.patient_id = patient
+    track.center_id = center_id
+    track.event_date = event_date
+    session.add(track)
+    return track
+
+
+def _record_tombstones(session):
+    for instance in session.deleted:
+        if isinstance(instance, (Patient, Event)):
+            session.add(Tombstone(entity=Patient.__name__ if isinstance(instance, Patient) else Event.__name__,
+                                  entity_id=instance.id, deleted_at=datetime.now()))
+
+
+def _summarise_events(session):
+    # Net the changes to each EventSummary row, then apply them as atomic increments so that concurrent sessions
+    # do not lose each other's counts.
+    deltas = {}
+
+    def add(key, complication, sign):
+        delta = deltas.setdefault(key, [0, 0])
+        delta[0] += sign
+        delta[1] += sign if complication else 0
+
+    for instance in session.new:
+        if isinstance(instance, Event):
+            add(*_summary(instance, _current), 1)
+
+    # An attribute set after its object has expired has no history of its old value, so read the committed state
+    # of changed events from the database.
+    changed = [i for i in session.deleted if isinstance(i, Event)] + \
+              [i for i in session.dirty if isinstance(i, Event) and session.is_modified(i)]
+    committed = _committed_values(session, [i.id for i in changed])
+
+    for instance in changed:
+        values = committed.get(instance.id)
+        before = _summary(instance, lambda i, name, relationship_name=None: values[name]) if values else None
+        after = _summary(instance, _current) if instance not in session.deleted else None
+        if before != after:
+            if before:
+                add(*before, -1)
+            if after:
+                add(*after, 1)
+
+    summaries = EventSummary.__table__
+    for (key, (events, complications)) in deltas.items():
+        if events == 0 and complications == 0:
+            continue
+
+        where = and_(*[summaries.c[name] == value for (name, value) in zip(EventSummary.KEY, key)])
+        increment = summaries.update().where(where).values(
+            events=summaries.c.events + events, complications=summaries.c.complications + complications)
+
+        if session.execute(increment).rowcount == 0:
+            insert = summaries.insert().values(events=events, complications=complications,
+                                               **dict(zip(EventSummary.KEY, key)))
+            if not _insert_once(session, insert):
+                # Another session inserted the row since the update missed it, so add to theirs
+                session.execute(increment)
+        elif events < 0:
+            session.execute(summaries.delete().where(and_(where, summaries.c.events <= 0)))
+
+
+def _insert_once(session, insert):
+    # In a savepoint, so that an insert that loses a race on the primary key leaves the flush's transaction usable.
+    # Session.begin_nested would flush, which cannot be done from before_flush.
+    connection = session.connection()
+    savepoint = connection.begin_nested()
+    try:
+        connection.execute(insert)
+    except IntegrityError:
+        savepoint.rollback()
+        return False
+
+    savepoint.commit()
+    return True
+
+
+def _summary(instance, get):
+    """The EventSummary key of an event and whether it counts as a complication, using get to read either its
+    current or its committed attribute values. The complication rules match app.admin.event_summary."""
+    event_date = get(instance, 'date')
+    mesh_type_id = 0
+    surgeon_id = 0
+    complication = False
+
+    if isinstance(instance, InguinalMeshHerniaRepair):
+        mesh_type_id = get(instance, 'mesh_type_id', 'mesh_type') or 0
+        surgeon_id = get(instance, 'primary_surgeon_id', 'primary_surgeon') or 0
+        # SQL TRIM only removes spaces
+        complication = len((get(instance, 'complications') or '').strip(' ')) > 0
+    elif isinstance(instance, Followup):
+        complication = bool(get(instance, 'infection') or get(instance, 'seroma') or get(instance, 'numbness'))
+    elif isinstance(instance, Discharge):
+        complication = bool(get(instance, 'perioperative_complication'))
+
+    key = (get(instance, 'center_id', 'center'), event_date.year, event_date.month,
+           type(instance).__mapper__.polymorphic_identity, mesh_type_id, surgeon_id)
+    return key, complication
+
+
+def _current(instance, name, relationship_name=None):
+    # Foreign keys are only synchronised from relationships during the flush, so prefer a newly assigned object.
+    if relationship_name:
+        added = inspect(instance).attrs[relationship_name].history.added
+        if added and added[0] is not None and added[0].id is not None:
+            return added[0].id
+
+    return getattr(instance, name)
+
+
+def _committed_values(session, ids):
+    if not ids:
+        return {}
+
+    events = Event.__table__
+    repairs = InguinalMeshHerniaRepair.__table__
+    followups = Followup.__table__
+    discharges = Discharge.__table__
+
+    query = select([events.c.id, events.c.center_id, events.c.date, repairs.c.mesh_type_id,
+                    repairs.c.primary_surgeon_id, repairs.c.complications, followups.c.infection, followups.c.seroma,
+                    followups.c.numbness, discharges.c.perioperative_complication]) \
+        .select_from(events
+                     .outerjoin(repairs, repairs.c.id == events.c.id)
+                     .outerjoin(followups, followups.c.id == events.c.id)
+                     .outerjoin(discharges, discharges.c.id == events.c.id)) \
+        .where(events.c.id.in_(ids))
+
+    return {row.id: row for row in session.execute(query)}
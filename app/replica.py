@@ -0,0 +1,136 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app, has_request_context, request, session as flask_session
+from sqlalchemy import and_, event, select
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.models import ReplicaHeartbeat
+from app.util.routing import READ_REPLICA_KEY
+from application import db
+
+REPLICA_BIND = 'replica'
+HEARTBEAT_ID = 1
+
+# The Flask session key holding when this browser last committed a change
+LAST_WRITE_KEY = 'last_write_at'
+
+_WROTE_KEY = 'replica_wrote'
+
+
+def init_app(app):
+    if REPLICA_BIND in (app.config.get('SQLALCHEMY_BINDS') or {}):
+        app.replica_router = ReplicaRouter(db.get_engine(app, bind=REPLICA_BIND), db.get_engine(app),
+                                           max_lag=app.config['REPLICA_MAX_LAG_SECONDS'],
+                                           check_seconds=app.config['REPLICA_LAG_CHECK_SECONDS'],
+                                           read_after_write=app.config['REPLICA_READ_AFTER_WRITE_SECONDS'])
+    else:
+        app.replica_router = None
+
+
+def read_replica(f):
+    """Marks a view as read-only, so that its queries may be answered by the read replica."""
+    f.read_replica = True
+    return f
+
+
+class ReplicaRouter:
+    """Decides whether a session's reads can go to the read replica. They can in a view marked with read_replica,
+    or a session with READ_REPLICA_KEY set in its info, unless:
+
+    - the session has written in its current transaction,
+    - the browser committed a change within read_after_write seconds, so it sees what it just saved, or
+    - the replica is more than max_lag seconds behind the primary, or its lag is unknown.
+
+    The lag is measured at most every check_seconds, as how long ago the heartbeat the replica has was written to the
+    primary. The heartbeat is rewritten whenever it is check_seconds old, so an up to date replica shows a lag of up
+    to twice check_seconds.
+    """
+
+    def __init__(self, engine, primary, max_lag=30, check_seconds=5, read_after_write=60):
+        self.engine = engine
+        self.primary = primary
+        self.max_lag = max_lag
+        self.check_seconds = check_seconds
+        self.read_after_write = read_after_write
+        self._lock = threading.Lock()
+        self._checked_at = None
+        self._lag = None
+
+    def use_replica(self, session):
+        if session.info.get(_WROTE_KEY):
+            return False
+
+        if not session.info.get(READ_REPLICA_KEY):
+            if not has_request_context() or not _read_only_view() or self._wrote_recently():
+                return False
+
+        return self.healthy()
+
+    def healthy(self):
+        # One thread claims a due check under the lock and measures outside it, so the others go on with the last
+        # measurement rather than waiting on the databases
+        now = time.monotonic()
+        with self._lock:
+            due = self._checked_at is None or now - self._checked_at >= self.check_seconds
+            if due:
+                self._checked_at = now
+
+        if due:
+            self._lag = self.check()
+
+        lag = self._lag
+        return lag is not None and lag <= self.max_lag
+
+    def check(self):
+        """Writes a new heartbeat to the primary if the last is check_seconds old, and returns how many seconds ago
+        the heartbeat the replica has was written, or None if that is unknown."""
+        table = ReplicaHeartbeat.__table__
+        beat = select([table.c.beat_at]).where(table.c.id == HEARTBEAT_ID)
+        now = datetime.now()
+
+        try:
+            # However many processes check, the heartbeat is only written once every check_seconds
+            with self.primary.begin() as connection:
+                due = and_(table.c.id == HEARTBEAT_ID, table.c.beat_at <= now - timedelta(seconds=self.check_seconds))
+                if connection.execute(table.update().where(due).values(beat_at=now)).rowcount == 0 and \
+                        connection.execute(beat).scalar() is None:
+                    connection.execute(table.insert().values(id=HEARTBEAT_ID, beat_at=now))
+
+            with self.engine.connect() as connection:
+                replica_beat = connection.execute(beat).scalar()
+        except SQLAlchemyError as e:
+            logging.warning('Unable to check the read replica, reading from the primary: {}'.format(e))
+            return None
+
+        if replica_beat is None:
+            return None
+
+        return max(0.0, (now - replica_beat).total_seconds())
+
+    def _wrote_recently(self):
+        last_write = flask_session.get(LAST_WRITE_KEY)
+        return last_write is not None and time.time() - last_write < self.read_after_write
+
+
+def _read_only_view():
+    view = current_app.view_functions.get(request.endpoint)
+    return getattr(view, 'read_replica', False)
+
+
+@event.listens_for(db.session, 'after_flush')
+def receive_after_flush(session, flush_context):
+    session.info[_WROTE_KEY] = True
+
+
+@event.listens_for(db.session, 'after_commit')
+def receive_after_commit(session):
+    if session.info.pop(_WROTE_KEY, None) and has_request_context() and current_app.replica_router is not None:
+        flask_session[LAST_WRITE_KEY] = time.time()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def receive_after_rollback(session):
+    session.info.pop(_WROTE_KEY, None)
@@ -1,8 +1,20 @@
-from application import db
+from flask import current_app, has_app_context
+
+from app.route_helper import reference_cache
 
 
 def id_choices(session, named_entity, include_empty=False, empty_value='(Any)'):
-    return choices(session.query(named_entity).order_by(named_entity.name).all(), include_empty, empty_value)
+    cache = getattr(current_app, 'reference_cache', None) if has_app_context() else None
+
+    if cache and reference_cache.is_cached(named_entity):
+        response = list(cache.choices(session, named_entity))
+    else:
+        response = choices(session.query(named_entity).order_by(named_entity.name).all())
+
+    if include_empty:
+        return [('', empty_value)] + response
+
+    return response
 
 
 def choices(result, include_empty=False, empty_value='(Any)'):
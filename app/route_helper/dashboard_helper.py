@@ -0,0 +1,66 @@
+from collections import OrderedDict
+
+from sqlalchemy import and_, func, or_
+
+from app.models import Center, EventSummary, InguinalMeshHerniaRepair, Followup, Discharge, MeshType, User
+
+EVENT_TYPES = [InguinalMeshHerniaRepair.__mapper__.polymorphic_identity,
+               Followup.__mapper__.polymorphic_identity,
+               Discharge.__mapper__.polymorphic_identity]
+DASHBOARD_MONTHS = 12
+
+
+def dashboard(session, today):
+    """The dashboard tiles, each a small grouped query over EventSummary rather than the event history."""
+    months = _months(today, DASHBOARD_MONTHS)
+    (first_year, first_month) = months[0]
+
+    recent = or_(EventSummary.year > first_year, and_(EventSummary.year == first_year, EventSummary.month >= first_month))
+    repair = EventSummary.type == EVENT_TYPES[0]
+
+    return dict(
+        types=EVENT_TYPES,
+        totals={type: (int(events or 0), int(complications or 0)) for (type, events, complications) in
+                session.query(EventSummary.type, func.sum(EventSummary.events), func.sum(EventSummary.complications))
+                .group_by(EventSummary.type)},
+        by_center=_pivot(session.query(Center.name, EventSummary.type, func.sum(EventSummary.events))
+                         .join(Center, Center.id == EventSummary.center_id)
+                         .group_by(Center.name, EventSummary.type)
+                         .order_by(Center.name)),
+        by_month=_pivot(session.query(EventSummary.year, EventSummary.month, EventSummary.type,
+                                      func.sum(EventSummary.events))
+                        .filter(recent)
+                        .group_by(EventSummary.year, EventSummary.month, EventSummary.type),
+                        rows=['{}-{:02d}'.format(y, m) for (y, m) in months], key_columns=2),
+        by_mesh_type=session.query(MeshType.name, func.sum(EventSummary.events), func.sum(EventSummary.complications))
+            .join(MeshType, MeshType.id == EventSummary.mesh_type_id)
+            .filter(repair)
+            .group_by(MeshType.name)
+            .order_by(MeshType.name).all(),
+        by_surgeon=session.query(User.name, func.sum(EventSummary.events), func.sum(EventSummary.complications))
+            .join(User, User.id == EventSummary.surgeon_id)
+            .filter(repair)
+            .group_by(User.name)
+            .order_by(User.name).all(),
+    )
+
+
+def _months(today, count):
+    months = []
+    (year, month) = (today.year, today.month)
+    for _ in range(count):
+        months.append((year, month))
+        (year, month) = (year, month - 1) if month > 1 else (year - 1, 12)
+
+    return list(reversed(months))
+
+
+def _pivot(query, rows=None, key_columns=1):
+    # Turns (row key..., column, value) results into an ordered {row: {column: value}} table. Keys of more than one
+    # column are joined as year-month.
+    table = OrderedDict((row, {}) for row in rows or [])
+    for result in query:
+        key = result[0] if key_columns == 1 else '{}-{:02d}'.format(*result[:key_columns])
+        table.setdefault(key, {})[result[key_columns]] = int(result[key_columns + 1] or 0)
+
+    return table
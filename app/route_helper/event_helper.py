@@ -1,7 +1,9 @@
+from sqlalchemy.orm import with_polymorphic, joinedload, selectinload
 from wtforms import HiddenField
 
 from app.forms import FollowupForm, InguinalMeshHerniaRepairForm, DischargeForm
-from app.models import Patient, Center, MeshType, User, InguinalMeshHerniaRepair, Followup, Discharge
+from app.models import Center, MeshType, User, Event, InguinalMeshHerniaRepair, Followup, Discharge, \
+    DrugEventAssociation
 from app.route_helper.choices import id_choices
 from app.util.strtobool import strtobool_optional
 
@@ -22,10 +24,60 @@ def find_helper(event):
         return ValueError('Unable to find an event helper for {}.'.format(name))
 
 
+def event_query(session):
+    """Query events of every type with their subclass columns and the relationships the event templates use, so
+    the number of queries does not depend on the number of events."""
+    events = with_polymorphic(Event, '*')
+
+    return session.query(events).options(
+        joinedload(events.center),
+        joinedload(events.created_by),
+        joinedload(events.updated_by),
+        joinedload(events.InguinalMeshHerniaRepair.mesh_type),
+        joinedload(events.InguinalMeshHerniaRepair.primary_surgeon),
+        joinedload(events.InguinalMeshHerniaRepair.secondary_surgeon),
+        joinedload(events.InguinalMeshHerniaRepair.tertiary_surgeon),
+        selectinload(events.InguinalMeshHerniaRepair.antibiotics).joinedload(DrugEventAssociation.drug),
+        joinedload(events.Followup.attendee),
+    )
+
+
+def patient_events(session, patient_id):
+    return event_query(session).filter(Event.patient_id == patient_id).order_by(Event.date, Event.id).all()
+
+
+def render_inline(session, event_ids, render):
+    """Renders the inline form for each of the given events, returning a dict of event id to the rendered body.
+    Events are loaded with one query and the choice lists are built once per event type. Unknown ids are
+    left out."""
+    events = event_query(session).filter(Event.id.in_(event_ids)).all() if event_ids else []
+
+    helpers = {}
+    bodies = {}
+    for event in events:
+        name = type(event).__name__
+        if name not in helpers:
+            helper = find_helper(event)
+            helpers[name] = (helper, helper.choices(session))
+
+        (helper, choices) = helpers[name]
+        form = helper.form(event, True)
+        helper.populate_choices(session, form, choices)
+        bodies[event.id] = render(helper, form, event)
+
+    return bodies
+
+
 class EventHelper:
-    def populate_choices(self, session, form):
-        form.patient_id.choices = id_choices(session, Patient, include_empty=False)
-        form.center_id.choices = id_choices(session, Center, include_empty=False)
+    def choices(self, session):
+        return dict(center_id=id_choices(session, Center, include_empty=False))
+
+    def populate_choices(self, session, form, choices=None):
+        if choices is None:
+            choices = self.choices(session)
+
+        for (name, values) in choices.items():
+            getattr(form, name).choices = values
 
     def copy_to_event(self, form, event):
         event.type = form.type.data
@@ -69,9 +121,6 @@ class DischargeEventHelper(EventHelper):
     def form(self, event, inline):
         return DischargeForm(obj=event, inline=inline)
 
-    def populate_choices(self, session, form):
-        super().populate_choices(session, form)
-
     def copy_to_event(self, form, event):
         super().copy_to_event(form, event)
         event.perioperative_complication = strtobool_optional(form.perioperative_complication.data)
@@ -91,9 +140,10 @@ class FollowupEventHelper(EventHelper):
         form = FollowupForm(obj=event, inline=True)
         return form
 
-    def populate_choices(self, session, form):
-        super().populate_choices(session, form)
-        form.attendee_id.choices = id_choices(session, User, include_empty=False)
+    def choices(self, session):
+        choices = super().choices(session)
+        choices['attendee_id'] = id_choices(session, User, include_empty=False)
+        return choices
 
     def copy_to_event(self, form, event):
         super().copy_to_event(form, event)
@@ -116,12 +166,14 @@ class InguinalMeshHerniaRepairEventHelper(EventHelper):
     def form(self, event, inline):
         return InguinalMeshHerniaRepairForm(obj=event)
 
-    def populate_choices(self, session, form):
-        super().populate_choices(session, form)
-        form.mesh_type_id.choices = id_choices(session, MeshType, include_empty=False)
-        form.primary_surgeon_id.choices = id_choices(session, User, include_empty=True)
-        form.secondary_surgeon_id.choices = id_choices(session, User, include_empty=True)
-        form.tertiary_surgeon_id.choices = id_choices(session, User, include_empty=True)
+    def choices(self, session):
+        choices = super().choices(session)
+        choices['mesh_type_id'] = id_choices(session, MeshType, include_empty=False)
+        surgeons = id_choices(session, User, include_empty=True)
+        choices['primary_surgeon_id'] = surgeons
+        choices['secondary_surgeon_id'] = surgeons
+        choices['tertiary_surgeon_id'] = surgeons
+        return choices
 
     def copy_to_event(self, form, event):
         super().copy_to_event(form, event)
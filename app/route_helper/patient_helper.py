@@ -1,3 +1,9 @@
+from sqlalchemy import and_, or_, case, select
+
+from app.models import Patient, PatientPhone
+from app.util import phone
+
+
 def copy_to_patient(form, patient):
     patient.name = form.name.data
     patient.national_id = form.national_id.data
@@ -10,3 +16,72 @@ def copy_to_patient(form, patient):
     patient.phone_2 = form.phone_2.data
     patient.phone_2_comments = form.phone_2_comments.data
     patient.address = form.address.data
+
+
+PATIENT_LOOKUP_PAGE_SIZE = 20
+PATIENT_LOOKUP_MAX_PAGE_SIZE = 50
+PATIENT_LOOKUP_SUBSTRING_MIN_LENGTH = 3
+
+
+def lookup_patients(session, text, page=1, page_size=PATIENT_LOOKUP_PAGE_SIZE):
+    """Find patients whose name, national id or hospital number starts with the text.
+
+    Prefix matches can use the indexes on those columns. Names are also matched on a substring once the text is
+    long enough to be selective, ranked after the prefix matches. Returns a page of (id, name, national_id,
+    hospital_number) tuples and whether there are more results after it.
+    """
+    text = (text or '').strip()
+    if len(text) == 0:
+        return [], False
+
+    page = max(page, 1)
+    page_size = min(max(page_size, 1), PATIENT_LOOKUP_MAX_PAGE_SIZE)
+
+    prefix = _escape_like(text) + '%'
+    prefix_match = or_(Patient.name.like(prefix, escape='\\'),
+                       Patient.national_id.like(prefix, escape='\\'),
+                       Patient.hospital_number.like(prefix, escape='\\'))
+
+    if text.isdigit():
+        prefix_match = or_(prefix_match, Patient.id == int(text))
+
+    f = prefix_match
+    if len(text) >= PATIENT_LOOKUP_SUBSTRING_MIN_LENGTH:
+        f = or_(f, Patient.name.like('%' + _escape_like(text) + '%', escape='\\'))
+
+    rows = session.query(Patient.id, Patient.name, Patient.national_id, Patient.hospital_number) \
+        .filter(f) \
+        .order_by(case([(prefix_match, 0)], else_=1), Patient.name, Patient.id) \
+        .offset((page - 1) * page_size) \
+        .limit(page_size + 1) \
+        .all()
+
+    return rows[:page_size], len(rows) > page_size
+
+
+def _escape_like(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def phone_filter(text):
+    """Matches patients with a phone number equal to the text, or starting with it when typed in national (0...) or
+    international (+...) form, or else ending with it. Returns None when the text has no digits."""
+    number = phone.normalise(text)
+    if number is None:
+        return None
+
+    if phone.is_complete(number):
+        match = PatientPhone.number == number
+    else:
+        prefix = phone.national_prefix(text)
+        if prefix:
+            match = _prefix_range(PatientPhone.number, prefix)
+        else:
+            match = _prefix_range(PatientPhone.number_reversed, phone.reversed_digits(number))
+
+    return Patient.id.in_(select([PatientPhone.patient_id]).where(match))
+
+
+def _prefix_range(column, prefix):
+    # Unlike LIKE 'prefix%' a range can always use the index, whatever the column collation.
+    return and_(column >= prefix, column < prefix[:-1] + chr(ord(prefix[-1]) + 1))
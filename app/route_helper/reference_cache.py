@@ -0,0 +1,95 @@
+import threading
+import time
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, func
+
+from app.models import Center, User, MeshType, Drug
+from application import db
+
+CACHED_ENTITIES = (Center, User, MeshType, Drug)
+
+_PENDING_KEY = 'reference_cache_pending'
+
+
+class ReferenceCache:
+    """Process-wide cache of the sorted (id, name) choice lists for reference data.
+
+    Entries are evicted as soon as a change to a cached entity is committed through this process. Other
+    processes (e.g. other gunicorn workers) can also change reference data, so an entry older than `ttl`
+    seconds is revalidated against a fingerprint of the entity's `version_id` column before being reused.
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def choices(self, session, entity):
+        name = entity.__name__
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(name)
+
+        if entry:
+            fingerprint, checked_at, result = entry
+            if now - checked_at < self.ttl:
+                return result
+
+            if _fingerprint(session, entity) == fingerprint:
+                with self._lock:
+                    self._entries[name] = (fingerprint, now, result)
+                return result
+
+        fingerprint = _fingerprint(session, entity)
+        result = [(str(id), name) for (id, name) in
+                  session.query(entity.id, entity.name).order_by(entity.name).all()]
+
+        with self._lock:
+            self._entries[name] = (fingerprint, now, result)
+
+        return result
+
+    def invalidate(self, names=None):
+        with self._lock:
+            if names is None:
+                self._entries.clear()
+            else:
+                for name in names:
+                    self._entries.pop(name, None)
+
+
+def is_cached(entity):
+    return entity in CACHED_ENTITIES
+
+
+def _fingerprint(session, entity):
+    # Any insert, update or delete changes at least one of these; updates always bump version_id.
+    return tuple(session.query(func.count(entity.id),
+                               func.coalesce(func.sum(entity.version_id), 0),
+                               func.max(entity.id)).one())
+
+
+@event.listens_for(db.session, 'after_flush')
+def receive_after_flush(session, flush_context):
+    changed = {type(o).__name__ for o in session.new | session.dirty | session.deleted
+               if isinstance(o, CACHED_ENTITIES)}
+
+    if changed:
+        session.info.setdefault(_PENDING_KEY, set()).update(changed)
+
+
+@event.listens_for(db.session, 'after_commit')
+def receive_after_commit(session):
+    changed = session.info.pop(_PENDING_KEY, None)
+
+    if changed and has_app_context():
+        cache = getattr(current_app, 'reference_cache', None)
+        if cache:
+            cache.invalidate(changed)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def receive_after_rollback(session):
+    session.info.pop(_PENDING_KEY, None)
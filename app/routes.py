@@ -1,23 +1,32 @@
 import datetime
 import logging
+import os
 
 from flask import current_app as application
-from flask import request, render_template, flash, redirect, url_for
+from flask import request, render_template, flash, redirect, url_for, stream_with_context, send_file
 from flask_login import current_user, login_user, logout_user, login_required
 from werkzeug.urls import url_parse
-
-from app import constants
-from app.forms import LoginForm, PatientSearchForm, PatientEditForm, UserEditForm
-from app.models import User, Patient, Event, Center, PatientDischargeTracker
-from app.route_helper import event_helper
+from werkzeug.utils import secure_filename
+
+from app import constants, export, importer, jobs, search
+from app.forms import LoginForm, PatientSearchForm, PatientEditForm, UserEditForm, JobForm, ImportForm
+from app.metrics import PROMETHEUS_CONTENT_TYPE
+from app.models import User, Patient, Event, Center, PatientDischargeTracker, Job
+from app.replica import read_replica
+from app.route_helper import dashboard_helper, event_helper
 from app.route_helper.choices import id_choices
-from app.route_helper.patient_helper import copy_to_patient
-from app.util import restful
-from app.util.filter import like_all
+from app.route_helper.patient_helper import copy_to_patient, lookup_patients, phone_filter, \
+    PATIENT_LOOKUP_PAGE_SIZE
+from app.util import engine_profile, restful
+from app.util.filter import like_all, keyset_after
 
 from application import db, login
 
-from sqlalchemy import and_, or_
+from sqlalchemy import and_
+from sqlalchemy.orm import joinedload
+
+INDEX_PAGE_SIZE = 50
+JOBS_PAGE_SIZE = 50
 
 
 @login.user_loader
@@ -47,11 +56,38 @@ def error(e):
 @application.route('/index', methods=['GET'])
 @login_required
 def index():
-    results = []
-    for pdt in db.session.query(PatientDischargeTracker).order_by(PatientDischargeTracker.event_date).all():
-        results.append(pdt.patient)
+    order = [PatientDischargeTracker.center_id, PatientDischargeTracker.event_date, PatientDischargeTracker.patient_id]
+    query = db.session.query(PatientDischargeTracker, Patient, Center) \
+        .join(Patient, Patient.id == PatientDischargeTracker.patient_id) \
+        .join(Center, Center.id == PatientDischargeTracker.center_id) \
+        .order_by(*order)
+
+    after = _discharge_tracker_cursor(request.args.get('after'))
+    if after:
+        query = query.filter(keyset_after(order, after))
+
+    rows = query.limit(INDEX_PAGE_SIZE + 1).all()
+
+    groups = []
+    for (pdt, patient, center) in rows[:INDEX_PAGE_SIZE]:
+        if not groups or groups[-1][0] is not center:
+            groups.append((center, []))
+        groups[-1][1].append(patient)
 
-    return render_template('index.html', title='Index', results=results)
+    next_cursor = None
+    if len(rows) > INDEX_PAGE_SIZE:
+        last = rows[INDEX_PAGE_SIZE - 1][0]
+        next_cursor = '{}:{}:{}'.format(last.center_id, last.event_date.isoformat(), last.patient_id)
+
+    return render_template('index.html', title='Index', groups=groups, next_cursor=next_cursor)
+
+
+def _discharge_tracker_cursor(s):
+    try:
+        center_id, event_date, patient_id = s.split(':')
+        return int(center_id), datetime.date.fromisoformat(event_date), int(patient_id)
+    except (AttributeError, ValueError):
+        return None
 
 
 @application.route('/login', methods=['GET', 'POST'])
@@ -105,6 +141,18 @@ def health_check():
         raise e
 
 
+@application.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    pools = {name: engine_profile.pool_status(engine.pool) for (name, engine) in _engines().items()}
+    return application.response_class(application.metrics.render(pools), content_type=PROMETHEUS_CONTENT_TYPE)
+
+
+@application.route('/pool_status', methods=['GET'])
+def pool_status():
+    status = {name: engine_profile.pool_status(engine.pool) for (name, engine) in _engines().items()}
+    return application.response_class(restful.json_dumps(status), mimetype='application/json')
+
+
 @application.route('/user/self', methods=['GET', 'POST'])
 @login_required
 def user_self():
@@ -180,6 +228,7 @@ def user_create():
 
 @application.route('/patient_search', methods=['GET', 'POST'])
 @login_required
+@read_replica
 def patient_search():
     form = PatientSearchForm()
     form.center_id.choices = id_choices(db.session, Center, include_empty=True)
@@ -189,22 +238,27 @@ def patient_search():
             return redirect(url_for('patient', id=form.id.data))
 
         f = like_all({
-            Patient.name: form.name.data,
-            Patient.national_id: form.national_id.data,
-            Patient.birth_year: form.birth_year.data,
             Patient.gender: form.gender.data,
-            Patient.address: form.address.data,
         })
 
-        f = and_(f, or_(Patient.phone_1.like('%' + form.phone.data + '%'),
-                    Patient.phone_2.like('%' + form.phone.data + '%'), ))
+        if form.birth_year.data:
+            f = and_(f, Patient.birth_year == form.birth_year.data)
+
+        if form.age.data is not None:
+            f = and_(f, Patient.aged_between(form.age.data, form.age_to.data or form.age.data))
+
+        phone_match = phone_filter(form.phone.data)
+        if phone_match is not None:
+            f = and_(f, phone_match)
 
         if form.center_id.data != '':
             f = and_(f, Patient.center_id.is_(form.center_id.data))
 
-        patients = db.session.query(Patient).filter(f).order_by(Patient.name).all()
+        criteria = {field: getattr(form, field).data for field in search.SEARCH_FIELDS}
+        patients = application.search_backend.search(db.session.query(Patient).filter(f), criteria).all()
         return render_template('patient_search.html', title='Patient Search', form=form, results=patients)
-    else:
+    elif not form.is_submitted() and current_user.center is not None:
+        # Defaults to the user's center, but a search with errors keeps what was chosen
         form.center_id.data = str(current_user.center.id)
 
     return render_template('patient_search.html', title='Patient Search', form=form, results=[])
@@ -214,7 +268,7 @@ def patient_search():
 @login_required
 def patient_create():
     patient = Patient()
-    events = db.session.query(Event).filter(Event.patient_id == patient.id).order_by(Event.date).all()
+    events = []
 
     form = PatientEditForm(obj=patient)
     form.center_id.choices = id_choices(db.session, Center, include_empty=True)
@@ -241,11 +295,14 @@ def patient_create():
 @application.route('/patient/<int:id>', methods=['GET', 'POST'])
 @login_required
 def patient(id):
-    patient = db.session.query(Patient).filter(Patient.id == id).first()
+    patient = db.session.query(Patient) \
+        .options(joinedload(Patient.center), joinedload(Patient.created_by), joinedload(Patient.updated_by)) \
+        .filter(Patient.id == id) \
+        .first()
     if patient is None:
         return error('Unable to find patient with id {}.'.format(id))
 
-    events = db.session.query(Event).filter(Event.patient_id == patient.id).order_by(Event.date).all()
+    events = event_helper.patient_events(db.session, patient.id)
 
     form = PatientEditForm(obj=patient)
     form.center_id.choices = id_choices(db.session, Center, include_empty=True)
@@ -278,8 +335,21 @@ def event_inline(id):
     return _event(id, True)
 
 
+@application.route('/event_inline/batch', methods=['GET'])
+@login_required
+def event_inline_batch():
+    ids = [int(id) for id in request.args.get('ids', '').split(',') if id.strip().isdigit()]
+
+    def render(helper, form, event):
+        return render_template(helper.template(True), title=helper.title(),
+                               form=form, event=event, mode='load', inline=True)
+
+    bodies = event_helper.render_inline(db.session, ids, render)
+    return application.response_class(restful.json_dumps(bodies), mimetype='application/json')
+
+
 def _event(id, inline):
-    event = db.session.query(Event).filter(Event.id == id).first()
+    event = event_helper.event_query(db.session).filter(Event.id == id).first()
     if event is None:
         return error('Unable to find an event with id {}.'.format(id))
 
@@ -314,6 +384,10 @@ def event_create_inline(type):
 def _event_create(type, inline):
     helper = event_helper.find_helper(type)
     event = helper.event()
+
+    # Only pre-fills the form, so the patient chosen in it is the one saved
+    event.patient_id = request.args.get('patient_id', type=int)
+
     form = helper.form(event, inline)
     helper.populate_choices(db.session, form)
 
@@ -329,20 +403,152 @@ def _event_create(type, inline):
         return redirect(url_for('event', id=event.id))
 
     _log_errors(form)
+    patient_name = db.session.query(Patient.name).filter(Patient.id == form.patient_id.data).scalar() \
+        if isinstance(form.patient_id.data, int) else None
     return render_template(helper.template(inline), title=helper.title(),
-                           form=form, event=event, mode='create')
+                           form=form, event=event, mode='create', patient_name=patient_name)
+
+
+@application.route('/dashboard', methods=['GET'])
+@login_required
+@read_replica
+def dashboard():
+    return render_template('dashboard.html', title='Dashboard',
+                           **dashboard_helper.dashboard(db.session, datetime.date.today()))
+
+
+@application.route('/reports', methods=['GET'])
+@login_required
+def reports():
+    return render_template('report.html', title='Reports', form=JobForm())
+
+
+@application.route('/report/<string:report_name>', methods=['GET'])
+@login_required
+@read_replica
+def report(report_name):
+    format = request.args.get('format', 'xlsx')
+    if report_name not in export.REPORTS or format not in export.EXPORT_FORMATS:
+        return error('Unable to find a {} report named {}.'.format(format, report_name))
+
+    report = export.find_report(report_name)
+    body = stream_with_context(export.export(db.session, report, format))
+    return application.response_class(
+        body, mimetype=export.MIMETYPES[format],
+        headers={'Content-Disposition': 'attachment; filename="{}"'.format(export.filename(report, format))})
+
+
+@application.route('/import', methods=['GET', 'POST'])
+@login_required
+def import_data():
+    form = ImportForm()
+    form.importer.choices = [(name, i.title) for (name, i) in importer.IMPORTERS.items()]
+
+    if form.validate_on_submit():
+        filename = secure_filename(form.file.data.filename)
+        path = jobs.upload_path(filename)
+        form.file.data.save(path)
+
+        parameters = dict(importer=form.importer.data, path=path, format=filename.rsplit('.', 1)[-1].lower())
+        id = application.job_runner.submit(db.session, 'import', parameters, current_user)
+        return redirect(url_for('job', id=id))
+
+    return render_template('import.html', title='Import Data', form=form, importers=importer.IMPORTERS.values())
+
+
+@application.route('/jobs', methods=['GET'])
+@login_required
+def job_list():
+    results = db.session.query(Job).options(joinedload(Job.created_by)) \
+        .order_by(Job.created_at.desc(), Job.id.desc()).limit(JOBS_PAGE_SIZE).all()
+    return render_template('jobs.html', title='Background Jobs', results=results, form=JobForm())
+
+
+@application.route('/job/create/<string:type>', methods=['POST'])
+@login_required
+def job_create(type):
+    form = JobForm()
+    if type not in jobs.JOB_TYPES or not form.validate_on_submit():
+        return error('Unable to start a {} job.'.format(type))
+
+    parameters = {}
+    if type == 'export':
+        parameters = dict(report_name=form.report_name.data, format=form.format.data or 'xlsx')
+        if parameters['report_name'] not in export.REPORTS or parameters['format'] not in export.EXPORT_FORMATS:
+            return error('Unable to find a {format} report named {report_name}.'.format(**parameters))
+
+    id = application.job_runner.submit(db.session, type, parameters, current_user)
+    return redirect(url_for('job', id=id))
+
+
+@application.route('/job/<int:id>', methods=['GET'])
+@login_required
+def job(id):
+    job = db.session.query(Job).filter(Job.id == id).first()
+    if job is None:
+        return error('Unable to find a job with id {}.'.format(id))
+
+    return render_template('job.html', title='Job {}'.format(job.id), job=job)
+
+
+@application.route('/job_status/<int:id>', methods=['GET'])
+@login_required
+def job_status(id):
+    job = db.session.query(Job).filter(Job.id == id).first()
+    if job is None:
+        return application.response_class(restful.json_dumps(dict(error='No such job')), status=404,
+                                          mimetype='application/json')
+
+    status = dict(id=job.id, type=job.type, status=job.status.name, progress=job.progress, message=job.message,
+                  finished=job.is_finished(),
+                  download=url_for('job_download', id=job.id) if job.result_path else None)
+    return application.response_class(restful.json_dumps(status), mimetype='application/json')
+
+
+@application.route('/job/<int:id>/download', methods=['GET'])
+@login_required
+def job_download(id):
+    job = db.session.query(Job).filter(Job.id == id).first()
+    if job is None or not job.is_finished() or not job.result_path or not os.path.exists(job.result_path):
+        return error('Job {} has no result to download.'.format(id))
+
+    return send_file(job.result_path, as_attachment=True, attachment_filename=job.result_name)
+
+
+@application.route('/patient_lookup', methods=['GET'])
+@login_required
+@read_replica
+def patient_lookup():
+    page = request.args.get('page', 1, type=int)
+    page_size = request.args.get('page_size', PATIENT_LOOKUP_PAGE_SIZE, type=int)
+    rows, more = lookup_patients(db.session, request.args.get('q', ''), page, page_size)
+
+    results = [dict(id=id, name=name, national_id=national_id, hospital_number=hospital_number)
+               for (id, name, national_id, hospital_number) in rows]
+    return application.response_class(restful.json_dumps(dict(results=results, page=page, more=more)),
+                                      mimetype='application/json')
 
 
 @application.route('/prefetch/patients', methods=['GET'])
+@read_replica
 def patients_prefetch():
     return restful.json_dumps(db.session.query(Patient.name).order_by(Patient.name).all())
 
 
 @application.route('/prefetch/centers', methods=['GET'])
+@read_replica
 def centers_prefetch():
     return restful.json_dumps(db.session.query(Center.name).order_by(Center.name).all())
 
 
+def _engines():
+    engines = dict(primary=db.engine)
+    if application.replica_router is not None:
+        engines['replica'] = application.replica_router.engine
+
+    return engines
+
+
 def _field_errors(form):
     errors = []
     for field in form:
@@ -0,0 +1,272 @@
+import sqlite3
+
+from flask import current_app, has_app_context
+from sqlalchemy import DDL, Float, Integer, and_, case, event, false, func, inspect, or_, select, text
+
+from app.models import Patient, PatientSearchGram
+from app.util.filter import like_all
+from application import db
+
+SEARCH_FIELDS = ('name', 'national_id', 'hospital_number', 'address')
+GRAM_LENGTH = 3
+PYTHON_SEARCH_MAX_RESULTS = 500
+
+FTS5_TABLE = 'PatientSearch'
+
+
+def find_backend(name, engine):
+    if name == 'auto':
+        if engine.dialect.name == 'sqlite' and fts5_available():
+            name = 'fts5'
+        else:
+            name = 'ngram'
+
+    if name == 'fts5':
+        backend = Fts5SearchBackend()
+        backend.ensure_index(engine)
+        return backend
+    elif name == 'ngram':
+        return NgramSearchBackend()
+    elif name == 'python':
+        return PythonSearchBackend()
+    else:
+        raise ValueError('Unknown search backend {}.'.format(name))
+
+
+def fts5_available(*args, **kwargs):
+    # The trigram tokenizer, which gives us substring matching, needs SQLite 3.34 or later.
+    if sqlite3.sqlite_version_info < (3, 34, 0):
+        return False
+
+    connection = sqlite3.connect(':memory:')
+    try:
+        options = [row[0] for row in connection.execute('PRAGMA compile_options')]
+        return 'ENABLE_FTS5' in options
+    finally:
+        connection.close()
+
+
+def ngrams(value):
+    s = ' '.join(str(value or '').lower().split())
+    return {s[i:i + GRAM_LENGTH] for i in range(0, len(s) - GRAM_LENGTH + 1)}
+
+
+class SearchBackend:
+    """Filters and ranks a Patient query by free text criteria over the SEARCH_FIELDS.
+
+    Criteria values too short to be indexed are matched with a LIKE filter instead.
+    """
+
+    def search(self, query, criteria):
+        criteria = {f: str(v).strip() for f, v in criteria.items() if v is not None and len(str(v).strip()) > 0}
+        ready = self._ready(query.session)
+        indexed = {f: v for f, v in criteria.items() if ready and len(v) >= GRAM_LENGTH}
+        short = {getattr(Patient, f): v for f, v in criteria.items() if f not in indexed}
+
+        if short:
+            query = query.filter(like_all(short))
+
+        if indexed:
+            return self._search(query, indexed)
+
+        return query.order_by(Patient.name)
+
+    def rebuild(self, session, batch_size=1000):
+        self._rebuild(session.connection(), batch_size)
+
+    def _rebuild(self, connection, batch_size=1000):
+        self.clear(connection)
+
+        # Read in keyset pages rather than streaming, so the index can be written on the same connection meanwhile
+        t = Patient.__table__
+        last_id = None
+        while True:
+            page = select([t.c.id] + [t.c[f] for f in SEARCH_FIELDS]).order_by(t.c.id).limit(batch_size)
+            batch = connection.execute(page if last_id is None else page.where(t.c.id > last_id)).fetchall()
+            if not batch:
+                return
+
+            self.index(connection, batch)
+            last_id = batch[-1].id
+
+    def index(self, connection, patients):
+        raise NotImplementedError()
+
+    def remove(self, connection, patient_ids):
+        raise NotImplementedError()
+
+    def clear(self, connection):
+        raise NotImplementedError()
+
+    def _search(self, query, criteria):
+        raise NotImplementedError()
+
+    def _ready(self, session):
+        return True
+
+
+class Fts5SearchBackend(SearchBackend):
+    """SQLite FTS5 virtual table using the trigram tokenizer, ranked by bm25."""
+
+    def ensure_index(self, engine):
+        # A database created before the search index existed has no table for it, and there are no migrations
+        tables = inspect(engine).get_table_names()
+        if FTS5_TABLE not in tables and Patient.__tablename__ in tables:
+            with engine.begin() as connection:
+                self._rebuild(connection)
+
+    def index(self, connection, patients):
+        self.remove(connection, [p.id for p in patients])
+        connection.execute(text('INSERT INTO {} (rowid, {}) VALUES (:id, {})'.format(
+            FTS5_TABLE, ', '.join(SEARCH_FIELDS), ', '.join(':' + f for f in SEARCH_FIELDS))),
+            [_search_values(p) for p in patients])
+
+    def remove(self, connection, patient_ids):
+        if patient_ids:
+            connection.execute(text('DELETE FROM {} WHERE rowid = :id'.format(FTS5_TABLE)),
+                               [dict(id=id) for id in patient_ids])
+
+    def clear(self, connection):
+        connection.execute(_FTS5_CREATE_SQL)
+        connection.execute(text('DELETE FROM {}'.format(FTS5_TABLE)))
+
+    def _search(self, query, criteria):
+        match = ' AND '.join('{} : "{}"'.format(f, v.replace('"', '""')) for f, v in criteria.items())
+        matches = text('SELECT rowid AS patient_id, rank FROM {0} WHERE {0} MATCH :match'.format(FTS5_TABLE)) \
+            .bindparams(match=match) \
+            .columns(patient_id=Integer, rank=Float) \
+            .alias('matches')
+
+        return query.join(matches, matches.c.patient_id == Patient.id).order_by(matches.c.rank, Patient.name)
+
+
+class NgramSearchBackend(SearchBackend):
+    """Portable trigram side table (PatientSearchGrams), used on MySQL/Aurora and PostgreSQL.
+
+    A patient matches when every trigram of every criterion is present in the corresponding field. Each gram is
+    weighted by 1 / (number of grams in the field), so matches on shorter, more specific values rank first.
+
+    The grams of patients written before the table existed are only added by reindex_search, which on a large
+    registry is too slow to run as a worker starts, so until the table has any rows every criterion is matched with
+    LIKE instead.
+    """
+
+    def __init__(self):
+        self._indexed = False
+
+    def _ready(self, session):
+        if not self._indexed:
+            self._indexed = session.query(PatientSearchGram.patient_id).first() is not None or \
+                session.query(Patient.id).first() is None
+
+        return self._indexed
+
+    def index(self, connection, patients):
+        self.remove(connection, [p.id for p in patients])
+
+        rows = []
+        for p in patients:
+            for f in SEARCH_FIELDS:
+                grams = ngrams(getattr(p, f))
+                rows.extend(dict(patient_id=p.id, field=f, gram=g, weight=1.0 / len(grams)) for g in grams)
+
+        if rows:
+            connection.execute(PatientSearchGram.__table__.insert(), rows)
+
+    def remove(self, connection, patient_ids):
+        if patient_ids:
+            t = PatientSearchGram.__table__
+            connection.execute(t.delete().where(t.c.patient_id.in_(patient_ids)))
+
+    def clear(self, connection):
+        connection.execute(PatientSearchGram.__table__.delete())
+
+    def _search(self, query, criteria):
+        t = PatientSearchGram.__table__
+
+        clauses = []
+        required = 0
+        for f, v in criteria.items():
+            grams = ngrams(v)
+            required += len(grams)
+            clauses.append(and_(t.c.field == f, t.c.gram.in_(grams)))
+
+        matches = select([t.c.patient_id, func.sum(t.c.weight).label('score')]) \
+            .where(or_(*clauses)) \
+            .group_by(t.c.patient_id) \
+            .having(func.count() >= required) \
+            .alias('matches')
+
+        return query.join(matches, matches.c.patient_id == Patient.id) \
+            .order_by(matches.c.score.desc(), Patient.name)
+
+
+class PythonSearchBackend(SearchBackend):
+    """Fallback that needs no index; scans the searchable columns and ranks the matches in Python."""
+
+    def index(self, connection, patients):
+        pass
+
+    def remove(self, connection, patient_ids):
+        pass
+
+    def clear(self, connection):
+        pass
+
+    def _search(self, query, criteria):
+        scored = []
+        columns = [getattr(Patient, f) for f in criteria]
+        # Scanned through the caller's query, so that its filters apply before the results are cut short
+        for row in query.with_entities(Patient.id, *columns).order_by(None).yield_per(1000):
+            score = 0.0
+            for f, v in criteria.items():
+                s = (getattr(row, f) or '').lower()
+                if v.lower() not in s:
+                    break
+                score += len(v) / len(s)
+            else:
+                scored.append((-score, row.id))
+
+        ids = [id for (_, id) in sorted(scored)][:PYTHON_SEARCH_MAX_RESULTS]
+        if not ids:
+            return query.filter(false())
+
+        return query.filter(Patient.id.in_(ids)) \
+            .order_by(case({id: i for (i, id) in enumerate(ids)}, value=Patient.id), Patient.name)
+
+
+def _search_values(patient):
+    values = {f: getattr(patient, f) or '' for f in SEARCH_FIELDS}
+    values['id'] = patient.id
+    return values
+
+
+def _search_fields_modified(patient):
+    attrs = inspect(patient).attrs
+    return any(attrs[f].history.has_changes() for f in SEARCH_FIELDS)
+
+
+_FTS5_CREATE_SQL = text("CREATE VIRTUAL TABLE IF NOT EXISTS {} USING fts5({}, tokenize='trigram')"
+                        .format(FTS5_TABLE, ', '.join(SEARCH_FIELDS)))
+
+event.listen(Patient.__table__, 'after_create',
+             DDL(str(_FTS5_CREATE_SQL)).execute_if(dialect='sqlite', callable_=fts5_available))
+event.listen(Patient.__table__, 'before_drop',
+             DDL('DROP TABLE IF EXISTS {}'.format(FTS5_TABLE)).execute_if(dialect='sqlite'))
+
+
+@event.listens_for(db.session, 'after_flush')
+def receive_after_flush(session, flush_context):
+    backend = getattr(current_app, 'search_backend', None) if has_app_context() else None
+    if not backend:
+        return
+
+    deleted = [o.id for o in session.deleted if isinstance(o, Patient)]
+    changed = [o for o in session.new if isinstance(o, Patient)] + \
+              [o for o in session.dirty if isinstance(o, Patient) and _search_fields_modified(o)]
+
+    if deleted or changed:
+        connection = session.connection()
+        backend.remove(connection, deleted)
+        if changed:
+            backend.index(connection, changed)
@@ -0,0 +1,169 @@
+from collections import namedtuple
+
+from app.models import Patient, Event, InguinalMeshHerniaRepair, Followup, Discharge
+from app.util.serializer import serializer
+
+EVENT_TYPES = {cls.__name__: cls for cls in (InguinalMeshHerniaRepair, Followup, Discharge)}
+
+# The models whose Date, DateTime and Enum columns restful.json_loads should convert in a batch
+SCHEMA = [Patient] + list(EVENT_TYPES.values())
+
+# Columns a client cannot set, they are kept by the server
+PROTECTED_FIELDS = {'id', 'version_id', 'client_id', 'type', 'dob_year', 'created_at', 'created_by_id',
+                    'updated_at', 'updated_by_id'}
+
+Conflict = namedtuple('Conflict', ['entity', 'id', 'client_id', 'version_id', 'submitted_version_id', 'current'])
+Applied = namedtuple('Applied', ['client_id', 'instance', 'status'])
+
+
+class SyncError(Exception):
+    pass
+
+
+class SyncConflict(Exception):
+    def __init__(self, conflicts):
+        super().__init__('{} records were changed on the server since they were read.'.format(len(conflicts)))
+        self.conflicts = conflicts
+
+
+def apply(session, batch, user):
+    """Applies a batch of patients and events recorded offline, returning the status, server id and version of each.
+
+    batch is {"patients": [...], "events": [...]} as decoded by restful.json_loads(s, schema=SCHEMA). Each record
+    without an id is new and must carry a client generated client_id, so that a batch resubmitted after a lost
+    response finds its records already there rather than adding them again. Events give their patient as the
+    server's patient_id or the client_id of a patient as patient_client_id, which may be in the same batch.
+
+    A record with an id updates that record and must carry the version_id it was read at. If the server has a later
+    version the whole batch is rejected with a SyncConflict listing every such record, unless the submitted values
+    are those already held (a resubmitted update). The caller commits, or rolls back on an error, so the batch is
+    applied as a whole or not at all.
+    """
+    if not isinstance(batch, dict):
+        raise SyncError('A batch must be an object of patients and events.')
+
+    patients = _records(batch, 'patients')
+    events = _records(batch, 'events')
+
+    conflicts = []
+    applied = dict(patients=[], events=[])
+
+    existing = _existing(session, Patient, patients)
+    for record in patients:
+        applied['patients'].append(_apply(session, Patient, record, existing, user, conflicts))
+
+    # The new patients need their ids before events can refer to them
+    session.flush()
+    patient_ids = _patient_ids(session, [r['patient_client_id'] for r in events if 'patient_client_id' in r])
+
+    existing = _existing(session, Event, events)
+    for record in events:
+        record = dict(record)
+        if 'patient_client_id' in record:
+            patient_client_id = record.pop('patient_client_id')
+            if patient_client_id not in patient_ids:
+                raise SyncError('Unable to find a patient with client id {}.'.format(patient_client_id))
+            record['patient_id'] = patient_ids[patient_client_id]
+
+        if 'id' in record:
+            entity = Event
+        elif record.get('type') in EVENT_TYPES:
+            entity = EVENT_TYPES[record['type']]
+        else:
+            raise SyncError('Unknown event type {}, expected one of {}.'.format(record.get('type'),
+                                                                                ', '.join(sorted(EVENT_TYPES))))
+
+        applied['events'].append(_apply(session, entity, record, existing, user, conflicts))
+
+    if conflicts:
+        raise SyncConflict(conflicts)
+
+    # Flushed before reporting, so that new records have their ids and updated ones their new versions
+    session.flush()
+    return {name: [dict(client_id=a.client_id, id=a.instance.id, version_id=a.instance.version_id, status=a.status)
+                   for a in records]
+            for (name, records) in applied.items()}
+
+
+def _apply(session, entity, record, existing, user, conflicts):
+    client_id = record.get('client_id')
+    values = {k: v for (k, v) in record.items() if k not in PROTECTED_FIELDS}
+
+    if 'id' in record:
+        instance = session.query(entity).get(record['id'])
+        if instance is None:
+            raise SyncError('Unable to find a {} with id {}.'.format(entity.__name__, record['id']))
+
+        _check_fields(instance, values)
+        changed = {k: v for (k, v) in values.items() if getattr(instance, k) != v}
+        if not changed:
+            return Applied(client_id, instance, 'unchanged')
+
+        if instance.version_id != record.get('version_id'):
+            conflicts.append(Conflict(type(instance).__name__, instance.id, client_id, instance.version_id,
+                                      record.get('version_id'), serializer(type(instance)).instance(instance)))
+            return Applied(client_id, instance, 'conflict')
+
+        for (k, v) in changed.items():
+            setattr(instance, k, v)
+        instance.updated_by = user
+        return Applied(client_id, instance, 'updated')
+
+    if not client_id or not isinstance(client_id, str):
+        raise SyncError('A new {} must have a client_id.'.format(entity.__name__))
+
+    if client_id in existing:
+        return Applied(client_id, existing[client_id], 'existing')
+
+    instance = entity()
+    _check_fields(instance, values)
+    missing = _required_fields(entity) - set(values)
+    if missing:
+        raise SyncError('{} {} is missing {}.'.format(entity.__name__, client_id, ', '.join(sorted(missing))))
+
+    for (k, v) in values.items():
+        setattr(instance, k, v)
+    instance.client_id = client_id
+    instance.created_by = user
+    instance.updated_by = user
+
+    session.add(instance)
+    existing[client_id] = instance
+    return Applied(client_id, instance, 'created')
+
+
+def _records(batch, name):
+    records = batch.get(name, [])
+    if not isinstance(records, list) or not all(isinstance(r, dict) for r in records):
+        raise SyncError('{} must be a list of objects.'.format(name))
+
+    return records
+
+
+def _existing(session, entity, records):
+    # The records already synced, read with one query rather than one per record
+    client_ids = [r['client_id'] for r in records if 'id' not in r and isinstance(r.get('client_id'), str)]
+    if not client_ids:
+        return {}
+
+    return {i.client_id: i for i in session.query(entity).filter(entity.client_id.in_(client_ids))}
+
+
+def _patient_ids(session, client_ids):
+    if not client_ids:
+        return {}
+
+    return dict(session.query(Patient.client_id, Patient.id).filter(Patient.client_id.in_(set(client_ids))))
+
+
+def _check_fields(instance, values):
+    names = {p.key for p in type(instance).__mapper__.column_attrs}
+    unknown = set(values) - names
+    if unknown:
+        raise SyncError('Unknown {} fields {}.'.format(type(instance).__name__, ', '.join(sorted(unknown))))
+
+
+def _required_fields(entity):
+    return {p.key for p in entity.__mapper__.column_attrs
+            if p.key not in PROTECTED_FIELDS
+            and not any(c.nullable or c.default is not None or c.server_default is not None for c in p.columns)}
@@ -2,6 +2,7 @@ import pytest
 
 from app import constants, base_data
 from app.tests import test_data
+from app.tests.query_budget import QueryCounter
 from app.tests.routes.test_login import _login
 from application import create_app
 
@@ -41,3 +42,8 @@ def flask_client(flask_application):
 def flask_client_logged_in(flask_client):
     _login(flask_client, constants.TEST_ACCOUNT_EMAIL, constants.TEST_ACCOUNT_PASSWORD)
     yield flask_client
+
+
+@pytest.fixture(scope="function")
+def query_counter(flask_client_logged_in):
+    yield QueryCounter(flask_client_logged_in)
@@ -0,0 +1,45 @@
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from application import db
+
+
+class QueryCounter:
+    """Counts the SQL statements each request of a test client executes, so that a test can hold a route to a query
+    budget.
+
+    The tests share their session with the requests, so it is emptied before each counted request, which then loads
+    everything itself as it would in a server. The request is made once beforehand, uncounted, so that caches such as
+    the reference cache are warm; pass warm_up=False for a request that writes.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def count(self, url, method='get', warm_up=True, **kwargs):
+        """Returns the response and the statements executed for it."""
+        if warm_up:
+            getattr(self.client, method)(url, **kwargs)
+        db.session.expunge_all()
+
+        statements = []
+
+        def receive_before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(Engine, 'before_cursor_execute', receive_before_cursor_execute)
+        try:
+            response = getattr(self.client, method)(url, **kwargs)
+        finally:
+            event.remove(Engine, 'before_cursor_execute', receive_before_cursor_execute)
+
+        return response, statements
+
+    def assert_budget(self, budget, url, method='get', **kwargs):
+        """Requests url, asserting that it succeeds within budget statements, and returns how many it took."""
+        (response, statements) = self.count(url, method, **kwargs)
+        assert response.status_code == 200, '{} {} responded {}'.format(method.upper(), url, response.status)
+        assert len(statements) <= budget, '{} {} executed {} statements, over its budget of {}:\n{}'.format(
+            method.upper(), url, len(statements), budget, '\n'.join(s.split('\n')[0][:120] for s in statements))
+
+        return len(statements)
@@ -0,0 +1,192 @@
+import datetime
+import json
+
+from flask import url_for
+
+from app.models import Patient, Event, Followup, Tombstone, Center, User, Pain
+from app.tests import test_data
+from application import db
+
+
+def test_api_patients_pages(flask_client_logged_in):
+    for i in range(5):
+        test_data.create_patient(db.session, 'Api Patient {}'.format(i))
+    db.session.commit()
+    expected = [id for (id,) in db.session.query(Patient.id).order_by(Patient.id)]
+
+    for order in ['id', 'updated_at']:
+        ids = []
+        after = None
+        while True:
+            page = _get(flask_client_logged_in, 'api_patients', order=order, limit=2, after=after, fields='id,name')
+            assert all(set(p) == {'id', 'name'} for p in page['results'])
+            ids.extend(p['id'] for p in page['results'])
+
+            after = page['next']
+            if after is None:
+                break
+
+        assert sorted(ids) == expected
+
+
+def test_api_events(flask_client_logged_in):
+    patient = test_data.create_patient(db.session, 'Api Patient')
+    repair = test_data.create_repair(db.session, patient, datetime.date(2020, 1, 1))
+    followup = test_data.create_followup(db.session, patient, datetime.date(2020, 2, 1))
+    db.session.commit()
+
+    events = {e['id']: e for e in _get(flask_client_logged_in, 'api_events', limit=1000)['results']}
+    assert len(events) == db.session.query(Event).count()
+    assert events[repair.id]['cepod'] == 'Cepod.Planned'
+    assert 'pain' not in events[repair.id]
+    assert events[followup.id]['pain'] == 'Pain.No_Pain'
+    assert 'cepod' not in events[followup.id]
+
+    repairs = _get(flask_client_logged_in, 'api_events_of_type', type='InguinalMeshHerniaRepair',
+                   fields='date,cepod')['results']
+    assert {'date': '2020-01-01', 'cepod': 'Cepod.Planned'} in repairs
+    assert all(set(r) == {'date', 'cepod'} for r in repairs)
+
+
+def test_api_errors(flask_client_logged_in):
+    client = flask_client_logged_in
+    assert client.get(url_for('api_events_of_type', type='Surgery')).status_code == 404
+    assert client.get(url_for('api_patients', fields='name,colour')).status_code == 400
+    assert client.get(url_for('api_patients', order='name')).status_code == 400
+    assert client.get(url_for('api_patients', order='updated_at', after='yesterday')).status_code == 400
+
+
+def test_api_changes(flask_client_logged_in, monkeypatch):
+    monkeypatch.setattr('app.api.CHANGES_SETTLE_SECONDS', 0)
+    client = flask_client_logged_in
+
+    (changes, after) = _changes(client, None)
+    assert len(changes['patients']) == db.session.query(Patient).count()
+    assert len(changes['events']) == db.session.query(Event).count()
+    assert _changes(client, after)[0] == {'patients': [], 'events': [], 'deleted': []}
+
+    patient = test_data.create_patient(db.session, 'Changed Patient')
+    followup = test_data.create_followup(db.session, patient, datetime.date(2020, 2, 1))
+    db.session.commit()
+    (changes, after) = _changes(client, after)
+    assert [p['id'] for p in changes['patients']] == [patient.id]
+    assert [e['id'] for e in changes['events']] == [followup.id]
+    assert changes['events'][0]['pain'] == 'Pain.No_Pain'
+
+    patient.name = 'Renamed Patient'
+    db.session.commit()
+    (changes, after) = _changes(client, after)
+    assert [p['name'] for p in changes['patients']] == ['Renamed Patient']
+    assert changes['events'] == []
+
+    db.session.delete(followup)
+    db.session.commit()
+    (changes, after) = _changes(client, after)
+    assert [(d['entity'], d['entity_id']) for d in changes['deleted']] == [('Event', followup.id)]
+    assert db.session.query(Tombstone).count() == 1
+
+
+def test_api_changes_settle(flask_client_logged_in):
+    # Nothing written in the last few seconds is returned yet, so the cursor cannot pass over an open transaction
+    test_data.create_patient(db.session, 'Unsettled Patient')
+    db.session.commit()
+
+    changes = _get(flask_client_logged_in, 'api_changes', limit=1000)
+    assert 'Unsettled Patient' not in [p['name'] for p in changes['patients']]
+    assert flask_client_logged_in.get(url_for('api_changes', after='not a cursor')).status_code == 400
+
+
+def test_api_sync(flask_client_logged_in):
+    client = flask_client_logged_in
+    center = db.session.query(Center).first()
+    attendee = db.session.query(User).first()
+    batch = dict(
+        patients=[dict(client_id='p-1', name='Offline Patient', gender='F', dob='1980-01-01', center_id=center.id)],
+        events=[dict(client_id='e-1', type='Followup', patient_client_id='p-1', date='2020-02-01',
+                     center_id=center.id, attendee_id=attendee.id, pain='Pain.Mild', pain_comments='Aches')])
+
+    result = _sync(client, batch)
+    assert [r['status'] for r in result['patients'] + result['events']] == ['created', 'created']
+    patient = db.session.query(Patient).filter(Patient.client_id == 'p-1').one()
+    followup = db.session.query(Followup).filter(Followup.client_id == 'e-1').one()
+    assert (followup.patient_id, followup.pain) == (patient.id, Pain.Mild)
+    assert patient.dob_year == 1980
+    assert result['events'][0] == dict(client_id='e-1', id=followup.id, version_id=followup.version_id,
+                                       status='created')
+
+    # Resubmitting the batch, as a client would after losing the response, records nothing twice
+    assert [r['status'] for r in _sync(client, batch)['patients']] == ['existing']
+    assert db.session.query(Followup).filter(Followup.patient_id == patient.id).count() == 1
+
+    update = dict(patients=[dict(id=patient.id, version_id=patient.version_id, name='Online Patient')])
+    assert _sync(client, update)['patients'][0]['status'] == 'updated'
+    assert _sync(client, update)['patients'][0]['status'] == 'unchanged'
+
+
+def test_api_sync_conflict(flask_client_logged_in):
+    client = flask_client_logged_in
+    patient = test_data.create_patient(db.session, 'Shared Patient')
+    db.session.commit()
+    version_id = patient.version_id
+
+    patient.name = 'Changed On Server'
+    db.session.commit()
+
+    response = client.post(url_for('api_sync'), json=dict(
+        patients=[dict(id=patient.id, version_id=version_id, name='Changed Offline'),
+                  dict(client_id='p-2', name='Other Patient', gender='M', center_id=patient.center_id)]))
+    assert response.status_code == 409
+    (conflict,) = json.loads(response.data)['conflicts']
+    assert (conflict['id'], conflict['version_id'], conflict['submitted_version_id']) == \
+        (patient.id, patient.version_id, version_id)
+    assert conflict['current']['name'] == 'Changed On Server'
+
+    # Nothing in the batch was applied
+    db.session.expire_all()
+    assert db.session.query(Patient).get(patient.id).name == 'Changed On Server'
+    assert db.session.query(Patient).filter(Patient.client_id == 'p-2').count() == 0
+
+
+def test_api_sync_errors(flask_client_logged_in):
+    client = flask_client_logged_in
+    center_id = db.session.query(Center.id).first()[0]
+    # The failed syncs roll back the session the test shares with the requests, so keep the test user
+    db.session.commit()
+
+    def post(batch):
+        return client.post(url_for('api_sync'), json=batch).status_code
+
+    assert post(dict(patients=[dict(client_id='p-3', name='No Gender', center_id=center_id)])) == 400
+    assert post(dict(patients=[dict(name='No Client Id', gender='F', center_id=center_id)])) == 400
+    assert post(dict(patients=[dict(client_id='p-4', name='Colour', gender='F', center_id=center_id,
+                                    colour='Blue')])) == 400
+    assert post(dict(events=[dict(client_id='e-2', type='Followup', patient_client_id='p-5')])) == 400
+    assert post(dict(events=[dict(client_id='e-3', type='Surgery')])) == 400
+    assert post(dict(events=[dict(client_id='e-4', type='Followup', pain='Pain.Excruciating')])) == 400
+    assert client.post(url_for('api_sync'), data='patients=').status_code == 415
+    assert db.session.query(Patient).filter(Patient.client_id.isnot(None)).count() == 0
+
+
+def _sync(client, batch):
+    response = client.post(url_for('api_sync'), json=batch)
+    assert response.status == '200 OK', response.data
+    return json.loads(response.data)
+
+
+def _changes(client, after):
+    # Follows the feed from after until it is exhausted, returning the changes and the cursor to continue from
+    changes = {'patients': [], 'events': [], 'deleted': []}
+    while True:
+        page = _get(client, 'api_changes', after=after, limit=2)
+        for (name, rows) in changes.items():
+            rows.extend(page[name])
+
+        after = page['next']
+        if not page['more']:
+            return changes, after
+
+
+def _get(client, endpoint, **args):
+    response = client.get(url_for(endpoint, **{k: v for k, v in args.items() if v is not None}))
+    assert response.status == '200 OK'
+    return json.loads(response.data)
@@ -0,0 +1,22 @@
+import datetime
+
+from flask import url_for
+
+from app.tests import test_data
+from application import db
+
+
+def test_dashboard(flask_client_logged_in):
+    today = datetime.date.today()
+    patient = test_data.create_patient(db.session, 'Dashboard Patient')
+    test_data.create_repair(db.session, patient, today, complications='Haematoma')
+    test_data.create_followup(db.session, patient, today)
+    db.session.commit()
+
+    response = flask_client_logged_in.get(url_for('dashboard'))
+    assert response.status == '200 OK'
+
+    html = response.data.decode()
+    assert '1 with complications' in html
+    assert '{}-{:02d}'.format(today.year, today.month) in html
+    assert patient.center.name in html
@@ -0,0 +1,88 @@
+import datetime
+import json
+
+from flask import url_for
+from sqlalchemy import event
+
+from app.admin import discharge_tracker
+from app.models import Center, Discharge, PatientDischargeTracker, User
+from app.tests import test_data
+from application import db
+
+
+def test_event_inline_batch(flask_client_logged_in):
+    flask_client = flask_client_logged_in
+
+    counts = []
+    for num_events in [1, 10]:
+        patient = test_data.create_patient(db.session, 'Batch patient {}'.format(num_events), birth_year=1970)
+        events = []
+        for i in range(num_events):
+            day = datetime.date(2020, 1, 1) + datetime.timedelta(days=i)
+            events.append(test_data.create_repair(db.session, patient, day))
+            events.append(test_data.create_followup(db.session, patient, day))
+            events.append(test_data.create_discharge(db.session, patient, day))
+        db.session.commit()
+        ids = [e.id for e in events]
+        db.session.expunge_all()
+
+        url = url_for('event_inline_batch', ids=','.join(str(id) for id in ids + [0]))
+
+        # Warm the reference data cache so only the event queries are counted
+        flask_client.get(url)
+        db.session.expunge_all()
+
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        response = flask_client.get(url)
+        event.remove(db.engine, 'before_cursor_execute', listener)
+
+        assert response.status == '200 OK'
+        bodies = json.loads(response.data)
+        assert sorted(int(id) for id in bodies) == sorted(ids)
+        assert all('event_form_container' in body for body in bodies.values())
+        counts.append(len(statements))
+
+    assert counts[0] == counts[1]
+
+
+def test_event_inline_batch_empty(flask_client_logged_in):
+    response = flask_client_logged_in.get(url_for('event_inline_batch', ids='x,'))
+    assert response.status == '200 OK'
+    assert json.loads(response.data) == {}
+
+
+def test_event_forms_keep_tracking(flask_client_logged_in):
+    flask_client = flask_client_logged_in
+    (first, second) = db.session.query(Center).order_by(Center.id).limit(2)
+    attendee = db.session.query(User).first()
+    patient = test_data.create_patient(db.session, 'Tracked Patient', center=first, birth_year=1970)
+    test_data.create_repair(db.session, patient, datetime.date(2020, 1, 10))
+    db.session.commit()
+    patient_id = patient.id
+
+    # Forms post ids as strings
+    response = flask_client.post(url_for('event_create', type='Followup'), data=dict(
+        patient_id=str(patient_id), center_id=str(second.id), date='2020-02-01', attendee_id=str(attendee.id),
+        pain='No_Pain'))
+    assert response.status == '302 FOUND'
+    assert _tracked() == [(patient_id, second.id, datetime.date(2020, 2, 1))]
+
+    response = flask_client.post(url_for('event_create', type='Discharge'), data=dict(
+        patient_id=str(patient_id), center_id=str(first.id), date='2020-02-05'))
+    assert response.status == '302 FOUND'
+    assert _tracked() == []
+
+    # Moving the discharge back before the follow-up tracks the patient again
+    discharge = db.session.query(Discharge).filter(Discharge.patient_id == patient_id).one()
+    response = flask_client.post(url_for('event', id=discharge.id), data=dict(
+        id=str(discharge.id), patient_id=str(patient_id), center_id=str(first.id), date='2020-01-20'))
+    assert response.status == '302 FOUND'
+    assert _tracked() == [(patient_id, second.id, datetime.date(2020, 2, 1))]
+    assert not any(discharge_tracker.check(db.session))
+
+
+def _tracked():
+    db.session.expire_all()
+    return [(t.patient_id, t.center_id, t.event_date) for t in db.session.query(PatientDischargeTracker)]
@@ -0,0 +1,51 @@
+from datetime import date
+
+from flask import url_for
+
+from app.models import Center
+from app.tests import test_data
+from application import db
+
+
+def test_index_pending_discharge(flask_client_logged_in):
+    flask_client = flask_client_logged_in
+    centers = db.session.query(Center).order_by(Center.id).all()
+
+    pending = test_data.create_patient(db.session, 'Pending Patient', center=centers[0])
+    test_data.create_repair(db.session, pending, date(2020, 1, 1))
+
+    other_center = test_data.create_patient(db.session, 'Other Center Patient', center=centers[1])
+    test_data.create_repair(db.session, other_center, date(2020, 1, 2))
+
+    discharged = test_data.create_patient(db.session, 'Discharged Patient', center=centers[0])
+    test_data.create_repair(db.session, discharged, date(2020, 1, 1))
+    db.session.commit()
+    test_data.create_discharge(db.session, discharged, date(2020, 1, 3))
+    db.session.commit()
+
+    response = flask_client.get(url_for('index'))
+    assert response.status == '200 OK'
+
+    page = response.data.decode()
+    assert 'Pending Patient' in page
+    assert 'Other Center Patient' in page
+    assert 'Discharged Patient' not in page
+    assert page.index(centers[0].name) < page.index('Pending Patient') < page.index(centers[1].name)
+
+
+def test_index_paginated(flask_client_logged_in, monkeypatch):
+    flask_client = flask_client_logged_in
+    monkeypatch.setattr('app.routes.INDEX_PAGE_SIZE', 2)
+
+    for i in range(3):
+        patient = test_data.create_patient(db.session, 'Patient {}'.format(i))
+        test_data.create_repair(db.session, patient, date(2020, 1, i + 1))
+    db.session.commit()
+
+    first = flask_client.get(url_for('index')).data.decode()
+    assert 'Patient 0' in first and 'Patient 1' in first and 'Patient 2' not in first
+
+    after = first[first.index('after=') + len('after='):].split('"')[0].replace('%3A', ':')
+    second = flask_client.get(url_for('index', after=after)).data.decode()
+    assert 'Patient 0' not in second and 'Patient 2' in second
+    assert 'after=' not in second
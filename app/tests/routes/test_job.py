@@ -0,0 +1,171 @@
+import csv
+import datetime
+import io
+import json
+import os
+
+import pytest
+from flask import current_app, url_for
+from openpyxl import load_workbook
+
+from app import jobs
+from app.models import Job, JobStatus, Patient, PatientDischargeTracker, User
+from app.tests import test_data
+from application import db
+
+
+@pytest.fixture
+def job_client(flask_client_logged_in, tmp_path):
+    current_app.job_runner.directory = str(tmp_path)
+    yield flask_client_logged_in
+
+
+def test_export_job(job_client):
+    response = job_client.post(url_for('job_create', type='export'), data=dict(report_name='Patient', format='xlsx'))
+    assert response.status == '302 FOUND'
+
+    job = _job()
+    assert response.location.endswith(url_for('job', id=job.id))
+    assert job.status == JobStatus.Succeeded
+    assert job.progress == 100
+    assert job.result_name == 'Patient.xlsx'
+
+    status = json.loads(job_client.get(url_for('job_status', id=job.id)).data)
+    assert status['status'] == 'Succeeded'
+    assert status['finished']
+
+    response = job_client.get(status['download'])
+    assert response.status == '200 OK'
+    rows = list(load_workbook(io.BytesIO(response.data), read_only=True)['Patient'].values)
+    assert len(rows) - 1 == db.session.query(Patient).count()
+
+    assert 'Patient.xlsx' in job_client.get(url_for('job_list')).data.decode()
+
+
+def test_export_job_unknown_report(job_client):
+    response = job_client.post(url_for('job_create', type='export'), data=dict(report_name='Nothing'))
+    assert 'Unable to find a xlsx report named Nothing' in response.data.decode()
+    assert db.session.query(Job).count() == 0
+
+
+def test_data_quality_job(job_client):
+    patient = test_data.create_patient(db.session, 'Unrepaired Patient', birth_year=1990)
+    test_data.create_followup(db.session, patient, datetime.date(1985, 1, 1))
+    db.session.commit()
+
+    job_client.post(url_for('job_create', type='data_quality'))
+    job = _job()
+    assert job.status == JobStatus.Succeeded
+
+    with open(job.result_path) as f:
+        issues = {(row['Patient Id'], row['Issue']) for row in csv.DictReader(f)}
+    assert (str(patient.id), 'Follow-up without an earlier repair') in issues
+    assert (str(patient.id), 'Dated before the patient was born') in issues
+
+
+def test_rebuild_tracker_job(job_client):
+    patient = test_data.create_patient(db.session, 'Tracked Patient')
+    test_data.create_repair(db.session, patient, datetime.date(2020, 1, 10))
+    db.session.commit()
+    db.session.query(PatientDischargeTracker).delete()
+    db.session.commit()
+
+    job_client.post(url_for('job_create', type='rebuild_tracker'))
+    job = _job()
+    assert job.status == JobStatus.Succeeded
+    assert job.message.startswith('Missing: 1')
+    assert db.session.query(PatientDischargeTracker).filter_by(patient_id=patient.id).count() == 1
+    assert job_client.get(url_for('job_download', id=job.id)).status == '200 OK'
+
+
+def test_failed_job(job_client, monkeypatch):
+    def fail(session, job, parameters, progress):
+        raise RuntimeError('Out of paper')
+
+    monkeypatch.setitem(jobs.JOB_TYPES, 'data_quality', fail)
+    job_client.post(url_for('job_create', type='data_quality'))
+
+    job = _job()
+    assert job.status == JobStatus.Failed
+    assert job.message == 'Out of paper'
+    assert 'has no result to download' in job_client.get(url_for('job_download', id=job.id)).data.decode()
+
+
+def test_import_job(job_client):
+    upload = 'name,gender,birth_year,center\nUploaded Patient,F,1980,Korogwe\nUploaded Patient,X,1980,Korogwe\n'
+    response = job_client.post(url_for('import_data'),
+                               data=dict(importer='Patient', file=(io.BytesIO(upload.encode()), 'patients.csv')),
+                               content_type='multipart/form-data')
+    assert response.status == '302 FOUND'
+
+    job = _job()
+    assert job.status == JobStatus.Succeeded
+    assert job.message == 'Imported 1 of 2 Patient rows, 1 errors.'
+    assert db.session.query(Patient).filter(Patient.name == 'Uploaded Patient').count() == 1
+
+    report = list(csv.reader(io.StringIO(job_client.get(url_for('job_download', id=job.id)).data.decode())))
+    assert report == [['Row', 'Field', 'Error'], ['3', 'gender', 'Not a valid choice']]
+    assert os.listdir(os.path.join(current_app.job_runner.directory, 'uploads')) == []
+
+
+def test_import_page(job_client):
+    page = job_client.get(url_for('import_data')).data.decode()
+    assert 'primary_surgeon' in page
+    assert 'Follow-ups' in page
+
+
+def test_failed_job_progress_commits_no_work(job_client, monkeypatch):
+    def fail(session, job, parameters, progress):
+        test_data.create_patient(session, 'Half Imported')
+        progress(1, 2)
+        raise RuntimeError('Out of paper')
+
+    monkeypatch.setitem(jobs.JOB_TYPES, 'rebuild_tracker', fail)
+    job_client.post(url_for('job_create', type='rebuild_tracker'))
+
+    assert _job().status == JobStatus.Failed
+    assert db.session.query(Patient).filter(Patient.name == 'Half Imported').count() == 0
+
+
+def test_interrupted_jobs_fail(job_client):
+    runner = current_app.job_runner
+    user = db.session.query(User).first()
+    now = datetime.datetime.now()
+    stopped = now - datetime.timedelta(seconds=4 * runner.heartbeat_seconds)
+
+    db.session.add_all([
+        Job(type='export', status=JobStatus.Running, created_by=user, owner='gone:1', heartbeat_at=stopped),
+        Job(type='export', status=JobStatus.Queued, created_by=user, owner='gone:2', heartbeat_at=None),
+        Job(type='export', status=JobStatus.Running, created_by=user, owner='alive:1', heartbeat_at=now),
+        Job(type='export', status=JobStatus.Running, created_by=user, owner=runner.owner, heartbeat_at=stopped),
+        Job(type='export', status=JobStatus.Succeeded, created_by=user, owner='gone:3', heartbeat_at=stopped),
+    ])
+    db.session.commit()
+
+    assert runner.beat(db.session, now) == 2
+    db.session.expire_all()
+    assert [(job.owner, job.status) for job in db.session.query(Job).order_by(Job.id)] == [
+        ('gone:1', JobStatus.Failed), ('gone:2', JobStatus.Failed), ('alive:1', JobStatus.Running),
+        (runner.owner, JobStatus.Running), ('gone:3', JobStatus.Succeeded)]
+
+
+def _job():
+    # Jobs run in their own session, so drop whatever the test's session has cached
+    db.session.expire_all()
+    return db.session.query(Job).one()
+
+
+def test_outcomes_job(job_client):
+    patient = test_data.create_patient(db.session, 'Outcome Patient')
+    test_data.create_repair(db.session, patient, datetime.date(2020, 1, 10))
+    test_data.create_followup(db.session, patient, datetime.date(2020, 2, 10))
+    db.session.commit()
+
+    job_client.post(url_for('job_create', type='outcomes'))
+    job = _job()
+    assert job.status == JobStatus.Succeeded, job.message
+    assert job.message == 'Analysed 1 repairs, 1 follow-ups and 0 discharges.'
+
+    workbook = load_workbook(job.result_path, read_only=True)
+    assert 'Outcomes by center' in workbook.sheetnames
+    assert 'Pain by complexity' in workbook.sheetnames
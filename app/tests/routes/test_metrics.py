@@ -0,0 +1,30 @@
+from flask import url_for
+
+from app.tests import test_data
+from application import db
+
+
+def test_metrics(flask_client_logged_in):
+    client = flask_client_logged_in
+    patient = test_data.create_patient(db.session, 'Measured Patient', birth_year=1980)
+    db.session.commit()
+
+    assert client.get(url_for('patient', id=patient.id)).status_code == 200
+    assert client.get(url_for('patient', id=patient.id)).status_code == 200
+
+    response = client.get(url_for('prometheus_metrics'))
+    assert response.content_type.startswith('text/plain; version=0.0.4')
+    lines = response.data.decode('utf-8').splitlines()
+
+    assert 'registry_requests_total{endpoint="patient",method="GET",status="200"} 2' in lines
+    assert 'registry_request_duration_seconds_count{endpoint="patient"} 2' in lines
+    assert 'registry_request_duration_seconds_bucket{endpoint="patient",le="+Inf"} 2' in lines
+    assert _value(lines, 'registry_request_queries_sum{endpoint="patient"}') > 0
+    assert _value(lines, 'registry_request_sql_seconds_sum{endpoint="patient"}') > 0
+    assert _value(lines, 'registry_request_template_seconds_sum{endpoint="patient"}') > 0
+    assert '# TYPE registry_request_queries histogram' in lines
+
+
+def _value(lines, sample):
+    (value,) = [line.split(' ')[-1] for line in lines if line.startswith(sample + ' ')]
+    return float(value)
@@ -1,7 +1,12 @@
+import datetime
+
 from flask import url_for
+from sqlalchemy import event
 
 from app.models import Patient
+from app.tests import test_data
 from app.util.filter import like_all
+from application import db
 
 
 def test_patient(flask_client_logged_in):
@@ -9,7 +14,8 @@ def test_patient(flask_client_logged_in):
     test_patient_dict = dict(name='Test Patient',
                              gender='F',
                              center_id='1',
-                             birth_year=1960
+                             birth_year=1960,
+                             phone_1='0712 345 678'
                              )
 
     # Create a Patient and assert the form return ok.
@@ -18,14 +24,70 @@ def test_patient(flask_client_logged_in):
     assert 'New patient {} has been recorded'.format(test_patient_dict['name']) in str(response.data)
 
     # Assert that the patient we create is actually in the database
-    from application import db
     f = like_all({Patient.name: test_patient_dict['name']})
     patients = db.session.query(Patient).filter(f).order_by(Patient.name).all()
     assert len(patients) == 1
     assert patients[0].name == test_patient_dict['name']
 
     # Assert that patient_search can find the patient
-    #
-    # response = flask_client.post(url_for('patient_search'),
-    #                              data=test_patient_dict, follow_redirects=True)
-    # assert response.status == '200 OK'
+    response = flask_client.post(url_for('patient_search'),
+                                 data=dict(name='test pat', phone='', center_id=''), follow_redirects=True)
+    assert response.status == '200 OK'
+    assert test_patient_dict['name'] in str(response.data)
+
+    response = flask_client.post(url_for('patient_search'),
+                                 data=dict(birth_year='1960', phone='', center_id=''), follow_redirects=True)
+    assert test_patient_dict['name'] in str(response.data)
+
+    response = flask_client.post(url_for('patient_search'),
+                                 data=dict(birth_year='1961', phone='', center_id=''), follow_redirects=True)
+    assert test_patient_dict['name'] not in str(response.data)
+
+    age = datetime.date.today().year - 1960
+    response = flask_client.post(url_for('patient_search'),
+                                 data=dict(age=str(age - 5), age_to=str(age), phone='', center_id=''),
+                                 follow_redirects=True)
+    assert test_patient_dict['name'] in str(response.data)
+
+    for (age_from, age_to, message) in [('', '30', 'An age must be given'), ('40', '30', 'Must be at least the age')]:
+        response = flask_client.post(url_for('patient_search'),
+                                     data=dict(age=age_from, age_to=age_to, phone='', center_id=''),
+                                     follow_redirects=True)
+        assert message in str(response.data)
+
+    for phone, found in [('+255 712 345 678', True), ('0712-34', True), ('5678', True), ('0787', False)]:
+        response = flask_client.post(url_for('patient_search'),
+                                     data=dict(phone=phone, center_id=''), follow_redirects=True)
+        assert (test_patient_dict['name'] in str(response.data)) == found
+
+
+def test_patient_page_queries(flask_client_logged_in):
+    flask_client = flask_client_logged_in
+
+    counts = []
+    for num_events in [1, 10]:
+        patient = test_data.create_patient(db.session, 'Patient with {} events'.format(num_events), birth_year=1970)
+        for i in range(num_events):
+            day = datetime.date(2020, 1, 1) + datetime.timedelta(days=i)
+            test_data.create_repair(db.session, patient, day)
+            test_data.create_followup(db.session, patient, day)
+            test_data.create_discharge(db.session, patient, day)
+        db.session.commit()
+        patient_id = patient.id
+        db.session.expunge_all()
+
+        # Warm the reference data cache so only the timeline queries are counted
+        flask_client.get(url_for('patient', id=patient_id))
+        db.session.expunge_all()
+
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        response = flask_client.get(url_for('patient', id=patient_id))
+        event.remove(db.engine, 'before_cursor_execute', listener)
+
+        assert response.status == '200 OK'
+        assert response.data.decode().count('card-event-body') == 3 * num_events
+        counts.append(len(statements))
+
+    assert counts[0] == counts[1]
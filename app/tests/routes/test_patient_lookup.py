@@ -0,0 +1,82 @@
+import json
+
+from flask import url_for
+
+from app.models import Patient, User, Center, Discharge
+from app.route_helper.patient_helper import PATIENT_LOOKUP_MAX_PAGE_SIZE
+from application import db
+
+
+def test_patient_lookup(flask_client_logged_in):
+    flask_client = flask_client_logged_in
+    _create_patients(['Amina Juma', 'Juma Hassan', 'Neema Mushi'])
+
+    response = _lookup(flask_client, q='jum')
+    assert response.status == '200 OK'
+
+    # Prefix matches are ranked before substring matches
+    assert [p['name'] for p in json.loads(response.data)['results']] == ['Juma Hassan', 'Amina Juma']
+
+    # Substring matching only applies once the text is selective enough
+    assert [p['name'] for p in json.loads(_lookup(flask_client, q='ne').data)['results']] == ['Neema Mushi']
+    assert json.loads(_lookup(flask_client, q='').data)['results'] == []
+
+
+def test_patient_lookup_paginated(flask_client_logged_in):
+    flask_client = flask_client_logged_in
+    _create_patients(['Patient {:03d}'.format(i) for i in range(PATIENT_LOOKUP_MAX_PAGE_SIZE + 10)])
+
+    first = json.loads(_lookup(flask_client, q='patient', page_size=1000).data)
+    assert len(first['results']) == PATIENT_LOOKUP_MAX_PAGE_SIZE
+    assert first['more']
+
+    second = json.loads(_lookup(flask_client, q='patient', page=2, page_size=1000).data)
+    assert [p['name'] for p in second['results']][0] == 'Patient {:03d}'.format(PATIENT_LOOKUP_MAX_PAGE_SIZE)
+    assert not second['more']
+
+
+def test_event_create_validates_patient(flask_client_logged_in):
+    flask_client = flask_client_logged_in
+
+    response = flask_client.post(url_for('event_create', type='Discharge'),
+                                 data=dict(patient_id='999999', center_id='1', date='2020-01-01'),
+                                 follow_redirects=True)
+    assert response.status == '200 OK'
+    assert 'Unable to find a patient with id 999999' in str(response.data)
+
+    patient = _create_patients(['Asha Mrema'])[0]
+    response = flask_client.get(url_for('event_create', type='Discharge', patient_id=patient.id))
+    assert 'Asha Mrema' in str(response.data)
+
+
+def test_event_create_saves_chosen_patient(flask_client_logged_in):
+    flask_client = flask_client_logged_in
+    (opened_for, chosen) = _create_patients(['Asha Mrema', 'Neema Mushi'])
+    center = db.session.query(Center).first()
+
+    # The form posts back to the URL it was opened with, which names the pre-filled patient
+    response = flask_client.post(url_for('event_create', type='Discharge', patient_id=opened_for.id),
+                                 data=dict(patient_id=str(chosen.id), center_id=str(center.id), date='2020-01-01'))
+    assert response.status == '302 FOUND'
+    assert db.session.query(Discharge.patient_id).one() == (chosen.id,)
+
+    # A form sent back with errors shows the chosen patient
+    response = flask_client.post(url_for('event_create', type='Discharge', patient_id=opened_for.id),
+                                 data=dict(patient_id=str(chosen.id), center_id=str(center.id), date='x'))
+    assert 'Neema Mushi' in response.data.decode()
+    assert 'Asha Mrema' not in response.data.decode()
+
+
+def _lookup(flask_client, **kwargs):
+    return flask_client.get(url_for('patient_lookup', **kwargs))
+
+
+def _create_patients(names):
+    user = db.session.query(User).first()
+    center = db.session.query(Center).first()
+
+    patients = [Patient(name=name, gender='F', center=center, created_by=user, updated_by=user) for name in names]
+    db.session.add_all(patients)
+    db.session.commit()
+
+    return patients
@@ -0,0 +1,72 @@
+from datetime import date, timedelta
+
+import pytest
+from flask import url_for
+
+from app.models import Patient
+from app.tests import test_data
+from application import db
+
+# The statements each route may execute with the reference cache warm, however much data there is
+BUDGETS = [
+    ('index', lambda s: url_for('index'), 2),
+    ('patient', lambda s: url_for('patient', id=s.patient_id), 4),
+    ('event', lambda s: url_for('event', id=s.repair_id), 4),
+    ('event_inline', lambda s: url_for('event_inline', id=s.repair_id), 4),
+    ('event_inline_batch', lambda s: url_for('event_inline_batch', ids=','.join(map(str, s.event_ids))), 4),
+    ('event_create', lambda s: url_for('event_create', type='Followup', patient_id=s.patient_id), 2),
+    ('dashboard', lambda s: url_for('dashboard'), 6),
+    ('job_list', lambda s: url_for('job_list'), 2),
+    ('patient_lookup', lambda s: url_for('patient_lookup', q='Budget'), 2),
+    ('api_patients', lambda s: url_for('api_patients'), 2),
+    ('api_events', lambda s: url_for('api_events'), 2),
+    ('api_changes', lambda s: url_for('api_changes'), 4),
+]
+
+
+class Seeded:
+    """A patient whose history grows, among a growing number of other patients."""
+
+    def __init__(self, session):
+        self.session = session
+        patient = test_data.create_patient(session, 'Budget Patient', birth_year=1980)
+        repair = test_data.create_repair(session, patient, date(2020, 1, 1))
+        session.commit()
+
+        (self.patient_id, self.repair_id) = (patient.id, repair.id)
+        self.event_ids = [repair.id]
+        self.size = 0
+
+    def grow(self, n):
+        patient = self.session.query(Patient).get(self.patient_id)
+        for i in range(self.size, self.size + n):
+            other = test_data.create_patient(self.session, 'Budget Other {}'.format(i), birth_year=1980)
+            test_data.create_repair(self.session, other, date(2020, 1, 1) + timedelta(days=i))
+
+            events = [test_data.create_followup(self.session, patient, date(2020, 2, 1) + timedelta(days=i)),
+                      test_data.create_discharge(self.session, patient, date(2020, 2, 1) + timedelta(days=i))]
+            self.session.flush()
+            self.event_ids += [e.id for e in events]
+
+        self.session.commit()
+        self.size += n
+
+
+@pytest.mark.parametrize('endpoint, url, budget', BUDGETS, ids=[endpoint for (endpoint, _, _) in BUDGETS])
+def test_query_budget(query_counter, endpoint, url, budget):
+    seeded = Seeded(db.session)
+
+    counts = []
+    for n in (1, 10):
+        seeded.grow(n)
+        counts.append(query_counter.assert_budget(budget, url(seeded)))
+
+    assert counts[0] == counts[1], '{} makes more queries as the data grows: {}'.format(endpoint, counts)
+
+
+def test_patient_search_budget(query_counter):
+    seeded = Seeded(db.session)
+    seeded.grow(5)
+
+    query_counter.assert_budget(3, url_for('patient_search'), method='post',
+                                data=dict(name='Budget', center_id=''))
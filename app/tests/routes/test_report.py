@@ -0,0 +1,65 @@
+import csv
+import datetime
+import io
+
+from flask import url_for
+from openpyxl import load_workbook
+
+from app import export
+from app.models import Drug, DrugEventAssociation, Patient, Event, Pain
+from app.tests import test_data
+from application import db
+
+
+def test_report_csv(flask_client_logged_in, monkeypatch):
+    monkeypatch.setattr(export, 'EXPORT_CHUNK_SIZE', 2)
+    _create_events()
+
+    response = flask_client_logged_in.get(url_for('report', report_name='Episode', format='csv'))
+    assert response.status == '200 OK'
+    assert response.is_streamed
+    assert response.headers['Content-Disposition'] == 'attachment; filename="Episode.csv"'
+
+    rows = list(csv.DictReader(io.StringIO(response.data.decode())))
+    assert len(rows) == db.session.query(Event).count()
+
+    repair = next(r for r in rows if r['Type'] == 'Mesh Hernia Repair' and r['Patient'] == 'Export Patient')
+    assert repair['Cepod'] == 'Planned'
+    assert repair['Antibiotics'] == ', '.join(sorted(d.name for d in db.session.query(Drug).limit(2)))
+    assert repair['Pain'] == ''
+
+    followup = next(r for r in rows if r['Type'] == 'Follow-Up' and r['Patient'] == 'Export Patient')
+    assert followup['Pain'] == 'Mild'
+    assert followup['Cepod'] == ''
+
+
+def test_report_xlsx(flask_client_logged_in, monkeypatch):
+    monkeypatch.setattr(export, 'EXPORT_CHUNK_SIZE', 2)
+    _create_events()
+
+    response = flask_client_logged_in.get(url_for('report', report_name='Patient'))
+    assert response.status == '200 OK'
+    assert response.mimetype == export.MIMETYPES['xlsx']
+
+    sheet = load_workbook(io.BytesIO(response.data), read_only=True)['Patient']
+    rows = list(sheet.values)
+    assert list(rows[0]) == export.find_report('Patient').headers()
+    assert len(rows) - 1 == db.session.query(Patient).count()
+    assert 'Export Patient' in [row[1] for row in rows[1:]]
+
+
+def test_report_unknown(flask_client_logged_in):
+    response = flask_client_logged_in.get(url_for('report', report_name='Patient', format='pdf'))
+    assert 'Unable to find a pdf report named Patient' in response.data.decode()
+
+
+def _create_events():
+    patient = test_data.create_patient(db.session, 'Export Patient', birth_year=1970)
+    repair = test_data.create_repair(db.session, patient, datetime.date(2020, 1, 1))
+    test_data.create_followup(db.session, patient, datetime.date(2020, 2, 1), pain=Pain.Mild)
+    test_data.create_discharge(db.session, patient, datetime.date(2020, 1, 2))
+    db.session.flush()
+
+    for drug in db.session.query(Drug).limit(2):
+        db.session.add(DrugEventAssociation(event_id=repair.id, drug_id=drug.id))
+    db.session.commit()
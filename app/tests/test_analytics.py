@@ -0,0 +1,66 @@
+from datetime import date
+
+import pytest
+
+from app import analytics
+from app.models import Center, Occurrence, Pain, Side, User
+from app.tests import test_data
+
+
+def test_outcomes(database_session):
+    centers = database_session.query(Center).order_by(Center.name).limit(2).all()
+
+    # At the first center one of two repairs recurs, at the second none do
+    first = test_data.create_patient(database_session, 'First', center=centers[0])
+    surgeon = database_session.query(User).first()
+    repair = test_data.create_repair(database_session, first, date(2020, 1, 1), side=Side.Left,
+                                     discharge_date=date(2020, 1, 3), primary_surgeon=surgeon)
+    test_data.create_followup(database_session, first, date(2020, 2, 1), pain=Pain.Mild, infection=True,
+                              seroma=False)
+    test_data.create_discharge(database_session, first, date(2020, 1, 3), post_operative_antibiotics_iv_days=2,
+                               post_operative_antibiotics_oral_days=5)
+    test_data.create_repair(database_session, first, date(2021, 1, 1), side=Side.Left,
+                            occurrence=Occurrence.Recurrent)
+    test_data.create_discharge(database_session, first, date(2021, 1, 2))
+
+    second = test_data.create_patient(database_session, 'Second', center=centers[1])
+    test_data.create_repair(database_session, second, date(2020, 1, 1), side=Side.Left,
+                            discharge_date=date(2020, 1, 2))
+    test_data.create_repair(database_session, second, date(2020, 6, 1), side=Side.Right,
+                            occurrence=Occurrence.Recurrent, discharge_date=date(2020, 6, 2))
+    test_data.create_followup(database_session, second, date(2020, 7, 1), pain=Pain.No_Pain, infection=False,
+                              seroma=True)
+    database_session.commit()
+
+    frames = analytics.load(database_session)
+    assert frames.followups['repair_id'].tolist() == [repair.id, frames.repairs['id'].iloc[-1]]
+
+    result = analytics.outcomes(frames, 'center')
+    first_center = result.loc[centers[0].name]
+    assert first_center['repairs'] == 2
+    assert first_center['recurrence_rate'] == 0.5
+    assert first_center['mean_length_of_stay'] == 1.5
+    assert first_center['infection_rate'] == 1.0
+    assert first_center['mean_antibiotic_days'] == 3.5
+
+    second_center = result.loc[centers[1].name]
+    assert second_center['recurrence_rate'] == 0.0
+    assert second_center['seroma_rate'] == 1.0
+
+    pain = analytics.pain_distribution(frames, 'center')
+    assert pain.loc[centers[0].name, 'Mild'] == 1.0
+    assert pain.loc[centers[1].name, 'No_Pain'] == 1.0
+    assert list(pain.columns) == analytics.PAIN_LEVELS
+
+    for by in ['mesh_type', 'cepod', 'complexity']:
+        assert analytics.outcomes(frames, by)['repairs'].sum() == 4
+    assert analytics.outcomes(frames, 'surgeon')['repairs'].to_dict() == {surgeon.name: 1}
+
+
+def test_outcomes_empty(database_session):
+    frames = analytics.load(database_session)
+    assert len(analytics.outcomes(frames, 'surgeon')) == 0
+    assert len(analytics.pain_distribution(frames, 'cepod')) == 0
+
+    with pytest.raises(ValueError):
+        analytics.outcomes(frames, 'colour')
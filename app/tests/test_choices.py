@@ -0,0 +1,55 @@
+from flask import current_app
+from sqlalchemy import event
+
+from app.models import Center, MeshType, Patient
+from app.route_helper.choices import id_choices
+
+
+def test_id_choices_cached(database_session):
+    statements = _count_statements(database_session)
+
+    first = id_choices(database_session, MeshType)
+    count = len(statements)
+    second = id_choices(database_session, MeshType, include_empty=True)
+
+    assert len(statements) == count
+    assert second == [('', '(Any)')] + first
+    assert [name for (_, name) in first] == sorted(name for (_, name) in first)
+
+
+def test_id_choices_invalidated_on_commit(database_session):
+    before = id_choices(database_session, Center)
+
+    center = Center(name='AAA Hospital', address='Somewhere')
+    database_session.add(center)
+    database_session.commit()
+
+    after = id_choices(database_session, Center)
+    assert len(after) == len(before) + 1
+    assert after[0] == (str(center.id), 'AAA Hospital')
+
+    center.name = 'ZZZ Hospital'
+    database_session.commit()
+
+    assert id_choices(database_session, Center)[-1] == (str(center.id), 'ZZZ Hospital')
+
+
+def test_id_choices_revalidated_after_ttl(database_session):
+    current_app.reference_cache.ttl = 0
+    before = id_choices(database_session, MeshType)
+
+    # Simulate a change made by another process, which this process' commit hooks never see.
+    database_session.execute(MeshType.__table__.insert().values(name='Other Mesh', version_id=1))
+
+    assert len(id_choices(database_session, MeshType)) == len(before) + 1
+
+
+def test_id_choices_uncached_entity(database_session):
+    assert id_choices(database_session, Patient) == []
+
+
+def _count_statements(session):
+    statements = []
+    event.listen(session.get_bind(), 'before_cursor_execute',
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+    return statements
@@ -4,7 +4,8 @@ from datetime import timedelta, date
 from typing import List
 
 from app import constants
-from app.models import User, Patient, Center
+from app.models import User, Patient, Center, MeshType, InguinalMeshHerniaRepair, Followup, Discharge, Cepod, \
+    Side, Occurrence, InguinalHerniaType, Complexity, AnestheticType, Pain
 from app.tests import names
 from app.util import pwd_generator
 
@@ -37,6 +38,64 @@ def create_sample_data(session, num_users: int, num_patients: int):
     session.add_all(patients)
 
 
+def create_patient(session, name, center=None, **kwargs) -> Patient:
+    user = session.query(User).first()
+    patient = Patient(name=name,
+                      gender=kwargs.pop('gender', 'F'),
+                      center=center or session.query(Center).first(),
+                      created_by=user,
+                      updated_by=user,
+                      **kwargs)
+    session.add(patient)
+    return patient
+
+
+def create_repair(session, patient, date_of_surgery: date, center=None, **kwargs) -> InguinalMeshHerniaRepair:
+    user = session.query(User).first()
+    repair = InguinalMeshHerniaRepair(**_event_keys(patient, center),
+                                      date=date_of_surgery,
+                                      cepod=kwargs.pop('cepod', Cepod.Planned),
+                                      side=kwargs.pop('side', Side.Left),
+                                      occurrence=kwargs.pop('occurrence', Occurrence.Primary),
+                                      hernia_type=kwargs.pop('hernia_type', InguinalHerniaType.Direct),
+                                      complexity=kwargs.pop('complexity', Complexity.Simple),
+                                      mesh_type=kwargs.pop('mesh_type', None) or session.query(MeshType).first(),
+                                      anaesthetic_type=kwargs.pop('anaesthetic_type', AnestheticType.Spinal),
+                                      anaesthetic_other=kwargs.pop('anaesthetic_other', ''),
+                                      created_by=user,
+                                      updated_by=user,
+                                      **kwargs)
+    session.add(repair)
+    return repair
+
+
+def create_followup(session, patient, date_of_followup: date, center=None, **kwargs) -> Followup:
+    user = session.query(User).first()
+    followup = Followup(**_event_keys(patient, center),
+                        date=date_of_followup,
+                        pain=kwargs.pop('pain', Pain.No_Pain),
+                        created_by=user,
+                        updated_by=user,
+                        **kwargs)
+    session.add(followup)
+    return followup
+
+
+def create_discharge(session, patient, date_of_discharge: date, center=None, **kwargs) -> Discharge:
+    user = session.query(User).first()
+    discharge = Discharge(**_event_keys(patient, center),
+                          date=date_of_discharge,
+                          created_by=user,
+                          updated_by=user,
+                          **kwargs)
+    session.add(discharge)
+    return discharge
+
+
+def _event_keys(patient, center):
+    return dict(patient=patient, center=center or patient.center)
+
+
 def _users(num: int) -> List[User]:
     users = []
 
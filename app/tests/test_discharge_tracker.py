@@ -0,0 +1,40 @@
+from datetime import date
+
+from flask import current_app
+
+from app.admin import admin_command, discharge_tracker
+from app.models import PatientDischargeTracker, Center
+from app.tests import test_data
+
+
+def test_check_and_rebuild(database_session):
+    centers = database_session.query(Center).order_by(Center.id).all()
+
+    pending = test_data.create_patient(database_session, 'Pending')
+    test_data.create_repair(database_session, pending, date(2020, 1, 1))
+    test_data.create_followup(database_session, pending, date(2020, 1, 5), center=centers[1])
+
+    discharged = test_data.create_patient(database_session, 'Discharged')
+    test_data.create_repair(database_session, discharged, date(2020, 1, 1))
+    database_session.commit()
+    test_data.create_discharge(database_session, discharged, date(2020, 1, 3))
+
+    test_data.create_patient(database_session, 'No Events')
+    database_session.commit()
+
+    assert discharge_tracker.check(database_session) == discharge_tracker.TrackerDiff([], [], [])
+
+    # Drift the tracker away from the events
+    database_session.query(PatientDischargeTracker).delete()
+    database_session.add(PatientDischargeTracker(patient_id=discharged.id, center_id=centers[0].id,
+                                                 event_date=date(2020, 1, 1)))
+    database_session.commit()
+
+    diff = discharge_tracker.check(database_session)
+    assert diff == discharge_tracker.TrackerDiff(missing=[pending.id], unexpected=[discharged.id], mismatched=[])
+    assert 'Missing: 1' in admin_command.execute(current_app, 'check_tracker')
+
+    admin_command.execute(current_app, 'rebuild_tracker')
+    assert [(t.patient_id, t.center_id, t.event_date) for t in database_session.query(PatientDischargeTracker)] == \
+           [(pending.id, centers[1].id, date(2020, 1, 5))]
+    assert discharge_tracker.check(database_session) == discharge_tracker.TrackerDiff([], [], [])
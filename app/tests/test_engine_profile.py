@@ -0,0 +1,47 @@
+import json
+
+import pytest
+from flask import url_for
+from sqlalchemy import create_engine, exc
+from sqlalchemy.engine.url import make_url
+
+from app.util import engine_profile
+
+CONFIG = dict(WEB_CONCURRENCY=4, WEB_THREADS=8, JOB_WORKERS=2, DB_POOL_SIZE=0, DB_MAX_OVERFLOW=None,
+              DB_MAX_CONNECTIONS=0, DB_POOL_TIMEOUT=10, DB_POOL_RECYCLE=280, DB_CONNECT_TIMEOUT=5)
+
+
+def test_engine_options():
+    options = engine_profile.engine_options(make_url('mysql+mysqlconnector://u:p@db/registry'), CONFIG)
+    assert (options['pool_size'], options['max_overflow'], options['pool_pre_ping']) == (10, 5, True)
+    assert options['connect_args'] == dict(connection_timeout=5)
+
+    # Four workers sharing 40 connections get 10 each
+    options = engine_profile.engine_options(make_url('mysql+pymysql://u:p@db/registry'),
+                                            dict(CONFIG, DB_MAX_CONNECTIONS=40, WEB_THREADS=16))
+    assert (options['pool_size'], options['max_overflow']) == (10, 0)
+
+    assert engine_profile.engine_options(make_url('sqlite:///registry.db'), CONFIG) == {}
+
+
+def test_pool_stats(tmp_path):
+    engine = create_engine('sqlite:///' + str(tmp_path / 'pool.db'), poolclass=engine_profile.InstrumentedQueuePool,
+                           pool_size=1, max_overflow=0, pool_timeout=0.1)
+    engine_profile.configure(engine)
+
+    with engine.connect() as connection:
+        assert connection.execute('PRAGMA journal_mode').scalar() == 'wal'
+        status = engine_profile.pool_status(engine.pool)
+        assert (status['checked_out'], status['saturation']) == (1, 1.0)
+
+        with pytest.raises(exc.TimeoutError):
+            engine.connect()
+
+    status = engine_profile.pool_status(engine.pool)
+    assert (status['checkouts'], status['timeouts'], status['checked_out']) == (2, 1, 0)
+    assert status['max_wait_seconds'] >= 0.1
+
+
+def test_pool_status_page(flask_client):
+    status = json.loads(flask_client.get(url_for('pool_status')).data)
+    assert status['primary']['pool'] == 'StaticPool'
@@ -0,0 +1,96 @@
+from datetime import date
+
+from flask import current_app
+from sqlalchemy import event
+
+from app.admin import admin_command, event_summary
+from app.models import Center, EventSummary, User
+from app.tests import test_data
+
+NO_DIFF = event_summary.SummaryDiff([], [], [])
+
+
+def test_summary_follows_flushes(database_session):
+    centers = database_session.query(Center).order_by(Center.id).all()
+    surgeon = database_session.query(User).first()
+
+    patient = test_data.create_patient(database_session, 'Summarised')
+    repair = test_data.create_repair(database_session, patient, date(2020, 1, 10), primary_surgeon=surgeon)
+    followup = test_data.create_followup(database_session, patient, date(2020, 2, 10), infection=True)
+    database_session.commit()
+
+    repair_key = (centers[0].id, 2020, 1, 'Mesh Hernia Repair', repair.mesh_type_id, surgeon.id)
+    assert _summary(database_session) == {repair_key: (1, 0),
+                                          (centers[0].id, 2020, 2, 'Follow-Up', 0, 0): (1, 1)}
+
+    # Moving an event to another month and center, and changing its complications, moves its counts
+    followup.date = date(2020, 3, 1)
+    followup.center_id = centers[1].id
+    followup.infection = False
+    test_data.create_repair(database_session, patient, date(2020, 1, 20), primary_surgeon=surgeon,
+                            complications='Bleeding')
+    database_session.commit()
+    assert _summary(database_session) == {repair_key: (2, 1),
+                                          (centers[1].id, 2020, 3, 'Follow-Up', 0, 0): (1, 0)}
+
+    database_session.delete(followup)
+    database_session.commit()
+    assert _summary(database_session) == {repair_key: (2, 1)}
+
+    assert event_summary.check(database_session) == NO_DIFF
+
+
+def test_check_and_rebuild(database_session):
+    patient = test_data.create_patient(database_session, 'Summarised')
+    test_data.create_repair(database_session, patient, date(2020, 1, 10))
+    test_data.create_discharge(database_session, patient, date(2020, 1, 12), perioperative_complication=True)
+    database_session.commit()
+    assert event_summary.check(database_session) == NO_DIFF
+
+    database_session.query(EventSummary).delete()
+    database_session.commit()
+    assert 'Missing: 2' in admin_command.execute(current_app, 'check_summary')
+
+    admin_command.execute(current_app, 'rebuild_summary')
+    assert event_summary.check(database_session) == NO_DIFF
+    assert sum(s.complications for s in database_session.query(EventSummary)) == 1
+
+
+def test_summary_insert_race(database_session):
+    center = database_session.query(Center).order_by(Center.id).first()
+    connection = database_session.connection()
+    summaries = EventSummary.__table__
+    raced = []
+
+    # Another session inserts the same row between the hook's update and its insert
+    def insert_first(conn, name):
+        if not raced:
+            raced.append(True)
+            conn.execute(summaries.insert().values(center_id=center.id, year=2020, month=2, type='Follow-Up',
+                                                   mesh_type_id=0, surgeon_id=0, events=3, complications=1))
+
+    event.listen(connection, 'savepoint', insert_first)
+    try:
+        patient = test_data.create_patient(database_session, 'Raced')
+        test_data.create_followup(database_session, patient, date(2020, 2, 10), infection=True)
+        database_session.commit()
+    finally:
+        event.remove(connection, 'savepoint', insert_first)
+
+    assert raced
+    assert _summary(database_session) == {(center.id, 2020, 2, 'Follow-Up', 0, 0): (4, 2)}
+
+
+def test_summary_complications_match_sql_trim(database_session):
+    patient = test_data.create_patient(database_session, 'Summarised')
+    test_data.create_repair(database_session, patient, date(2020, 1, 10), complications='   ')
+    test_data.create_repair(database_session, patient, date(2020, 1, 11), complications='\n')
+    database_session.commit()
+
+    assert event_summary.check(database_session) == NO_DIFF
+    assert sum(s.complications for s in database_session.query(EventSummary)) == 1
+
+
+def _summary(session):
+    return {tuple(getattr(s, name) for name in EventSummary.KEY): (s.events, s.complications)
+            for s in session.query(EventSummary)}
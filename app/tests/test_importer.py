@@ -0,0 +1,85 @@
+from datetime import date, datetime
+
+from openpyxl import Workbook
+
+from app import importer
+from app.admin import discharge_tracker, event_summary
+from app.models import Patient, Event, InguinalMeshHerniaRepair, Followup, User, Cepod, Pain
+from app.route_helper.patient_helper import phone_filter
+from app.tests import test_data
+
+
+def test_import_patients(flask_application, database_session):
+    user = database_session.query(User).first()
+    rows = [
+        dict(name='Imported Patient', gender='M', birth_year='1970', center='korogwe', hospital_number='H1',
+             phone_1='0712 345 678'),
+        dict(name='', gender='F', center='Korogwe'),
+        dict(name='Nowhere Patient', gender='F', center='Atlantis'),
+    ]
+
+    result = importer.import_rows(database_session, importer.find_importer('Patient'), rows, user)
+    assert (result.rows, result.imported) == (3, 1)
+    assert result.errors == [
+        importer.RowError(3, 'name', 'This field is required.'),
+        importer.RowError(4, 'center', 'Unable to find a Center with this name.'),
+    ]
+
+    patient = database_session.query(Patient).filter(Patient.name == 'Imported Patient').one()
+    assert (patient.center.name, patient.dob_year, patient.birth_year, patient.version_id) == ('Korogwe', 1970, 1970, 1)
+    assert [p.id for p in flask_application.search_backend.search(database_session.query(Patient),
+                                                                  dict(name='Imported')).all()] == [patient.id]
+    assert database_session.query(Patient).filter(phone_filter('0712345678')).all() == [patient]
+
+
+def test_import_events(database_session):
+    user = database_session.query(User).first()
+    patient = test_data.create_patient(database_session, 'Patient With History')
+    database_session.commit()
+
+    repairs = [
+        dict(patient_id=str(patient.id), date='2020-01-02', center='Korogwe', cepod='Planned', side='Left',
+             occurrence='Primary', hernia_type='Direct', complexity='Simple', mesh_type='Commercial Mesh',
+             anaesthetic_type='Spinal', primary_surgeon='Paul Smith'),
+        dict(patient_id='999999', date='2020-01-02', center='Korogwe', cepod='Sometimes'),
+    ]
+    result = importer.import_rows(database_session, importer.find_importer('InguinalMeshHerniaRepair'), repairs, user)
+    assert result.imported == 1
+    assert {(e.row, e.field) for e in result.errors} >= {(3, 'patient_id'), (3, 'cepod'), (3, 'side')}
+
+    repair = database_session.query(InguinalMeshHerniaRepair).filter(Event.patient_id == patient.id).one()
+    assert (repair.date, repair.cepod, repair.mesh_type.name) == (date(2020, 1, 2), Cepod.Planned, 'Commercial Mesh')
+    assert repair.primary_surgeon.name == 'Paul Smith'
+    assert repair.comments == ''
+
+    followups = [
+        dict(patient_id=str(patient.id), date='2020-03-01', center='Korogwe', attendee='Paul Smith', pain='Mild'),
+        dict(patient_id=str(patient.id), date='2020-03-01', center='Korogwe', attendee='Paul Smith',
+             pain='No Pain', infection='yes'),
+    ]
+    result = importer.import_rows(database_session, importer.find_importer('Followup'), followups, user)
+    assert result.imported == 0
+    assert [(e.row, e.field) for e in result.errors] == [(2, 'pain_comments'), (3, 'infection_comments')]
+
+    followups[0]['pain_comments'] = 'Aches'
+    result = importer.import_rows(database_session, importer.find_importer('Followup'), followups[:1], user)
+    assert result.imported == 1
+    assert database_session.query(Followup).filter(Event.patient_id == patient.id).one().pain == Pain.Mild
+
+    # The derived tables skipped by the bulk inserts have been rebuilt
+    assert not any(discharge_tracker.check(database_session))
+    assert not any(event_summary.check(database_session))
+
+
+def test_read_xlsx(tmp_path):
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(['name', 'birth_year', 'date', None])
+    sheet.append(['Spreadsheet Patient', 1980.0, datetime(2020, 1, 2), 'ignored'])
+    sheet.append([None, None, None, None])
+    path = str(tmp_path / 'patients.xlsx')
+    workbook.save(path)
+
+    assert list(importer.read_rows(path, 'xlsx')) == [dict(name='Spreadsheet Patient', birth_year='1980',
+                                                           date='2020-01-02')]
+    assert importer.count_rows(path, 'xlsx') == 2
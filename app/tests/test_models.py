@@ -0,0 +1,194 @@
+from datetime import date
+
+from flask import current_app
+from sqlalchemy import event
+
+from app.admin import admin_command, backfill, discharge_tracker
+from app.models import Patient, PatientPhone, PatientDischargeTracker, User, Center
+from app.route_helper.patient_helper import phone_filter
+from app.tests import test_data
+
+
+def test_patient_birth_year(database_session):
+    _create_patients(database_session, [1950, 1960, 1961, 1975])
+
+    patient = database_session.query(Patient).filter(Patient.birth_year == 1960).one()
+    assert patient.birth_year == 1960
+    assert patient.dob_year == 1960
+    assert patient.dob_year_only
+
+    # Birth year follows the date of birth
+    patient.dob = date(1962, 5, 17)
+    database_session.commit()
+    assert database_session.query(Patient.dob_year).filter(Patient.id == patient.id).scalar() == 1962
+
+    # Filtering happens in SQL, so plain column queries work without loading patients
+    years = database_session.query(Patient.birth_year).filter(Patient.birth_year < 1962).order_by(Patient.birth_year)
+    assert [y for (y,) in years] == [1950, 1961]
+
+
+def test_patient_aged_between(database_session):
+    _create_patients(database_session, [1950, 1960, 1961, 1975])
+
+    today = date(2020, 6, 1)
+    patients = database_session.query(Patient).filter(Patient.aged_between(59, 60, today=today)).all()
+    assert sorted(p.birth_year for p in patients) == [1960, 1961]
+
+
+def test_backfill_dob_year(database_session):
+    _create_patients(database_session, [1950, 1960])
+    # As recorded before dob_year was kept
+    database_session.query(Patient).update({Patient.dob_year: None}, synchronize_session=False)
+    database_session.commit()
+
+    assert backfill.dob_years(database_session) == 2
+    database_session.commit()
+    assert sorted(y for (y,) in database_session.query(Patient.dob_year)) == [1950, 1960]
+    assert backfill.dob_years(database_session) == 0
+
+
+def _create_patients(session, birth_years):
+    user = session.query(User).first()
+    center = session.query(Center).first()
+
+    for birth_year in birth_years:
+        patient = Patient(name='Born {}'.format(birth_year), gender='F', center=center, created_by=user,
+                          updated_by=user)
+        patient.birth_year = birth_year
+        session.add(patient)
+
+    session.commit()
+
+
+def test_patient_phones(database_session):
+    user = database_session.query(User).first()
+    center = database_session.query(Center).first()
+
+    patient = Patient(name='Phone Patient', gender='F', center=center, created_by=user, updated_by=user,
+                      phone_1='0712 345 678')
+    database_session.add(patient)
+    database_session.commit()
+    assert [(p.position, p.number) for p in patient.phones] == [(1, '+255712345678')]
+
+    patient.phone_1 = ''
+    patient.phone_2 = '0787-000-111'
+    database_session.commit()
+    assert [(p.position, p.number) for p in patient.phones] == [(2, '+255787000111')]
+    assert database_session.query(PatientPhone).count() == 1
+
+    database_session.delete(patient)
+    database_session.commit()
+    assert database_session.query(PatientPhone).count() == 0
+
+
+def test_rebuild_phones(database_session):
+    user = database_session.query(User).first()
+    center = database_session.query(Center).first()
+    database_session.add(Patient(name='Phone Patient', gender='F', center=center, created_by=user, updated_by=user,
+                                 phone_1='0712 345 678', phone_2='5678'))
+    database_session.commit()
+    # As recorded before PatientPhones existed
+    database_session.query(PatientPhone).delete()
+    database_session.commit()
+    assert database_session.query(Patient).filter(phone_filter('0712345678')).count() == 0
+
+    assert admin_command.execute(current_app, 'rebuild_phones') == 'Rebuilt 2 phone numbers\nDone'
+    assert database_session.query(Patient).filter(phone_filter('0712345678')).count() == 1
+    assert database_session.query(Patient).filter(phone_filter('5678')).count() == 1
+
+
+def test_discharge_tracker(database_session):
+    patient = test_data.create_patient(database_session, 'Tracked Patient')
+    test_data.create_repair(database_session, patient, date(2020, 1, 10))
+    database_session.commit()
+    assert _tracked(database_session) == {patient.id: date(2020, 1, 10)}
+
+    # A later follow-up moves the tracked date on
+    test_data.create_followup(database_session, patient, date(2020, 1, 12))
+    database_session.commit()
+    assert _tracked(database_session) == {patient.id: date(2020, 1, 12)}
+
+    test_data.create_discharge(database_session, patient, date(2020, 1, 14))
+    database_session.commit()
+    assert _tracked(database_session) == {}
+
+    # A back-dated discharge for an untracked patient starts tracking again if there is a later repair
+    test_data.create_repair(database_session, patient, date(2020, 2, 1))
+    database_session.commit()
+    test_data.create_discharge(database_session, patient, date(2020, 2, 3))
+    database_session.commit()
+    assert _tracked(database_session) == {}
+
+    test_data.create_repair(database_session, patient, date(2020, 3, 1))
+    database_session.commit()
+    database_session.query(PatientDischargeTracker).delete()
+    test_data.create_discharge(database_session, patient, date(2020, 2, 20))
+    database_session.commit()
+    assert _tracked(database_session) == {patient.id: date(2020, 3, 1)}
+
+
+def test_discharge_tracker_back_dated_discharge(database_session):
+    (first, second) = database_session.query(Center).order_by(Center.id).limit(2)
+    patient = test_data.create_patient(database_session, 'Back Dated', center=first)
+    test_data.create_repair(database_session, patient, date(2020, 3, 1), center=second)
+    database_session.commit()
+
+    discharge = test_data.create_discharge(database_session, patient, date(2020, 2, 20))
+    database_session.commit()
+    assert not any(discharge_tracker.check(database_session))
+
+    discharge.date = date(2020, 3, 5)
+    database_session.commit()
+    assert _tracked(database_session) == {}
+
+    # Moving the discharge back before the repair tracks the repair, at its center
+    discharge.date = date(2020, 2, 20)
+    database_session.commit()
+    assert database_session.query(PatientDischargeTracker.center_id, PatientDischargeTracker.event_date).all() == \
+        [(second.id, date(2020, 3, 1))]
+    assert not any(discharge_tracker.check(database_session))
+
+
+def test_discharge_tracker_repair_and_discharge_in_one_flush(database_session):
+    for discharge_first in [False, True]:
+        patient = test_data.create_patient(database_session, 'One Flush {}'.format(discharge_first))
+        database_session.flush()
+
+        with database_session.no_autoflush:
+            repair = test_data.create_repair(database_session, patient, date(2020, 3, 1))
+            discharge = test_data.create_discharge(database_session, patient, date(2020, 3, 5))
+            # The hook sees the events in the order they were added
+            database_session.expunge(repair)
+            database_session.expunge(discharge)
+            for e in ([discharge, repair] if discharge_first else [repair, discharge]):
+                database_session.add(e)
+        database_session.commit()
+
+        assert patient.id not in _tracked(database_session)
+        assert not any(discharge_tracker.check(database_session))
+
+
+def test_discharge_tracker_queries_per_flush(database_session):
+    counts = []
+    for n in [1, 20]:
+        patients = [test_data.create_patient(database_session, 'Batch {} {}'.format(n, i)) for i in range(n)]
+        database_session.flush()
+
+        for patient in patients:
+            test_data.create_repair(database_session, patient, date(2020, 1, 10))
+            test_data.create_discharge(database_session, patient, date(2020, 1, 5))
+
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(database_session.get_bind(), 'before_cursor_execute', listener)
+        database_session.flush()
+        event.remove(database_session.get_bind(), 'before_cursor_execute', listener)
+
+        counts.append(len([s for s in statements if s.lstrip().upper().startswith('SELECT')]))
+        assert all(p.id in _tracked(database_session) for p in patients)
+
+    assert counts[0] == counts[1] <= 3
+
+
+def _tracked(session):
+    return {t.patient_id: t.event_date for t in session.query(PatientDischargeTracker)}
@@ -0,0 +1,128 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from flask import url_for
+
+from app import replica
+from app.jobs import READ_ONLY_JOBS
+from app.models import Center, ReplicaHeartbeat
+from app.tests import test_data
+from application import db
+
+
+@pytest.fixture
+def router(flask_application, tmp_path):
+    flask_application.config['SQLALCHEMY_BINDS'] = {replica.REPLICA_BIND: 'sqlite:///' + str(tmp_path / 'replica.db')}
+    replica.init_app(flask_application)
+    router = flask_application.replica_router
+    db.Model.metadata.create_all(router.engine)
+
+    # Measure the lag on every read rather than every few seconds
+    router.check_seconds = 0
+    router.check()
+
+    yield router
+
+    flask_application.replica_router = None
+    router.engine.dispose()
+
+
+def test_read_only_views_use_replica(flask_client_logged_in, router):
+    test_data.create_patient(db.session, 'Replicated Patient')
+    db.session.commit()
+    _replicate(router)
+
+    patient = test_data.create_patient(db.session, 'Not Yet Replicated', birth_year=1980)
+    db.session.commit()
+
+    assert _prefetched(flask_client_logged_in) == ['Replicated Patient']
+
+    # Views that may write read from the primary
+    response = flask_client_logged_in.get(url_for('patient', id=patient.id))
+    assert b'Not Yet Replicated' in response.data
+
+    # As does a replica that has fallen too far behind
+    _set_replica_beat(router, datetime.now() - timedelta(minutes=5))
+    assert _prefetched(flask_client_logged_in) == ['Not Yet Replicated', 'Replicated Patient']
+
+
+def test_lag_when_replication_stops(router):
+    # Replication stopped five minutes ago, and nothing has checked the lag since
+    _replicate(router)
+    five_minutes_ago = datetime.now() - timedelta(minutes=5)
+    db.session.query(ReplicaHeartbeat).update(dict(beat_at=five_minutes_ago))
+    db.session.commit()
+    _set_replica_beat(router, five_minutes_ago)
+
+    assert router.check() >= 300
+    assert not router.healthy()
+
+    # The heartbeat was written again, and the replica is fine once it has it
+    _replicate(router)
+    assert router.check() < router.max_lag
+
+
+def test_lag_measured_outside_the_lock(router, monkeypatch):
+    checks = []
+
+    def check():
+        checks.append(router._lock.locked())
+        return 0.0
+
+    monkeypatch.setattr(router, 'check', check)
+    assert router.healthy()
+    assert checks == [False]
+
+
+def test_read_after_write(flask_client_logged_in, router):
+    _replicate(router)
+    center = db.session.query(Center).first()
+
+    response = flask_client_logged_in.post(url_for('api_sync'), json=dict(
+        patients=[dict(client_id='p-1', name='Just Saved', gender='F', dob='1980-01-01', center_id=center.id)]))
+    assert response.status_code == 200
+
+    # The replica does not have the new patient, but the browser that saved it reads it back from the primary
+    assert _prefetched(flask_client_logged_in) == ['Just Saved']
+
+    router.read_after_write = 0
+    assert _prefetched(flask_client_logged_in) == []
+
+
+def test_read_only_jobs(flask_application, database_session, router):
+    assert {'export', 'outcomes'} <= READ_ONLY_JOBS
+    test_data.create_patient(database_session, 'Replicated Patient')
+    database_session.commit()
+    _replicate(router)
+
+    session = db.session.session_factory(info={replica.READ_REPLICA_KEY: True})
+    try:
+        assert session.get_bind() is router.engine
+        session.add(Center(name='Written To Primary', address='Primary'))
+        session.commit()
+    finally:
+        session.close()
+
+    assert database_session.query(Center).filter(Center.name == 'Written To Primary').count() == 1
+    assert router.engine.execute(Center.__table__.select().where(Center.name == 'Written To Primary')).first() is None
+
+
+def _prefetched(client):
+    return [name for (name,) in json.loads(client.get(url_for('patients_prefetch')).data)]
+
+
+def _set_replica_beat(router, beat_at):
+    table = ReplicaHeartbeat.__table__
+    router.engine.execute(table.update().where(table.c.id == replica.HEARTBEAT_ID).values(beat_at=beat_at))
+
+
+def _replicate(router):
+    # Copies the primary to the replica, as replication would
+    with router.primary.connect() as primary, router.engine.begin() as target:
+        for table in reversed(db.Model.metadata.sorted_tables):
+            target.execute(table.delete())
+        for table in db.Model.metadata.sorted_tables:
+            rows = [dict(row) for row in primary.execute(table.select())]
+            if rows:
+                target.execute(table.insert(), rows)
@@ -0,0 +1,154 @@
+import os
+import shutil
+from datetime import date
+
+import pytest
+from sqlalchemy import create_engine
+
+from app import base_data
+from app.admin import discharge_tracker, event_summary, replication
+from app.models import Patient, Event, Center, Followup, Replica
+from app.tests import test_data
+from application import db
+
+
+@pytest.fixture
+def central(flask_application, tmp_path, monkeypatch):
+    monkeypatch.setattr(replication, 'REPLICATION_SETTLE_SECONDS', 0)
+
+    engine = create_engine('sqlite:///' + str(tmp_path / 'central.db'))
+    db.Model.metadata.create_all(engine)
+    session = replication.target_session(engine)
+
+    # So that reference data has different ids on each node
+    session.add(Center(name='Central Only', address='Central'))
+    session.commit()
+    base_data.create(session)
+    session.commit()
+
+    yield session
+
+    session.close()
+    engine.dispose()
+
+
+def test_replication(database_session, central, tmp_path):
+    outbox = str(tmp_path / 'outbox')
+    patient = test_data.create_patient(database_session, 'Edge Patient')
+    test_data.create_repair(database_session, patient, date(2020, 1, 1))
+    followup = test_data.create_followup(database_session, patient, date(2020, 2, 1))
+    database_session.commit()
+
+    paths = replication.export_outbox(database_session, 'clinic', outbox)
+    assert len(paths) == 1
+    assert replication.export_outbox(database_session, 'clinic', outbox) == []
+
+    results = replication.forward_outbox(central, outbox)
+    (result,) = results.values()
+    assert (len(result.applied), result.conflicts, result.errors) == (3, [], [])
+    assert os.listdir(outbox) == [replication.SENT_DIRECTORY]
+
+    replica = central.query(Patient).filter(Patient.client_id == 'clinic:{}'.format(patient.id)).one()
+    assert (replica.name, replica.center.name, replica.center_id) == ('Edge Patient', patient.center.name,
+                                                                     _center_id(central, patient.center.name))
+    events = central.query(Event).filter(Event.patient_id == replica.id).order_by(Event.date).all()
+    assert [type(e).__name__ for e in events] == ['InguinalMeshHerniaRepair', 'Followup']
+    assert events[1].created_by.email == followup.created_by.email
+
+    # The central database's derived data was kept by its session hooks
+    assert not any(discharge_tracker.check(central))
+    assert not any(event_summary.check(central))
+
+    # Replaying a batch changes nothing
+    sent = os.path.join(outbox, replication.SENT_DIRECTORY, os.path.basename(paths[0]))
+    shutil.copy(sent, outbox)
+    (result,) = replication.forward_outbox(central, outbox).values()
+    assert (len(result.applied), len(result.skipped)) == (0, 3)
+
+    # Later changes follow on from the cursors
+    patient.name = 'Renamed At Edge'
+    database_session.commit()
+    replication.export_outbox(database_session, 'clinic', outbox)
+    (result,) = replication.forward_outbox(central, outbox).values()
+    assert [p.client_id for p in result.applied] == [replica.client_id]
+    central.refresh(replica)
+    assert replica.name == 'Renamed At Edge'
+
+
+def test_replication_conflict(database_session, central, tmp_path):
+    outbox = str(tmp_path / 'outbox')
+    patient = test_data.create_patient(database_session, 'Edge Patient')
+    database_session.commit()
+    replication.export_outbox(database_session, 'clinic', outbox)
+    replication.forward_outbox(central, outbox)
+
+    replica = central.query(Patient).filter(Patient.client_id == 'clinic:{}'.format(patient.id)).one()
+    replica.name = 'Changed Centrally'
+    central.commit()
+
+    patient.name = 'Changed At Edge'
+    database_session.commit()
+    replication.export_outbox(database_session, 'clinic', outbox)
+    (result,) = replication.forward_outbox(central, outbox).values()
+    assert [(p.entity, p.client_id) for p in result.conflicts] == [('Patient', replica.client_id)]
+
+    central.refresh(replica)
+    assert replica.name == 'Changed Centrally'
+    assert central.query(Replica).get(('Patient', replica.client_id)).origin_version == 1
+
+
+def test_replication_unknown_reference(database_session, central, tmp_path):
+    outbox = str(tmp_path / 'outbox')
+    center = Center(name='Edge Only', address='Edge')
+    patient = test_data.create_patient(database_session, 'Edge Patient', center=center)
+    followup = test_data.create_followup(database_session, patient, date(2020, 2, 1))
+    database_session.commit()
+
+    replication.export_outbox(database_session, 'clinic', outbox)
+    (result,) = replication.forward_outbox(central, outbox).values()
+    assert [(p.client_id, p.message) for p in result.errors] == [
+        ('clinic:{}'.format(patient.id), 'Unable to find Centers Edge Only.'),
+        ('clinic:{}'.format(followup.id), 'Unable to find Patients clinic:{}.'.format(patient.id))]
+    assert central.query(Followup).count() == 0
+
+    # The batch stays in the outbox until the center exists centrally
+    assert len([n for n in os.listdir(outbox) if n.endswith(replication.BATCH_SUFFIX)]) == 1
+    central.add(Center(name='Edge Only', address='Central'))
+    central.commit()
+
+    (result,) = replication.forward_outbox(central, outbox).values()
+    assert (len(result.applied), result.errors) == (2, [])
+    assert os.listdir(outbox) == [replication.SENT_DIRECTORY]
+    assert central.query(Followup).count() == 1
+
+
+def test_replication_event_ahead_of_its_patient(database_session, central, tmp_path):
+    outbox = str(tmp_path / 'outbox')
+    first = test_data.create_patient(database_session, 'First Patient')
+    database_session.commit()
+    second = test_data.create_patient(database_session, 'Second Patient')
+    database_session.commit()
+    test_data.create_repair(database_session, first, date(2020, 1, 1))
+    database_session.commit()
+
+    # Editing the patient puts it behind its repair in the patient stream, so a batch has the repair without it
+    first.name = 'First Patient Edited'
+    database_session.commit()
+
+    paths = replication.export_outbox(database_session, 'clinic', outbox, limit=1)
+    assert len(paths) == 2
+
+    results = replication.forward_outbox(central, outbox)
+    assert [p for r in results.values() for p in r.errors] == []
+    assert os.listdir(outbox) == [replication.SENT_DIRECTORY]
+
+    replica = central.query(Patient).filter(Patient.client_id == 'clinic:{}'.format(first.id)).one()
+    assert replica.name == 'First Patient Edited'
+    assert central.query(Event).filter(Event.patient_id == replica.id).count() == 1
+    assert central.query(Patient.name).filter(Patient.client_id == 'clinic:{}'.format(second.id)).scalar() == \
+        'Second Patient'
+    assert not any(discharge_tracker.check(central))
+
+
+def _center_id(session, name):
+    return session.query(Center.id).filter(Center.name == name).scalar()
@@ -0,0 +1,44 @@
+import datetime
+
+import pytest
+
+from app.models import Patient, InguinalMeshHerniaRepair, Followup, Cepod, Pain, Side
+from app.util import restful
+
+
+def test_json_loads_round_trip():
+    data = dict(date=datetime.date(2020, 1, 2), updated_at=datetime.datetime(2020, 1, 2, 3, 4, 5), cepod=Cepod.Planned,
+                pain=Pain.No_Pain, name='Planned.Surgery', notes='2020-13-45')
+
+    assert restful.json_loads(restful.json_dumps(data)) == data
+
+
+def test_json_loads_schema():
+    s = restful.json_dumps(dict(
+        patients=[dict(id=1, name='2020-01-02', dob=datetime.date(1970, 5, 6),
+                       updated_at=datetime.datetime(2020, 1, 2))],
+        events=[dict(id=2, date=datetime.date(2020, 1, 2), cepod=Cepod.Emergency, side='Left', comments='Side.Right'),
+                dict(id=3, date=datetime.date(2020, 2, 1), pain=Pain.Severe)]))
+
+    data = restful.json_loads(s, schema=[Patient, InguinalMeshHerniaRepair, Followup])
+
+    patient = data['patients'][0]
+    assert patient['name'] == '2020-01-02'
+    assert patient['dob'] == datetime.date(1970, 5, 6)
+    # Unlike the schemaless decoder a midnight datetime stays a datetime
+    assert patient['updated_at'] == datetime.datetime(2020, 1, 2)
+
+    (repair, followup) = data['events']
+    assert repair['date'] == datetime.date(2020, 1, 2)
+    assert repair['cepod'] == Cepod.Emergency
+    assert repair['side'] == Side.Left
+    assert repair['comments'] == 'Side.Right'
+    assert followup['pain'] == Pain.Severe
+
+
+def test_json_loads_schema_invalid():
+    with pytest.raises(ValueError):
+        restful.json_loads('{"cepod": "Cepod.Sometime"}', schema=InguinalMeshHerniaRepair)
+
+    with pytest.raises(ValueError):
+        restful.json_loads('{"dob": "last year"}', schema=Patient)
@@ -0,0 +1,103 @@
+import pytest
+from flask import current_app
+
+from app import search
+from app.admin import admin_command
+from app.models import Patient, PatientSearchGram, User, Center
+
+
+@pytest.fixture(params=['fts5', 'ngram', 'python'])
+def search_backend(request, database_session):
+    if request.param == 'fts5' and not search.fts5_available():
+        pytest.skip('SQLite FTS5 trigram tokenizer is not available.')
+
+    current_app.search_backend = search.find_backend(request.param, database_session.get_bind())
+    current_app.search_backend.rebuild(database_session)
+    yield current_app.search_backend
+
+
+def test_search(database_session, search_backend):
+    _create_patients(database_session, [('Juma Hassan', 'Muheza'), ('Amina Juma Mwinyi', 'Korogwe'),
+                                        ('Neema Mushi', 'Moshi')])
+
+    assert _names(database_session, name='juma') == ['Juma Hassan', 'Amina Juma Mwinyi']
+    assert _names(database_session, name='juma', address='korogwe') == ['Amina Juma Mwinyi']
+    assert _names(database_session, name='mushi hassan') == []
+
+    # Values shorter than a trigram are still matched, just without the index
+    assert _names(database_session, name='ne') == ['Neema Mushi']
+
+
+def test_search_follows_flushes(database_session, search_backend):
+    patient = _create_patients(database_session, [('Juma Hassan', 'Muheza')])[0]
+
+    patient.name = 'Baraka Hassan'
+    database_session.commit()
+    assert _names(database_session, name='juma') == []
+    assert _names(database_session, name='baraka') == ['Baraka Hassan']
+
+    database_session.delete(patient)
+    database_session.commit()
+    assert _names(database_session, name='hassan') == []
+
+
+def test_reindex_search(database_session, search_backend):
+    _create_patients(database_session, [('Juma Hassan', 'Muheza')])
+    search_backend.clear(database_session.connection())
+
+    assert admin_command.execute(current_app, 'reindex_search') == 'Done'
+    assert _names(database_session, name='hassan') == ['Juma Hassan']
+
+
+def _names(session, **criteria):
+    return [p.name for p in current_app.search_backend.search(session.query(Patient), criteria).all()]
+
+
+def _create_patients(session, details):
+    user = session.query(User).first()
+    center = session.query(Center).first()
+
+    patients = [Patient(name=name, address=address, gender='M', center=center, created_by=user, updated_by=user)
+                for (name, address) in details]
+    session.add_all(patients)
+    session.commit()
+
+    return patients
+
+
+def test_python_search_applies_filters_first(database_session, monkeypatch):
+    monkeypatch.setattr(search, 'PYTHON_SEARCH_MAX_RESULTS', 1)
+    current_app.search_backend = search.find_backend('python', database_session.get_bind())
+    _create_patients(database_session, [('Juma Hassan', 'Muheza'), ('Juma Hassani', 'Korogwe')])
+
+    # The closer match in another center would otherwise take the only place
+    query = database_session.query(Patient).filter(Patient.address == 'Korogwe')
+    assert [p.name for p in current_app.search_backend.search(query, dict(name='juma hassan')).all()] == \
+        ['Juma Hassani']
+
+
+def test_fts5_index_created_on_existing_database(database_session):
+    if not search.fts5_available():
+        pytest.skip('SQLite FTS5 trigram tokenizer is not available.')
+
+    _create_patients(database_session, [('Juma Hassan', 'Muheza')])
+    database_session.execute('DROP TABLE {}'.format(search.FTS5_TABLE))
+    database_session.commit()
+
+    current_app.search_backend = search.find_backend('fts5', database_session.get_bind())
+    assert _names(database_session, name='hassan') == ['Juma Hassan']
+    _create_patients(database_session, [('Neema Hassan', 'Moshi')])
+    assert _names(database_session, name='hassan') == ['Juma Hassan', 'Neema Hassan']
+
+
+def test_ngram_search_before_reindex(database_session):
+    _create_patients(database_session, [('Juma Hassan', 'Muheza')])
+    database_session.query(PatientSearchGram).delete()
+    database_session.commit()
+
+    current_app.search_backend = search.find_backend('ngram', database_session.get_bind())
+    assert _names(database_session, name='hassan', address='muh') == ['Juma Hassan']
+
+    admin_command.execute(current_app, 'reindex_search')
+    assert database_session.query(PatientSearchGram).count() > 0
+    assert _names(database_session, name='hassan') == ['Juma Hassan']
@@ -0,0 +1,40 @@
+import datetime
+
+from app.models import Patient, InguinalMeshHerniaRepair
+from app.tests import test_data
+from app.util import restful
+from app.util.serializer import Serializer, serializer
+
+
+def test_serializer_instances_and_rows(database_session):
+    patient = test_data.create_patient(database_session, 'Serialized Patient')
+    repair = test_data.create_repair(database_session, patient, datetime.date(2020, 1, 2))
+    database_session.commit()
+
+    s = serializer(InguinalMeshHerniaRepair)
+    d = s.instance(repair)
+    assert d['id'] == repair.id
+    assert d['patient_id'] == patient.id
+    assert d['date'] == '2020-01-02'
+    assert d['cepod'] == 'Cepod.Planned'
+    assert d['updated_at'] == repair.updated_at.isoformat()
+
+    # The row fast path gives the same result without loading any ORM objects
+    rows = s.query(database_session).filter(InguinalMeshHerniaRepair.id == repair.id).all()
+    assert s.rows(rows) == [d]
+
+    # And the encoding matches CustomJSONEncoder's
+    assert restful.json_dumps(repair.as_dict()) == restful.json_dumps(d)
+
+
+def test_serializer_selected_columns(database_session):
+    patient = test_data.create_patient(database_session, 'Selected Patient')
+    database_session.commit()
+
+    table = Patient.__table__
+    selected = [table.c.id, table.c.dob, table.c.name]
+    s = Serializer([table.c.name, table.c.id], selected=selected)
+
+    assert s.rows(database_session.query(*selected).filter(table.c.id == patient.id)) == \
+        [dict(name='Selected Patient', id=patient.id)]
+    assert s.row((patient.id, None, 'Selected Patient')) == dict(name='Selected Patient', id=patient.id)
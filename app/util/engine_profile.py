@@ -0,0 +1,135 @@
+import logging
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+# Applied to every connection of a SQLite file database, for when the registry runs as a single node: WAL lets
+# readers carry on while another process writes, and the busy timeout waits out a writer rather than failing.
+SQLITE_PRAGMAS = ('journal_mode=WAL', 'synchronous=NORMAL', 'busy_timeout=5000', 'temp_store=MEMORY')
+
+# The connect_args each driver takes its connection timeout as
+CONNECT_TIMEOUT_ARGS = {
+    'mysqlconnector': 'connection_timeout',
+    'pymysql': 'connect_timeout',
+    'mysqldb': 'connect_timeout',
+    'psycopg2': 'connect_timeout',
+}
+
+
+def engine_options(sa_url, config):
+    """The create_engine options for a database server, sized for the worker model: each of the WEB_THREADS
+    request threads and each JOB_WORKERS job needs a connection, with half as many again as overflow. With
+    DB_MAX_CONNECTIONS set, the WEB_CONCURRENCY worker processes share it between them.
+
+    Connections are pinged before use, as after a failover or an idle period they may have been closed by the
+    server, and a checkout gives up after DB_POOL_TIMEOUT seconds, well inside gunicorn's worker timeout. SQLite
+    keeps the pool Flask-SQLAlchemy chooses for it.
+    """
+    if sa_url.get_backend_name() == 'sqlite':
+        return {}
+
+    workers = max(1, config['WEB_CONCURRENCY'])
+    pool_size = config['DB_POOL_SIZE'] or max(1, config['WEB_THREADS']) + config['JOB_WORKERS']
+    max_overflow = config['DB_MAX_OVERFLOW'] if config['DB_MAX_OVERFLOW'] is not None else max(1, pool_size // 2)
+
+    if config['DB_MAX_CONNECTIONS']:
+        per_worker = max(1, config['DB_MAX_CONNECTIONS'] // workers)
+        if pool_size > per_worker:
+            logging.warning('{} connections per worker process is fewer than the pool size of {}.'.format(
+                per_worker, pool_size))
+        pool_size = min(pool_size, per_worker)
+        max_overflow = min(max_overflow, per_worker - pool_size)
+
+    logging.info('Connection pool of {} and overflow {} in each of {} worker processes.'.format(
+        pool_size, max_overflow, workers))
+
+    options = dict(poolclass=InstrumentedQueuePool, pool_size=pool_size, max_overflow=max_overflow,
+                   pool_timeout=config['DB_POOL_TIMEOUT'], pool_recycle=config['DB_POOL_RECYCLE'],
+                   pool_pre_ping=True)
+
+    timeout_arg = CONNECT_TIMEOUT_ARGS.get(sa_url.get_driver_name())
+    if timeout_arg:
+        options['connect_args'] = {timeout_arg: config['DB_CONNECT_TIMEOUT']}
+
+    return options
+
+
+def configure(engine):
+    if engine.dialect.name == 'sqlite' and engine.url.database not in (None, '', ':memory:'):
+        event.listen(engine, 'connect', _set_sqlite_pragmas)
+
+
+def pool_status(pool):
+    """The pool's current use and, for an InstrumentedQueuePool, how long checkouts have waited for a connection."""
+    status = dict(pool=type(pool).__name__)
+    if not isinstance(pool, QueuePool):
+        return status
+
+    # A negative overflow means the pool has no limit
+    capacity = pool.size() + pool._max_overflow if pool._max_overflow >= 0 else None
+    status.update(size=pool.size(), checked_out=pool.checkedout(), overflow=pool.overflow(), capacity=capacity,
+                  saturation=pool.checkedout() / capacity if capacity else 0.0)
+
+    stats = getattr(pool, 'stats', None)
+    if stats is not None:
+        status.update(stats.as_dict())
+
+    return status
+
+
+class PoolStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def record(self, wait, timed_out=False):
+        with self._lock:
+            self.checkouts += 1
+            self.timeouts += timed_out
+            self.wait_seconds += wait
+            self.max_wait_seconds = max(self.max_wait_seconds, wait)
+
+    def as_dict(self):
+        with self._lock:
+            return dict(checkouts=self.checkouts, timeouts=self.timeouts, wait_seconds=self.wait_seconds,
+                        max_wait_seconds=self.max_wait_seconds)
+
+
+class InstrumentedQueuePool(QueuePool):
+    """A QueuePool that records how long each checkout waited for a connection, which grows as the pool
+    saturates."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.stats.record(time.perf_counter() - start, timed_out=True)
+            raise
+
+        self.stats.record(time.perf_counter() - start)
+        return connection
+
+    def recreate(self):
+        # Disposing of an engine recreates its pool, which keeps counting from where it was
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute('PRAGMA ' + pragma)
+    finally:
+        cursor.close()
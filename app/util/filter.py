@@ -1,4 +1,4 @@
-from sqlalchemy import and_
+from sqlalchemy import and_, or_
 
 
 def like_all(d):
@@ -19,3 +19,17 @@ def like_append(filter, column, value):
                 filter.append(column.like('%' + s + '%'))
             except AttributeError:
                 pass
+
+
+def keyset_after(columns, values):
+    """Filter for the rows that sort after values when ordered by columns (all ascending), for keyset pagination.
+
+    Expanded into OR'd equalities rather than a row value comparison so that every database can use an index on
+    the columns.
+    """
+    clauses = []
+    for i, (column, value) in enumerate(zip(columns, values)):
+        equal = [c == v for (c, v) in zip(columns[:i], values[:i])]
+        clauses.append(and_(*equal, column > value))
+
+    return or_(*clauses)
@@ -45,5 +45,16 @@ def coerce_for_bool():
 
 
 
+def filter_for_id():
+    """Turns an id posted as a string into an int, leaving anything else for the field's validators to reject."""
+    def filter(value):
+        if isinstance(value, str) and value.strip().isdigit():
+            return int(value)
+
+        return value
+
+    return filter
+
+
 def choice_for_bool():
     return [(True, 'True'), (False, 'False')]
@@ -0,0 +1,62 @@
+import re
+
+COUNTRY_CODE = '255'
+NATIONAL_NUMBER_LENGTH = 9
+
+_NON_DIGITS = re.compile(r'\D')
+
+
+def normalise(number):
+    """Canonicalise a phone number, returning None if it has no digits.
+
+    Tanzanian numbers in national (0712 345 678), international (255 712 345 678, 00255...) or bare (712345678)
+    form become +255712345678. Numbers given with an explicit + or 00 prefix keep their country code. Anything
+    else is reduced to its digits.
+    """
+    if number is None:
+        return None
+
+    s = str(number).strip()
+    digits = _NON_DIGITS.sub('', s)
+    if len(digits) == 0:
+        return None
+
+    if s.startswith('+'):
+        return '+' + digits
+    elif digits.startswith('00'):
+        return '+' + digits[2:]
+    elif digits.startswith(COUNTRY_CODE) and len(digits) == len(COUNTRY_CODE) + NATIONAL_NUMBER_LENGTH:
+        return '+' + digits
+    elif digits.startswith('0') and len(digits) == NATIONAL_NUMBER_LENGTH + 1:
+        return '+' + COUNTRY_CODE + digits[1:]
+    elif len(digits) == NATIONAL_NUMBER_LENGTH:
+        return '+' + COUNTRY_CODE + digits
+
+    return digits
+
+
+def is_complete(number):
+    return number is not None and number.startswith('+' + COUNTRY_CODE) and \
+           len(number) == len(COUNTRY_CODE) + NATIONAL_NUMBER_LENGTH + 1
+
+
+def national_prefix(text):
+    """Converts a partially typed number in national (0...) or international (+...) form to a prefix of the
+    canonical number, or returns None if the text is not in either form."""
+    s = str(text or '').strip()
+    digits = _NON_DIGITS.sub('', s)
+    if len(digits) == 0:
+        return None
+
+    if s.startswith('+'):
+        return '+' + digits
+    elif digits.startswith('00'):
+        return '+' + digits[2:]
+    elif digits.startswith('0'):
+        return '+' + COUNTRY_CODE + digits[1:]
+
+    return None
+
+
+def reversed_digits(number):
+    return _NON_DIGITS.sub('', number or '')[::-1]
@@ -1,9 +1,12 @@
 import datetime
 import enum
+import functools
 import json
 import re
 import uuid
 
+import sqlalchemy
+
 
 def all_as_dict(iterable):
     result = {}
@@ -31,7 +34,16 @@ def json_dumps(data):
     return json.dumps(data, cls=CustomJSONEncoder)
 
 
-def json_loads(s):
+def json_loads(s, schema=None):
+    """Decodes s, converting dates, datetimes and enums back to Python values.
+
+    Without a schema any string that looks like an ISO date or a known enum is converted. With a schema, a model
+    class or a list of them, only the values of their Date, DateTime and Enum columns are, which is both faster and
+    cannot mistake free text for a date.
+    """
+    if schema is not None:
+        return json.loads(s, cls=SchemaJSONDecoder, schema=schema)
+
     return json.loads(s, cls=CustomJSONDecoder)
 
 
@@ -49,44 +61,124 @@ class CustomJSONEncoder(json.JSONEncoder):
         return json.JSONEncoder.default(self, obj)
 
 
+# Checked before trying a conversion, so that ordinary strings never go through a failed parse
+ISO_DATE_REGEX = re.compile(r'^\d{4}-\d{2}-\d{2}([T ]\d{2}:\d{2}(:\d{2}(\.\d{1,6})?)?([+-]\d{2}:\d{2})?)?$')
+ENUM_REGEX = re.compile(r'^([A-Z][a-zA-Z]*)\.([A-Za-z][A-Za-z0-9_]*)$')
+
+
 class CustomJSONDecoder(json.JSONDecoder):
     def __init__(self, *args, **kwargs):
         json.JSONDecoder.__init__(self, object_hook=self.object_hook)  # , *args, **kwargs)
-        self.enum_regex = re.compile(r"^([A-Z][a-zA-Z]*)\.([A-Z][a-zA-Z]*)$")
-        self.enum_module = 'app.models'
 
     def object_hook(self, source):
         for k, v in source.items():
             if isinstance(v, str):
-                try:
-                    d = datetime.datetime.fromisoformat(str(v))
-                    if d.hour == 0 and d.minute == 0 and d.second == 0 and d.microsecond == 0:
-                        d = datetime.date(d.year, d.month, d.day)
-                    source[k] = d
-
-                    continue
-                except:
-                    pass
-
-                try:
-                    source[k] = self.parse_enum(str(v))
-                    continue
-                except:
-                    pass
+                if ISO_DATE_REGEX.match(v):
+                    d = parse_iso_datetime(v)
+                    if d is not None:
+                        if d.hour == 0 and d.minute == 0 and d.second == 0 and d.microsecond == 0:
+                            d = datetime.date(d.year, d.month, d.day)
+                        source[k] = d
+
+                elif ENUM_REGEX.match(v):
+                    e = known_enum_values().get(v)
+                    if e is not None:
+                        source[k] = e
 
         return source
 
     def parse_enum(self, v):
-        match = self.enum_regex.match(v)
-        if match:
-            enum_name = match.group(1)
-            enum_value = match.group(2)
-            return self.find_enum(self.enum_module, enum_name, enum_value)
-
-        raise ValueError('{} is not a known enum value!'.format(v))
-
-    @staticmethod
-    def find_enum(module, enum_name, enum_value):
-        mod = __import__(module, fromlist=[enum_name])
-        klass = getattr(mod, enum_name)
-        return klass[enum_value]
+        e = known_enum_values().get(v) if ENUM_REGEX.match(v) else None
+        if e is None:
+            raise ValueError('{} is not a known enum value!'.format(v))
+
+        return e
+
+
+class SchemaJSONDecoder(json.JSONDecoder):
+    """Converts only the values whose keys are Date, DateTime or Enum columns of the schema's models."""
+
+    def __init__(self, *args, schema=None, **kwargs):
+        json.JSONDecoder.__init__(self, object_hook=self.object_hook)
+        self.converters = column_converters(tuple(schema) if isinstance(schema, (list, tuple)) else (schema,))
+
+    def object_hook(self, source):
+        converters = self.converters
+        for k, v in source.items():
+            if isinstance(v, str):
+                convert = converters.get(k)
+                if convert:
+                    source[k] = convert(v)
+
+        return source
+
+
+@functools.lru_cache(maxsize=None)
+def column_converters(models):
+    """Maps each Date, DateTime and Enum column name of the models to a function converting its JSON string."""
+    converters = {}
+    for model in models:
+        for column in sqlalchemy.inspect(model).columns:
+            convert = _converter(column.type)
+            if convert is None:
+                continue
+
+            if converters.get(column.name, convert) != convert:
+                raise ValueError('Column {} has different types in {}.'.format(column.name, models))
+            converters[column.name] = convert
+
+    return converters
+
+
+def _converter(column_type):
+    if isinstance(column_type, sqlalchemy.DateTime):
+        return datetime.datetime.fromisoformat
+    elif isinstance(column_type, sqlalchemy.Date):
+        return _parse_date
+    elif isinstance(column_type, sqlalchemy.Enum) and column_type.enum_class is not None:
+        return _enum_converter(column_type.enum_class)
+
+    return None
+
+
+def _parse_date(v):
+    # Dates encode as YYYY-MM-DD but accept a datetime with a zero time, as written by older clients
+    return datetime.date.fromisoformat(v) if len(v) == 10 else datetime.datetime.fromisoformat(v).date()
+
+
+@functools.lru_cache(maxsize=None)
+def _enum_converter(enum_class):
+    # Enums encode as str(member), i.e. Class.Member; the bare member name is accepted too
+    values = {str(e): e for e in enum_class}
+    values.update({e.name: e for e in enum_class})
+
+    def convert(v):
+        e = values.get(v)
+        if e is None:
+            raise ValueError('{} is not a {} value!'.format(v, enum_class.__name__))
+
+        return e
+
+    return convert
+
+
+def parse_iso_datetime(v):
+    # The regex rules out all but out of range values such as 2020-02-30
+    try:
+        return datetime.datetime.fromisoformat(v)
+    except ValueError:
+        return None
+
+
+@functools.lru_cache(maxsize=None)
+def known_enum_values():
+    # Imported here rather than at the top as the models module depends on the application being set up
+    from app.models import KNOWN_ENUMS
+
+    values = {}
+    for (name, enum_class) in KNOWN_ENUMS.items():
+        for e in enum_class:
+            values['{}.{}'.format(name, e.name)] = e
+            values[str(e)] = e
+
+    return values
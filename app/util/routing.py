@@ -0,0 +1,35 @@
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import orm
+
+from app.util import engine_profile
+
+# Set in session.info to let a session outside a read-only view, such as a reporting job's, read from the replica
+READ_REPLICA_KEY = 'read_replica'
+
+
+class RoutingSession(SignallingSession):
+    """Sends reads to the read replica when the application's replica_router allows it. A flush, and any read while
+    the session has changes to flush, always goes to the primary."""
+
+    def get_bind(self, mapper=None, clause=None):
+        router = getattr(self.app, 'replica_router', None)
+        if router is not None and not self._flushing and self._is_clean() and router.use_replica(self):
+            return router.engine
+
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy with RoutingSessions, and engines set up by engine_profile."""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        super().apply_driver_hacks(app, sa_url, options)
+        options.update(engine_profile.engine_options(sa_url, app.config))
+
+    def create_engine(self, sa_url, engine_opts):
+        engine = super().create_engine(sa_url, engine_opts)
+        engine_profile.configure(engine)
+        return engine
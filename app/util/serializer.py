@@ -0,0 +1,91 @@
+import datetime
+import functools
+import operator
+
+import sqlalchemy
+
+
+class Serializer:
+    """Turns model instances or result rows into dicts keyed by column name.
+
+    Everything that does not depend on the values - the names, how to read each value and how to encode dates and
+    enums - is worked out once, when the serializer is built. With encode the values are made JSON ready (ISO dates,
+    enums as Class.Member strings, as CustomJSONEncoder writes them), otherwise they are returned as read.
+
+    rows() is the fast path: it reads plain result rows, such as those of session.query(*serializer.columns), so no
+    ORM objects are built at all. If the rows come from a wider select, pass its columns as selected and each
+    serializer picks its own columns out of them by position.
+    """
+
+    def __init__(self, columns, keys=None, selected=None, encode=True):
+        self.columns = tuple(columns)
+        self.names = tuple(c.name for c in self.columns)
+
+        self.encoders = tuple((c.name, e) for c in self.columns for e in [_encoder(c.type)] if e) if encode else ()
+        self.get_attributes = _getter(operator.attrgetter, keys) if keys else None
+        self.get_values = _getter(operator.itemgetter, [_position(selected, c) for c in self.columns]) \
+            if selected is not None else None
+
+    def instance(self, instance):
+        return self._dict(self.get_attributes(instance))
+
+    def instances(self, instances):
+        get_attributes = self.get_attributes
+        return [self._dict(get_attributes(i)) for i in instances]
+
+    def row(self, row):
+        return self._dict(self.get_values(row) if self.get_values else row)
+
+    def rows(self, rows):
+        if self.get_values:
+            get_values = self.get_values
+            return [self._dict(get_values(row)) for row in rows]
+
+        return [self._dict(row) for row in rows]
+
+    def query(self, session):
+        return session.query(*self.columns)
+
+    def _dict(self, values):
+        d = dict(zip(self.names, values))
+        for (name, encode) in self.encoders:
+            v = d[name]
+            if v is not None:
+                d[name] = encode(v)
+
+        return d
+
+
+@functools.lru_cache(maxsize=None)
+def serializer(model, encode=True):
+    """The Serializer of every column of model, including those it inherits."""
+    properties = sqlalchemy.inspect(model).column_attrs
+    return Serializer([p.columns[0] for p in properties], keys=[p.key for p in properties], encode=encode)
+
+
+def _getter(getter, items):
+    # The operator getters return a bare value rather than a tuple for a single item
+    if len(items) == 1:
+        get = getter(items[0])
+        return lambda o: (get(o),)
+
+    return getter(*items)
+
+
+def _position(selected, column):
+    for (i, c) in enumerate(selected):
+        if c is column:
+            return i
+
+    raise ValueError('Column {} is not selected.'.format(column))
+
+
+def _encoder(column_type):
+    if isinstance(column_type, sqlalchemy.DateTime):
+        return datetime.datetime.isoformat
+    elif isinstance(column_type, sqlalchemy.Date):
+        return datetime.date.isoformat
+    elif isinstance(column_type, sqlalchemy.Enum) and column_type.enum_class is not None:
+        return {e: str(e) for e in column_type.enum_class}.__getitem__
+
+    return None
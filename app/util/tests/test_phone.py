@@ -0,0 +1,34 @@
+from app.util import phone
+
+
+def test_normalise():
+    assert phone.normalise('0712 345 678') == '+255712345678'
+    assert phone.normalise('(0712) 345-678') == '+255712345678'
+    assert phone.normalise('255712345678') == '+255712345678'
+    assert phone.normalise('00255 712 345 678') == '+255712345678'
+    assert phone.normalise('712345678') == '+255712345678'
+    assert phone.normalise('+44 20 7946 0000') == '+442079460000'
+    assert phone.normalise('5678') == '5678'
+
+    assert phone.normalise(None) is None
+    assert phone.normalise('') is None
+    assert phone.normalise('n/a') is None
+
+
+def test_is_complete():
+    assert phone.is_complete('+255712345678')
+    assert not phone.is_complete('+25571234')
+    assert not phone.is_complete('5678')
+    assert not phone.is_complete(None)
+
+
+def test_national_prefix():
+    assert phone.national_prefix('0712 34') == '+25571234'
+    assert phone.national_prefix('+2557') == '+2557'
+    assert phone.national_prefix('5678') is None
+    assert phone.national_prefix('') is None
+
+
+def test_reversed_digits():
+    assert phone.reversed_digits('+255712345678') == '876543217552'
+    assert phone.reversed_digits(None) == ''
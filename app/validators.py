@@ -2,8 +2,27 @@ from datetime import date
 
 from wtforms import ValidationError
 
-from app.models import Pain
+from app.models import Pain, Patient
 from app.util.strtobool import strtobool_optional
+from application import db
+
+
+def validate_patient_id(form, field):
+    try:
+        patient_id = int(field.data)
+    except (TypeError, ValueError):
+        raise ValidationError('A patient must be selected.')
+
+    if db.session.query(Patient.id).filter(Patient.id == patient_id).first() is None:
+        raise ValidationError('Unable to find a patient with id {}.'.format(patient_id))
+
+
+def validate_age_to(form, field):
+    if form.age.data is None:
+        raise ValidationError('An age must be given to search an age range.')
+
+    if field.data < form.age.data:
+        raise ValidationError('Must be at least the age.')
 
 
 def validate_pain_comments(form, field):
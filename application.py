@@ -1,16 +1,18 @@
+import importlib
 import logging
 import os
+import sys
 import tempfile
 
 from flask import Flask
 from flask_login import LoginManager
-from flask_sqlalchemy import SQLAlchemy
 
 from app import formatters
 from app.util import pwd_generator, strtobool
+from app.util.routing import RoutingSQLAlchemy
 from app.util.strtobool import strtobool
 
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 login = LoginManager()
 
 LOG_FORMAT = '%(asctime)-15s [%(levelname)s] %(message)s'
@@ -48,15 +50,38 @@ def create_app(unit_test=False):
 
     logging.info('Initalising SQLAlchemy with database URL {}'.format(database_url))
 
+    # A read replica is only used outside the unit tests, which set one up themselves
+    read_url = None if unit_test else os.environ.get('RDS_READ_URL')
+
     app.config.from_mapping(
         SECRET_KEY=os.environ.get('SECRET_KEY') or pwd_generator.password(),
         TESTING=unit_test,
         SQLALCHEMY_DATABASE_URI=database_url,
-        SQLALCHEMY_POOL_RECYCLE=280,
         SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        SQLALCHEMY_BINDS={'replica': read_url} if read_url else {},
+        WEB_CONCURRENCY=int(os.environ.get('WEB_CONCURRENCY', 1)),
+        WEB_THREADS=int(os.environ.get('WEB_THREADS', 1)),
+        DB_POOL_SIZE=int(os.environ.get('DB_POOL_SIZE', 0)),
+        DB_MAX_OVERFLOW=int(os.environ['DB_MAX_OVERFLOW']) if 'DB_MAX_OVERFLOW' in os.environ else None,
+        DB_MAX_CONNECTIONS=int(os.environ.get('DB_MAX_CONNECTIONS', 0)),
+        DB_POOL_TIMEOUT=int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        DB_POOL_RECYCLE=int(os.environ.get('DB_POOL_RECYCLE', 280)),
+        DB_CONNECT_TIMEOUT=int(os.environ.get('DB_CONNECT_TIMEOUT', 10)),
+        REPLICA_MAX_LAG_SECONDS=int(os.environ.get('REPLICA_MAX_LAG_SECONDS', 30)),
+        REPLICA_LAG_CHECK_SECONDS=int(os.environ.get('REPLICA_LAG_CHECK_SECONDS', 5)),
+        REPLICA_READ_AFTER_WRITE_SECONDS=int(os.environ.get('REPLICA_READ_AFTER_WRITE_SECONDS', 60)),
         WTF_CSRF_ENABLED=not unit_test,
         DEFAULT_TEST_ACCOUNT_LOGIN=bool(strtobool(os.environ.get('DEFAULT_TEST_ACCOUNT_LOGIN', 'False'))),
-        MINIMUM_PASSWORD_STRENGTH=0.3
+        MINIMUM_PASSWORD_STRENGTH=0.3,
+        REFERENCE_CACHE_TTL=int(os.environ.get('REFERENCE_CACHE_TTL', 60)),
+        SEARCH_BACKEND=os.environ.get('SEARCH_BACKEND', 'auto'),
+        JOBS_DIR=os.environ.get('JOBS_DIR', os.path.join(tempfile.gettempdir(), 'registry-jobs')),
+        JOB_WORKERS=0 if unit_test else int(os.environ.get('JOB_WORKERS', 2)),
+        JOB_HEARTBEAT_SECONDS=int(os.environ.get('JOB_HEARTBEAT_SECONDS', 30)),
+        REPLICATION_NODE=os.environ.get('REPLICATION_NODE', 'edge'),
+        REPLICATION_OUTBOX=os.environ.get('REPLICATION_OUTBOX',
+                                          os.path.join(tempfile.gettempdir(), 'registry-replication')),
+        REPLICATION_TARGET_URL=os.environ.get('REPLICATION_TARGET_URL'),
     )
 
     # Initialize Plugins
@@ -70,11 +95,33 @@ def create_app(unit_test=False):
     # Register custom formattters
     app.jinja_env.filters['datetime'] = formatters.format_datetime
 
+    # Per-route request, SQL and template timings for /metrics
+    from app import metrics
+    metrics.init_app(app)
+
     # Set custom JSON Encode
     # app.json_encoder = CustomJSONEncoder()
 
     with app.app_context():
-        from app import routes
+        from app.route_helper.reference_cache import ReferenceCache
+        app.reference_cache = ReferenceCache(ttl=app.config['REFERENCE_CACHE_TTL'])
+
+        from app import search
+        app.search_backend = search.find_backend(app.config['SEARCH_BACKEND'], db.engine)
+
+        from app import replica
+        replica.init_app(app)
+
+        from app.jobs import JobRunner
+        app.job_runner = JobRunner(app, app.config['JOBS_DIR'], app.config['JOB_WORKERS'],
+                                   app.config['JOB_HEARTBEAT_SECONDS'])
+
+        # Routes register themselves against current_app on import, so re-import them for each new app.
+        for name in ['app.routes', 'app.api']:
+            if name in sys.modules:
+                importlib.reload(sys.modules[name])
+            else:
+                importlib.import_module(name)
 
     return app
 
@@ -0,0 +1,57 @@
+"""Compares ways of serialising Patients to JSON on an in-memory database.
+
+    python benchmark_serializer.py [rows]
+"""
+import json
+import sys
+import time
+from datetime import date, datetime
+
+from app import base_data
+from app.tests import test_data
+from app.util import restful
+from application import create_app
+
+
+def main(count):
+    application = create_app(unit_test=True)
+    with application.app_context():
+        from app.models import Patient, User, Center
+        from app.util.serializer import serializer
+
+        session = application.db.session
+        application.db.create_all()
+        base_data.create(session)
+        test_data.create_test_user(session)
+
+        user = session.query(User).first()
+        center = session.query(Center).first()
+        now = datetime.now()
+        session.execute(Patient.__table__.insert(), [
+            dict(version_id=1, name='Patient {}'.format(i), gender='F', dob=date(1950 + i % 50, 1, 1),
+                 dob_year=1950 + i % 50, address='{} Some Street'.format(i), center_id=center.id,
+                 created_at=now, created_by_id=user.id, updated_at=now, updated_by_id=user.id)
+            for i in range(count)])
+        session.commit()
+
+        def as_dict(patient):
+            # ExtendedBase.as_dict as it was before the compiled serializer
+            return {c.name: getattr(patient, c.name) for c in patient.__table__.columns}
+
+        s = serializer(Patient)
+        benchmarks = [
+            ('ORM objects, as_dict per column', lambda: restful.json_dumps([as_dict(p) for p in
+                                                                             session.query(Patient)])),
+            ('ORM objects, compiled serializer', lambda: json.dumps(s.instances(session.query(Patient)))),
+            ('Row tuples, compiled serializer', lambda: json.dumps(s.rows(s.query(session)))),
+        ]
+
+        for (name, benchmark) in benchmarks:
+            session.expunge_all()
+            start = time.perf_counter()
+            size = len(benchmark())
+            print('{:<36} {:>7.2f}s {:>12,} bytes'.format(name, time.perf_counter() - start, size))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
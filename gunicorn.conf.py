@@ -0,0 +1,5 @@
+import os
+
+# Read by application.create_app too, which sizes each worker's connection pool to match
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+threads = int(os.environ.get('WEB_THREADS', 1))
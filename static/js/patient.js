@@ -1,12 +1,20 @@
 document.addEventListener("DOMContentLoaded", function (event) {
-    $('.card-event-body').each(function f(i, v) {
-            id = v.id.split('_').slice(-1).pop();
-            url = '/event_inline/' + id
-            $('#' + v.id).load(url);
-        }
-    );
+    var ids = $('.card-event-body').map(function (i, v) {
+        return v.id.split('_').slice(-1).pop();
+    }).get();
 
-    $('#spinner').hide();
+    if (ids.length === 0) {
+        $('#spinner').hide();
+        return;
+    }
+
+    $.getJSON('/event_inline/batch', {ids: ids.join(',')}, function (bodies) {
+        $.each(bodies, function (id, body) {
+            $('#card_event_body_' + id).html(body);
+        });
+    }).always(function () {
+        $('#spinner').hide();
+    });
 });
 
 $('#birth_year').bind('change', function () {
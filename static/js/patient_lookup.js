@@ -0,0 +1,34 @@
+document.addEventListener("DOMContentLoaded", function (event) {
+    if ($('#patient_lookup').prop('readonly')) {
+        return;
+    }
+
+    patients = new Bloodhound({
+        datumTokenizer: Bloodhound.tokenizers.obj.whitespace('name'),
+        queryTokenizer: Bloodhound.tokenizers.whitespace,
+        remote: {
+            url: '/patient_lookup?q=%QUERY',
+            wildcard: '%QUERY',
+            transform: function (response) {
+                return response.results;
+            }
+        }
+    });
+
+    $('#patient_lookup').typeahead({minLength: 1, highlight: true}, {
+        name: 'patients',
+        display: 'name',
+        limit: 20,
+        source: patients,
+        templates: {
+            suggestion: function (patient) {
+                details = [patient.national_id, patient.hospital_number].filter(Boolean).join(' / ');
+                return $('<div/>').text(patient.name + (details ? ' (' + details + ')' : ''));
+            }
+        }
+    }).bind('typeahead:select', function (e, patient) {
+        $('#patient_id').val(patient.id);
+    }).bind('input', function () {
+        $('#patient_id').val('');
+    });
+});